@@ -0,0 +1,98 @@
+"""
+ASGI config for avrit_backend project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP requests go to Django, with /graphql served by the async view (see
+``GRAPHQL_ASYNC``); websocket connections to /graphql serve GraphQL
+subscriptions. Run it with any ASGI server, e.g.
+``uvicorn avrit_backend.asgi:application``.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler as BaseASGIHandler
+from django.db import connections
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'avrit_backend.settings')
+os.environ.setdefault('GRAPHQL_ASYNC', '1')
+
+
+def _next_part(parts):
+    return next(parts, None)
+
+
+def _close_connections():
+    connections.close_all()
+
+
+class ASGIHandler(BaseASGIHandler):
+    """Django's handler, but streaming bodies are read on a thread of their own.
+
+    Django 3.2 iterates streaming responses on the event loop, where a
+    generator that reads the database (``review.export``) fails and any
+    slow one blocks every connection. Each streaming response gets one
+    thread, so a server-side cursor stays on one database connection.
+    """
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super(ASGIHandler, self).send_response(response, send)
+        headers = [
+            (header.encode('ascii') if isinstance(header, str) else header,
+             value.encode('latin1') if isinstance(value, str) else value)
+            for header, value in response.items()
+        ]
+        headers.extend(
+            (b'Set-Cookie', cookie.output(header='').encode('ascii').strip()) for cookie in response.cookies.values()
+        )
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='avrit-streaming')
+        try:
+            parts = iter(response)
+            read = sync_to_async(_next_part, thread_sensitive=False, executor=executor)
+            part = await read(parts)
+            while part is not None:
+                for chunk, _ in self.chunk_bytes(part):
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                part = await read(parts)
+            await send({'type': 'http.response.body'})
+        finally:
+            await sync_to_async(response.close, thread_sensitive=False, executor=executor)()
+            await sync_to_async(_close_connections, thread_sensitive=False, executor=executor)()
+            executor.shutdown(wait=False)
+
+
+django.setup(set_prefix=False)
+django_application = ASGIHandler()
+
+from avrit_backend.subscriptions import GraphQLWebSocketApplication  # noqa: E402
+
+websocket_application = GraphQLWebSocketApplication()
+WEBSOCKET_PATHS = ('/graphql', '/graphql/')
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http':
+        await django_application(scope, receive, send)
+    elif scope['type'] == 'websocket':
+        if scope['path'] in WEBSOCKET_PATHS:
+            await websocket_application(scope, receive, send)
+        else:
+            await receive()
+            await send({'type': 'websocket.close', 'code': 1000})
+    elif scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+from avrit_backend.startup import preload, startup_setting  # noqa: E402
+
+if startup_setting('PRELOAD'):
+    preload()
@@ -0,0 +1,166 @@
+"""Authentication helpers.
+
+``CachedJSONWebTokenBackend`` replaces graphql_jwt's backend. A token's
+verified payload is cached under the token's sha256 until the token expires,
+and users are cached by primary key for ``USER_TIMEOUT`` seconds, dropped
+whenever the ``UserProfile`` is saved or deleted or its groups or
+permissions change. A request with a known token therefore authenticates
+without decoding or any SQL.
+
+Only ``USER_FIELDS`` are cached, never the password hash; a cached user
+loads any other field from the database when it is read.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.contrib.auth import authenticate, get_user_model
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+from graphql_jwt.backends import JSONWebTokenBackend
+from graphql_jwt.exceptions import JSONWebTokenError
+from graphql_jwt.settings import jwt_settings
+from graphql_jwt.utils import get_credentials, get_payload
+
+DEFAULTS = {
+    'CACHE': 'default',
+    'TOKEN_TIMEOUT': 60 * 60,
+    'USER_TIMEOUT': 60,
+}
+USER_FIELDS = ('id', 'email', 'name', 'is_active', 'is_staff', 'is_superuser')
+
+
+def auth_cache_setting(name):
+    return getattr(settings, 'AUTH_CACHE', {}).get(name, DEFAULTS[name])
+
+
+def get_cache():
+    return caches[auth_cache_setting('CACHE')]
+
+
+def _token_key(token):
+    return 'jwt-payload:' + hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def _username_key(username):
+    return 'auth-username:' + hashlib.sha256(str(username).encode('utf-8')).hexdigest()
+
+
+def _user_key(pk):
+    return 'auth-user:%s' % pk
+
+
+def _leeway():
+    leeway = jwt_settings.JWT_LEEWAY
+    return leeway.total_seconds() if hasattr(leeway, 'total_seconds') else leeway
+
+
+def forget_token(token):
+    get_cache().delete(_token_key(token))
+
+
+def get_verified_payload(token, context=None):
+    """Decode and verify ``token``, or return its cached payload."""
+    cache = get_cache()
+    key = _token_key(token)
+    payload = cache.get(key)
+    now = time.time()
+    if payload is not None:
+        exp = payload.get('exp')
+        if exp is None or not jwt_settings.JWT_VERIFY_EXPIRATION or exp + _leeway() > now:
+            return payload
+
+    payload = get_payload(token, context)
+    timeout = auth_cache_setting('TOKEN_TIMEOUT')
+    exp = payload.get('exp')
+    if exp is not None and jwt_settings.JWT_VERIFY_EXPIRATION:
+        timeout = min(timeout, exp + _leeway() - now)
+    if timeout > 0:
+        cache.set(key, payload, timeout)
+    return payload
+
+
+def get_cached_user(username):
+    cache = get_cache()
+    model = get_user_model()
+    pk = cache.get(_username_key(username))
+    values = cache.get(_user_key(pk)) if pk is not None else None
+    # The username may have moved to another user since it was cached.
+    if values is None or values[model.USERNAME_FIELD] != username:
+        user = jwt_settings.JWT_GET_USER_BY_NATURAL_KEY_HANDLER(username)
+        if user is None:
+            return None
+        values = {name: getattr(user, name) for name in USER_FIELDS}
+        timeout = auth_cache_setting('USER_TIMEOUT')
+        cache.set_many({_username_key(username): user.pk, _user_key(user.pk): values}, timeout)
+    # from_db takes the values in field order, deferring the fields left out.
+    names = [field.attname for field in model._meta.concrete_fields if field.attname in values]
+    return model.from_db(DEFAULT_DB_ALIAS, names, [values[name] for name in names])
+
+
+def _forget_users(pks):
+    get_cache().delete_many([_user_key(pk) for pk in pks])
+
+
+def forget_users(pks):
+    """Drop the users with ``pks`` from the user cache, now and once the current transaction commits.
+
+    Called when a ``UserProfile`` or its groups or permissions change.
+    """
+    pks = list(pks)
+    _forget_users(pks)
+    # A request may cache the old row again before the change commits.
+    transaction.on_commit(lambda: _forget_users(pks))
+
+
+def forget_user(user):
+    forget_users([user.pk])
+
+
+def get_token_user(token):
+    """The active user a JWT belongs to, or ``None`` if the token is not valid."""
+    try:
+        payload = get_verified_payload(token)
+    except JSONWebTokenError:
+        return None
+    username = jwt_settings.JWT_PAYLOAD_GET_USERNAME_HANDLER(payload)
+    user = get_cached_user(username) if username else None
+    if user is None or not getattr(user, 'is_active', True):
+        return None
+    return user
+
+
+class CachedJSONWebTokenBackend(JSONWebTokenBackend):
+    def authenticate(self, request=None, **kwargs):
+        if request is None or getattr(request, '_jwt_token_auth', False):
+            return None
+        token = get_credentials(request, **kwargs)
+        if token is None:
+            return None
+
+        payload = get_verified_payload(token, request)
+        username = jwt_settings.JWT_PAYLOAD_GET_USERNAME_HANDLER(payload)
+        if not username:
+            raise JSONWebTokenError('Invalid payload')
+        user = get_cached_user(username)
+        if user is not None and not getattr(user, 'is_active', True):
+            raise JSONWebTokenError('User is disabled')
+        return user
+
+
+def get_request_user(request):
+    """The user of a session or JWT (header or cookie) request, or ``None``.
+
+    A JWT user is stored on ``request.user`` so later checks, such as the
+    GraphQL JWT middleware, don't authenticate the request again.
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user
+    try:
+        user = authenticate(request=request)
+    except JSONWebTokenError:
+        return None
+    if user is not None:
+        request.user = user
+    return user
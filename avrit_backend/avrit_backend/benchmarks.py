@@ -0,0 +1,310 @@
+"""Benchmark suite for the GraphQL API.
+
+``generate`` fills the database with a reproducible data set of ``bench-*``
+users, profiles, posts, reviews, comments and uploads. ``run`` sends every
+query of ``CATALOG`` through the full Django stack with the test client. For
+each query it records latency percentiles, the SQL statement count and the
+peak Python memory allocated. ``compare`` checks the results against a
+stored baseline.
+
+Mutations run inside a transaction that is rolled back after every call, so
+repeated runs see the same data. Their ``on_commit`` hooks therefore don't
+run.
+"""
+import gc
+import random
+import time
+import tracemalloc
+from contextlib import ExitStack
+
+from django.contrib.auth.hashers import make_password
+from django.db import connections, transaction
+from django.test import Client
+from graphql_jwt.shortcuts import get_token
+from graphql_relay import to_global_id
+
+from avrit_backend.bulk import bulk_insert
+from profiles_api.models import ProfileDetails, UserProfile
+from review.models import Post, PostComment, PostUpload, Review, ReviewComment, ReviewUpload
+
+EMAIL = 'bench-%s@example.com'
+PASSWORD = 'benchmark'
+# The catalog's mutations act as these two users.
+MEMBER = EMAIL % 0
+NEWCOMER = EMAIL % 'newcomer'
+
+WORDS = (
+    'physics', 'chemistry', 'biology', 'genetics', 'ecology', 'algebra', 'topology', 'statistics',
+    'economics', 'linguistics', 'history', 'philosophy', 'neuroscience', 'astronomy', 'geology',
+    'robotics', 'compilers', 'databases', 'networks', 'cryptography', 'optics', 'thermodynamics',
+    'quantum', 'materials', 'climate', 'oceanography', 'epidemiology', 'immunology', 'psychology',
+    'sociology', 'archaeology', 'learning',
+)
+SUBMISSION_TYPES = [choice for choice, _ in Post._meta.get_field('type_of_submission').choices]
+
+# Dataset sizes, as accepted by generate().
+SCALE = {
+    'users': 200,
+    'posts': 1000,
+    'reviews_per_post': 3,
+    'comments_per_post': 2,
+    'comments_per_review': 1,
+    'uploads_per_post': 1,
+}
+
+POST_FIELDS = 'id title typeOfSubmission courseName subject reviewCount commentCount createdAt'
+PAGE_OF_POSTS = '''
+query ($order: String, $search: String) {
+  allPost(first: 20, orderBy: $order, search: $search) {
+    edges { cursor node { %s userProfile { name } } }
+    pageInfo { hasNextPage endCursor }
+  }
+}''' % POST_FIELDS
+POST_DETAIL = '''{
+  allPost(first: 10) {
+    edges { node {
+      %s
+      userProfile { name profiledetails { researchInterest } }
+      postUpload { description fileUpload size }
+      postcomments { comment createdAt }
+      reviews {
+        description createdAt userProfile { name }
+        reviewUpload { description fileUpload }
+        reviewcomments { comment }
+      }
+    } }
+  }
+}''' % POST_FIELDS
+PUBLIC_PROFILES = '''{
+  pubAllProfile(first: 20) {
+    edges { node { id researchInterest education experience user { name } } }
+    pageInfo { hasNextPage endCursor }
+  }
+}'''
+ME = '{ me { id name email profiledetails { address researchInterest education experience publications } } }'
+CREATE_PROFILE = '''mutation ($input: CreateProfileDetailsInput!) {
+  createProfileDetails(input: $input) { profileDetails { id researchInterest } }
+}'''
+UPDATE_PROFILE = '''mutation ($input: UpdateProfileDetailsInput!) {
+  updateProfileDetails(input: $input) { profileDetails { id address researchInterest } }
+}'''
+
+
+class Benchmark(object):
+    """One catalog entry; ``user`` is the email it authenticates as, if any."""
+    def __init__(self, name, query, variables=None, user=None, mutation=False):
+        self.name = name
+        self.query = query
+        self.variables = variables or {}
+        self.user = user
+        self.mutation = mutation
+
+    def get_variables(self, users):
+        return self.variables(users) if callable(self.variables) else self.variables
+
+
+CATALOG = (
+    # Served from the response cache after the first call.
+    Benchmark('allPost.anonymous', PAGE_OF_POSTS),
+    Benchmark('allPost.page', PAGE_OF_POSTS, user=MEMBER),
+    Benchmark('allPost.byReviewCount', PAGE_OF_POSTS, {'order': '-reviewCount'}, user=MEMBER),
+    Benchmark('allPost.search', PAGE_OF_POSTS, {'search': 'physics'}, user=MEMBER),
+    Benchmark('allPost.detail', POST_DETAIL, user=MEMBER),
+    Benchmark('pubAllProfile.page', PUBLIC_PROFILES, user=MEMBER),
+    Benchmark('me', ME, user=MEMBER),
+    Benchmark('createProfileDetails', CREATE_PROFILE, {'input': {
+        'address': 'Benchmark Street 1', 'researchInterest': 'physics quantum optics', 'education': 'PhD',
+    }}, user=NEWCOMER, mutation=True),
+    Benchmark('updateProfileDetails', UPDATE_PROFILE, lambda users: {'input': {
+        'profileId': to_global_id('ProfileDetailsNode', users[MEMBER].pk),
+        'address': 'Benchmark Street 2', 'researchInterest': 'chemistry materials climate',
+    }}, user=MEMBER, mutation=True),
+)
+
+
+def _text(rng, words):
+    return ' '.join(rng.sample(WORDS, words))
+
+
+def _reviewers(rng, people, post, count):
+    chosen = rng.sample(people, min(count + 1, len(people)))
+    return [user for user in chosen if user.pk != post.user_profile_id][:count]
+
+
+def generate(seed=0, **scale):
+    """Create the benchmark data set; the same seed and scale always give the same data."""
+    scale = dict(SCALE, **scale)
+    if UserProfile.objects.filter(email__startswith='bench-').exists():
+        raise Exception('Benchmark data already exists; remove it with clear() first.')
+    if scale['users'] < 2:
+        raise Exception('The benchmark needs at least 2 users.')
+    rng = random.Random(seed)
+    password = make_password(PASSWORD)
+    with transaction.atomic():
+        people = bulk_insert(UserProfile, [
+            UserProfile(email=EMAIL % i, name='Bench User %d' % i, password=password) for i in range(scale['users'])
+        ])
+        bulk_insert(UserProfile, [UserProfile(email=NEWCOMER, name='Bench Newcomer', password=password)])
+        bulk_insert(ProfileDetails, [
+            ProfileDetails(
+                user=user, address='%d Benchmark Road' % i, research_interest=_text(rng, rng.randint(2, 5)),
+                education=_text(rng, 2), experience=_text(rng, 3),
+                allow_public_view='Y' if rng.random() < 0.8 else 'N',
+            )
+            for i, user in enumerate(people)
+        ])
+        created_posts = bulk_insert(Post, [
+            Post(
+                user_profile=rng.choice(people), title='%s of %s #%d' % tuple(rng.sample(WORDS, 2) + [i]),
+                type_of_submission=rng.choice(SUBMISSION_TYPES), course_name=_text(rng, 1),
+                subject=_text(rng, 1), description=_text(rng, 12),
+            )
+            for i in range(scale['posts'])
+        ])
+        reviews = bulk_insert(Review, [
+            Review(user_profile=reviewer, post_id=post, description=_text(rng, 10))
+            for post in created_posts
+            for reviewer in _reviewers(rng, people, post, scale['reviews_per_post'])
+        ])
+        bulk_insert(PostComment, [
+            PostComment(post=post, comment=_text(rng, 6))
+            for post in created_posts for _ in range(scale['comments_per_post'])
+        ])
+        bulk_insert(ReviewComment, [
+            ReviewComment(review=review, comment=_text(rng, 6))
+            for review in reviews for _ in range(scale['comments_per_review'])
+        ])
+        # Only the rows: the files themselves are never read by the catalog.
+        bulk_insert(PostUpload, [
+            PostUpload(post=post, description=_text(rng, 4), file_upload='post/bench-%d-%d.pdf' % (post.pk, i),
+                       size=rng.randint(10 ** 4, 10 ** 7))
+            for post in created_posts for i in range(scale['uploads_per_post'])
+        ])
+        bulk_insert(ReviewUpload, [
+            ReviewUpload(review=review, description=_text(rng, 4), file_upload='review/bench-%d.pdf' % review.pk,
+                         size=rng.randint(10 ** 4, 10 ** 6))
+            for review in reviews[::2]
+        ])
+    return dataset()
+
+
+def clear():
+    """Delete the benchmark data set; everything else cascades from the users."""
+    return UserProfile.objects.filter(email__startswith='bench-').delete()[0]
+
+
+def dataset():
+    """Row counts of the benchmark data set, stored with a baseline."""
+    users = UserProfile.objects.filter(email__startswith='bench-')
+    return {
+        'users': users.count(),
+        'posts': Post.objects.filter(user_profile__in=users).count(),
+        'reviews': Review.objects.filter(post_id__user_profile__in=users).count(),
+        'post_comments': PostComment.objects.filter(post__user_profile__in=users).count(),
+        'review_comments': ReviewComment.objects.filter(review__post_id__user_profile__in=users).count(),
+        'uploads': PostUpload.objects.filter(post__user_profile__in=users).count()
+        + ReviewUpload.objects.filter(review__post_id__user_profile__in=users).count(),
+    }
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Counter(object):
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Runner(object):
+    """Sends catalog queries to ``/graphql`` with the test client."""
+    def __init__(self):
+        self.client = Client()
+        self.users = {user.email: user for user in UserProfile.objects.filter(email__in=[MEMBER, NEWCOMER])}
+        if len(self.users) != 2:
+            raise Exception('Benchmark data is missing; run generate_benchmark_data first.')
+        self.tokens = {email: get_token(user) for email, user in self.users.items()}
+
+    def request(self, benchmark):
+        headers = {}
+        if benchmark.user:
+            headers['HTTP_AUTHORIZATION'] = 'JWT ' + self.tokens[benchmark.user]
+        body = {'query': benchmark.query, 'variables': benchmark.get_variables(self.users)}
+        with transaction.atomic() if benchmark.mutation else ExitStack():
+            response = self.client.post('/graphql', body, content_type='application/json', **headers)
+            if benchmark.mutation:
+                transaction.set_rollback(True)
+        result = response.json()
+        if response.status_code != 200 or result.get('errors'):
+            raise Exception('%s failed: %s' % (benchmark.name, result.get('errors') or response.status_code))
+        return result
+
+    def measure(self, benchmark, iterations, warmup):
+        for _ in range(warmup):
+            self.request(benchmark)
+        gc.collect()
+        latencies = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            self.request(benchmark)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        # SQL and memory come from one extra call, so tracing doesn't skew the latencies.
+        counter = Counter()
+        tracemalloc.start()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(counter))
+                before = tracemalloc.get_traced_memory()[0]
+                self.request(benchmark)
+                peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return {
+            'p50': round(percentile(latencies, 0.5), 3),
+            'p95': round(percentile(latencies, 0.95), 3),
+            'p99': round(percentile(latencies, 0.99), 3),
+            'mean': round(sum(latencies) / len(latencies), 3),
+            'sql': counter.count,
+            'memory_kib': round((peak - before) / 1024, 1),
+        }
+
+
+def run(iterations=50, warmup=5, names=None):
+    """Measure the catalog, or the entries named in ``names``; returns results by name."""
+    runner = Runner()
+    return {
+        benchmark.name: runner.measure(benchmark, iterations, warmup)
+        for benchmark in CATALOG if not names or benchmark.name in names
+    }
+
+
+def compare(results, baseline, latency_tolerance=0.5, memory_tolerance=0.25, latency_floor=1.0,
+            memory_floor=64.0):
+    """Describe each regression of ``results`` against ``baseline``.
+
+    More SQL statements than the baseline always count. Latency (p50) and
+    memory count when they exceed the baseline by more than the tolerance
+    fraction and by more than the floor, in milliseconds and KiB, which keeps
+    noise on fast queries from failing the run.
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get('queries', {}).get(name)
+        if base is None:
+            continue
+        if result['sql'] > base['sql']:
+            regressions.append('%s: %d SQL statements, baseline %d' % (name, result['sql'], base['sql']))
+        if result['p50'] > max(base['p50'] * (1 + latency_tolerance), base['p50'] + latency_floor):
+            regressions.append('%s: p50 %.1f ms, baseline %.1f ms' % (name, result['p50'], base['p50']))
+        if result['memory_kib'] > max(base['memory_kib'] * (1 + memory_tolerance), base['memory_kib'] + memory_floor):
+            regressions.append('%s: %.0f KiB allocated, baseline %.0f KiB' % (
+                name, result['memory_kib'], base['memory_kib']
+            ))
+    return regressions
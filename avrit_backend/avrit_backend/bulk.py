@@ -0,0 +1,120 @@
+"""Bulk writes for batch mutations and imports.
+
+``bulk_insert`` and ``bulk_change`` write many rows with ``bulk_create`` and
+``bulk_update`` and then send ``bulk_saved`` once for the whole batch instead
+of ``post_save`` per row; apps that keep derived data (search indexes, the
+response cache) listen to both.
+"""
+from collections import defaultdict, deque
+
+import graphene
+from django.conf import settings
+from django.core.exceptions import NON_FIELD_ERRORS
+from django.db import DatabaseError, connections, router, transaction
+from django.db.models import Max
+from django.dispatch import Signal
+from django.utils import timezone
+from graphene.utils.str_converters import to_camel_case
+
+DEFAULTS = {
+    'MAX_ITEMS': 500,
+    'BATCH_SIZE': 500,
+}
+
+# Sent with instances, created, update_fields and using.
+bulk_saved = Signal()
+
+
+def bulk_setting(name):
+    return getattr(settings, 'BULK_MUTATIONS', {}).get(name, DEFAULTS[name])
+
+
+def natural_key(model):
+    """Fields that tell rows of ``model`` apart: its first unique field or ``unique_together``."""
+    for field in model._meta.concrete_fields:
+        if field.unique and not field.primary_key and not field.null:
+            return (field.name,)
+    for fields in model._meta.unique_together:
+        return tuple(fields)
+    return ()
+
+
+def bulk_insert(model, objects, using=None, key=None):
+    """Insert ``objects`` and set their primary keys.
+
+    Backends without RETURNING (SQLite) can't report the keys of a bulk
+    insert, so they are read back: the rows numbered above the largest key
+    before the insert are matched to ``objects`` by ``key`` (by default
+    ``natural_key(model)``), and rows with equal keys in the order they
+    were inserted.
+    """
+    if not objects:
+        return objects
+    using = using or router.db_for_write(model)
+    manager = model._base_manager.using(using)
+    pending = [obj for obj in objects if obj.pk is None]
+    if connections[using].features.can_return_rows_from_bulk_insert or not pending:
+        manager.bulk_create(objects, batch_size=bulk_setting('BATCH_SIZE'))
+    else:
+        known = [obj.pk for obj in objects if obj.pk is not None]
+        attnames = [model._meta.get_field(name).attname for name in (natural_key(model) if key is None else key)]
+        with transaction.atomic(using=using):
+            previous = manager.aggregate(last=Max('pk'))['last'] or 0
+            manager.bulk_create(objects, batch_size=bulk_setting('BATCH_SIZE'))
+            inserted = defaultdict(deque)
+            rows = manager.filter(pk__gt=previous).exclude(pk__in=known).order_by('pk').values_list('pk', *attnames)
+            for row in rows.iterator():
+                inserted[row[1:]].append(row[0])
+            for obj in pending:
+                pks = inserted[tuple(getattr(obj, attname) for attname in attnames)]
+                if not pks:
+                    raise DatabaseError('Could not read back the primary key of a new %s.' % model._meta.verbose_name)
+                obj.pk = pks.popleft()
+    bulk_saved.send(sender=model, instances=objects, created=True, update_fields=None, using=using)
+    return objects
+
+
+def bulk_change(model, objects, fields, using=None):
+    """Write ``fields`` of ``objects`` (plus any ``auto_now`` fields) in batched UPDATEs."""
+    if not objects:
+        return objects
+    using = using or router.db_for_write(model)
+    fields = list(fields)
+    now = timezone.now()
+    for field in model._meta.concrete_fields:
+        if getattr(field, 'auto_now', False):
+            for obj in objects:
+                setattr(obj, field.attname, now)
+            if field.name not in fields:
+                fields.append(field.name)
+    model._base_manager.using(using).bulk_update(objects, fields, batch_size=bulk_setting('BATCH_SIZE'))
+    bulk_saved.send(sender=model, instances=objects, created=False, update_fields=frozenset(fields), using=using)
+    return objects
+
+
+class BulkError(graphene.ObjectType):
+    """A problem with one item of a batch mutation."""
+    index = graphene.Int(required=True)
+    field = graphene.String()
+    messages = graphene.List(graphene.NonNull(graphene.String), required=True)
+
+
+class ItemErrors(object):
+    """Collects per-item errors of a batch, keyed by the item's index."""
+    def __init__(self):
+        self.errors = []
+        self.failed = set()
+
+    def add(self, index, field, *messages):
+        self.failed.add(index)
+        self.errors.append(BulkError(index=index, field=field and to_camel_case(field), messages=list(messages)))
+
+    def add_validation_error(self, index, error):
+        for field, messages in error.message_dict.items():
+            self.add(index, None if field == NON_FIELD_ERRORS else field, *messages)
+
+    def __contains__(self, index):
+        return index in self.failed
+
+    def __bool__(self):
+        return bool(self.failed)
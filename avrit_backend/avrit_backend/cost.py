@@ -0,0 +1,155 @@
+"""Static query cost and depth limits.
+
+A validated operation is walked before execution. Each field with a
+selection set costs 1 (or its ``FIELD_COSTS`` entry) plus the cost of its
+selections, multiplied by the page size for connections (``first`` or
+``last``, else the connection's maximum) and by ``LIST_SIZE`` for plain list
+fields. Scalar fields are free unless listed in ``FIELD_COSTS``. Requests
+over the ``MAX_DEPTH`` or ``MAX_COST`` of their user class (anonymous,
+authenticated or staff) are rejected without running any resolver.
+"""
+from django.conf import settings
+from graphene_django.settings import graphene_settings
+from graphql.error import GraphQLError
+from graphql.language import ast
+from graphql.type import GraphQLList, GraphQLObjectType
+
+from avrit_backend.documents import get_operation
+
+DEFAULTS = {
+    'LIMITS': {
+        'anonymous': {'MAX_DEPTH': 10, 'MAX_COST': 5000},
+        'authenticated': {'MAX_DEPTH': 12, 'MAX_COST': 20000},
+        'staff': {'MAX_DEPTH': None, 'MAX_COST': None},
+    },
+    'FIELD_COSTS': {},
+    'LIST_SIZE': 20,
+}
+
+
+def cost_setting(name):
+    return getattr(settings, 'GRAPHQL_COST', {}).get(name, DEFAULTS[name])
+
+
+def user_class(user):
+    if user is None or not user.is_authenticated:
+        return 'anonymous'
+    if user.is_staff:
+        return 'staff'
+    return 'authenticated'
+
+
+def _unwrap(graphql_type):
+    is_list = False
+    while hasattr(graphql_type, 'of_type'):
+        is_list = is_list or isinstance(graphql_type, GraphQLList)
+        graphql_type = graphql_type.of_type
+    return graphql_type, is_list
+
+
+def _is_connection(graphql_type):
+    return isinstance(graphql_type, GraphQLObjectType) and 'edges' in graphql_type.fields and 'pageInfo' in graphql_type.fields
+
+
+class CostAnalysis(object):
+    """Computes the cost and depth of one operation of a validated document."""
+    def __init__(self, schema, document_ast, variables=None):
+        self.schema = schema
+        self.variables = variables or {}
+        self.fragments = {
+            definition.name.value: definition
+            for definition in document_ast.definitions
+            if isinstance(definition, ast.FragmentDefinition)
+        }
+        self.field_costs = cost_setting('FIELD_COSTS')
+        self.list_size = cost_setting('LIST_SIZE')
+
+    def operation(self, operation):
+        """Return ``(cost, depth)`` of an ``OperationDefinition``."""
+        root = {
+            'query': self.schema.get_query_type,
+            'mutation': self.schema.get_mutation_type,
+            'subscription': self.schema.get_subscription_type,
+        }[operation.operation]()
+        return self.selection_set(operation.selection_set, root, 0, frozenset())
+
+    def selection_set(self, selection_set, parent_type, depth, visited):
+        cost = 0
+        max_depth = depth
+        for selection in selection_set.selections:
+            if isinstance(selection, ast.Field):
+                name = selection.name.value
+                fields = getattr(parent_type, 'fields', {})
+                if name.startswith('__') or name not in fields:
+                    continue
+                field_cost, field_depth = self.field(selection, parent_type, fields[name], depth + 1, visited)
+            elif isinstance(selection, ast.FragmentSpread):
+                name = selection.name.value
+                fragment = self.fragments.get(name)
+                if fragment is None or name in visited:
+                    continue
+                fragment_type = self.schema.get_type(fragment.type_condition.name.value)
+                field_cost, field_depth = self.selection_set(fragment.selection_set, fragment_type, depth, visited | {name})
+            elif isinstance(selection, ast.InlineFragment):
+                fragment_type = parent_type
+                if selection.type_condition is not None:
+                    fragment_type = self.schema.get_type(selection.type_condition.name.value)
+                field_cost, field_depth = self.selection_set(selection.selection_set, fragment_type, depth, visited)
+            else:
+                continue
+            cost += field_cost
+            max_depth = max(max_depth, field_depth)
+        return cost, max_depth
+
+    def field(self, node, parent_type, field_def, depth, visited):
+        key = '%s.%s' % (parent_type.name, node.name.value)
+        if not node.selection_set:
+            return self.field_costs.get(key, 0), depth
+        field_type, is_list = _unwrap(field_def.type)
+        if _is_connection(field_type):
+            multiplier = self.page_size(node)
+        elif is_list and not _is_connection(parent_type):
+            multiplier = self.list_size
+        else:
+            multiplier = 1
+        child_cost, child_depth = self.selection_set(node.selection_set, field_type, depth, visited)
+        return self.field_costs.get(key, 1) + multiplier * child_cost, child_depth
+
+    def page_size(self, node):
+        sizes = [self.argument(node, name) for name in ('first', 'last')]
+        sizes = [size for size in sizes if isinstance(size, int)]
+        if sizes:
+            return max(sizes)
+        return graphene_settings.RELAY_CONNECTION_MAX_LIMIT or self.list_size
+
+    def argument(self, node, name):
+        for argument in node.arguments or ():
+            if argument.name.value != name:
+                continue
+            value = argument.value
+            if isinstance(value, ast.Variable):
+                return self.variables.get(value.name.value)
+            if isinstance(value, ast.IntValue):
+                return int(value.value)
+        return None
+
+
+def check_cost(schema, document, variables, operation_name, user):
+    """Return ``(report, error)`` for a validated document.
+
+    ``error`` is a ``GraphQLError`` if the operation exceeds the limits of
+    the user's class, else ``None``.
+    """
+    operation = get_operation(document.document_ast, operation_name)
+    if operation is None:
+        return None, None
+    cost, depth = CostAnalysis(schema, document.document_ast, variables).operation(operation)
+    limits = cost_setting('LIMITS').get(user_class(user), {})
+    max_depth = limits.get('MAX_DEPTH')
+    max_cost = limits.get('MAX_COST')
+    report = {'cost': cost, 'depth': depth, 'maxCost': max_cost, 'maxDepth': max_depth}
+    if max_depth is not None and depth > max_depth:
+        return report, GraphQLError('Query depth %d exceeds the maximum of %d.' % (depth, max_depth))
+    if max_cost is not None and cost > max_cost:
+        return report, GraphQLError('Query cost %d exceeds the maximum of %d.' % (cost, max_cost))
+    return report, None
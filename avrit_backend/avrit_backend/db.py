@@ -0,0 +1,102 @@
+"""Routing between the primary database and read replicas.
+
+``ReplicaRouter`` sends reads to one of ``DATABASE_ROUTING['REPLICAS']``
+only inside a request that ``ReplicaRoutingMiddleware`` has marked as safe.
+Such a request uses GET or HEAD, or is a GraphQL query. Everything else
+reads from the primary:
+
+* mutations and other unsafe requests;
+* the rest of a request once it has written anything, and reads inside
+  a transaction;
+* requests from a client that wrote within the last ``PIN_SECONDS``,
+  tracked with a cookie, so its reads don't miss its own writes while
+  the replicas catch up;
+* code outside a request, such as background tasks and subscriptions.
+
+Writes always go to the primary.
+"""
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.deprecation import MiddlewareMixin
+
+DEFAULTS = {
+    'REPLICAS': [],
+    'PIN_SECONDS': 5,
+    'PIN_COOKIE': 'db_pin',
+}
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def routing_setting(name):
+    return getattr(settings, 'DATABASE_ROUTING', {}).get(name, DEFAULTS[name])
+
+
+def get_replicas():
+    return [alias for alias in routing_setting('REPLICAS') if alias in settings.DATABASES]
+
+
+class RoutingState(object):
+    """Where reads of the current request go."""
+    def __init__(self, pinned, client_pinned):
+        self.pinned = pinned
+        self.client_pinned = client_pinned
+        self.wrote = False
+
+
+_state = ContextVar('avrit_db_routing', default=None)
+
+
+def use_replicas(allowed):
+    """Let the rest of the request read from replicas, unless it must see its own writes."""
+    state = _state.get()
+    if state is not None:
+        state.pinned = state.wrote or state.client_pinned or not allowed
+
+
+class ReplicaRouter(object):
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state.pinned or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        replicas = get_replicas()
+        return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+            state.pinned = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS}.union(get_replicas())
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaRoutingMiddleware(MiddlewareMixin):
+    """Tracks the routing state of each request and the read-your-writes cookie."""
+    def process_request(self, request):
+        try:
+            client_pinned = float(request.COOKIES.get(routing_setting('PIN_COOKIE'), 0)) > time.time()
+        except ValueError:
+            client_pinned = False
+        state = RoutingState(client_pinned or request.method not in SAFE_METHODS, client_pinned)
+        request.db_routing = state
+        _state.set(state)
+
+    def process_response(self, request, response):
+        state = getattr(request, 'db_routing', None)
+        if state is not None and state.wrote:
+            seconds = routing_setting('PIN_SECONDS')
+            response.set_cookie(
+                routing_setting('PIN_COOKIE'), '%d' % (time.time() + seconds), max_age=seconds, httponly=True,
+                samesite='Lax',
+            )
+        _state.set(None)
+        return response
@@ -0,0 +1,118 @@
+"""Parsed-and-validated GraphQL document cache.
+
+``document_backend`` replaces graphql-core's default backend for the
+``/graphql`` view. Each distinct query string is parsed and validated once
+and kept in a bounded LRU keyed by its sha256, the same hash automatic
+persisted queries use, so a persisted query hit skips parsing entirely.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import partial
+
+from django.conf import settings
+from graphql.backend.base import GraphQLDocument
+from graphql.backend.core import GraphQLCoreBackend
+from graphql.execution import ExecutionResult, execute
+from graphql.language import ast
+from graphql.language.base import parse
+from graphql.validation import validate
+
+DEFAULTS = {
+    'CACHE_SIZE': 500,
+    'PERSISTED_QUERIES_CACHE': 'default',
+    'PERSISTED_QUERIES_TIMEOUT': 60 * 60 * 24,
+}
+
+
+def documents_setting(name):
+    return getattr(settings, 'GRAPHQL_DOCUMENTS', {}).get(name, DEFAULTS[name])
+
+
+def query_hash(query):
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+
+def get_operation(document_ast, operation_name):
+    """The ``OperationDefinition`` a request runs, or ``None`` if it is ambiguous."""
+    operations = [
+        definition for definition in document_ast.definitions
+        if isinstance(definition, ast.OperationDefinition)
+    ]
+    if not operation_name:
+        return operations[0] if len(operations) == 1 else None
+    for operation in operations:
+        if operation.name and operation.name.value == operation_name:
+            return operation
+    return None
+
+
+class CachedDocumentBackend(GraphQLCoreBackend):
+    """A graphql-core backend that parses and validates each query only once."""
+    def __init__(self, max_size=None, executor=None):
+        super(CachedDocumentBackend, self).__init__(executor=executor)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_max_size(self):
+        return self.max_size if self.max_size is not None else documents_setting('CACHE_SIZE')
+
+    def get(self, schema, digest):
+        """Return the cached document for ``digest`` or ``None``, counting the lookup."""
+        key = (id(schema), digest)
+        with self._lock:
+            document = self._documents.get(key)
+            if document is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._documents.move_to_end(key)
+            return document
+
+    def document_from_string(self, schema, document_string):
+        digest = query_hash(document_string)
+        document = self.get(schema, digest)
+        if document is not None:
+            return document
+
+        document_ast = parse(document_string)
+        errors = validate(schema, document_ast)
+        if errors:
+            def run(*args, **kwargs):
+                return ExecutionResult(errors=errors, invalid=True)
+        else:
+            run = partial(execute, schema, document_ast, **self.execute_params)
+        document = GraphQLDocument(
+            schema=schema,
+            document_string=document_string,
+            document_ast=document_ast,
+            execute=run,
+        )
+        document.digest = digest
+        document.valid = not errors
+
+        with self._lock:
+            self._documents[(id(schema), digest)] = document
+            while len(self._documents) > self.get_max_size():
+                self._documents.popitem(last=False)
+        return document
+
+    def cache_info(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._documents),
+                'max_size': self.get_max_size(),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+            self.hits = self.misses = 0
+
+
+document_backend = CachedDocumentBackend()
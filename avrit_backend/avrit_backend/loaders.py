@@ -0,0 +1,83 @@
+"""Per-request DataLoaders for the relations walked by the GraphQL schema.
+
+Every resolver that follows a foreign key or a reverse relation goes through
+the registry returned by ``get_loaders(info.context)``, so all the keys asked
+for in one execution tick are fetched with a single ``IN (...)`` query.
+Relations the optimizer already joined or prefetched are used as they are.
+"""
+from collections import defaultdict
+
+from promise import Promise
+from promise.dataloader import DataLoader
+
+from profiles_api.models import UserProfile, ProfileDetails, ProfileImage, ProfileImageVariant
+from review.models import PostUpload, PostComment, Review, ReviewUpload, ReviewComment
+
+
+class ModelLoader(DataLoader):
+    """Loads one instance of ``model`` per key, matched on ``field``."""
+    def __init__(self, model, field='pk'):
+        super(ModelLoader, self).__init__()
+        self.model = model
+        self.field = field
+
+    def batch_load_fn(self, keys):
+        if self.field == 'pk':
+            found = self.model._default_manager.in_bulk(keys)
+        else:
+            attname = self.model._meta.get_field(self.field).attname
+            queryset = self.model._default_manager.filter(**{self.field + '__in': keys})
+            found = {getattr(obj, attname): obj for obj in queryset}
+        return Promise.resolve([found.get(key) for key in keys])
+
+
+class RelatedLoader(DataLoader):
+    """Loads the reverse side of a foreign key as one list per key, optionally narrowed by ``filters``."""
+    def __init__(self, model, field, **filters):
+        super(RelatedLoader, self).__init__()
+        self.model = model
+        self.field = field
+        self.filters = filters
+
+    def batch_load_fn(self, keys):
+        attname = self.model._meta.get_field(self.field).attname
+        queryset = self.model._default_manager.filter(**{self.field + '__in': keys}, **self.filters).order_by('pk')
+        grouped = defaultdict(list)
+        for obj in queryset:
+            grouped[getattr(obj, attname)].append(obj)
+        return Promise.resolve([grouped[key] for key in keys])
+
+
+class Loaders(object):
+    """The loaders for a single request."""
+    def __init__(self):
+        self.user = ModelLoader(UserProfile)
+        self.profile_details = ModelLoader(ProfileDetails)
+        self.profile_image = ModelLoader(ProfileImage, 'user')
+        self.profile_image_variants = RelatedLoader(ProfileImageVariant, 'image')
+        self.post_reviews = RelatedLoader(Review, 'post_id')
+        self.post_uploads = RelatedLoader(PostUpload, 'post')
+        self.latest_post_uploads = RelatedLoader(PostUpload, 'post', latest=True)
+        self.post_comments = RelatedLoader(PostComment, 'post')
+        self.review_uploads = RelatedLoader(ReviewUpload, 'review')
+        self.latest_review_uploads = RelatedLoader(ReviewUpload, 'review', latest=True)
+        self.review_comments = RelatedLoader(ReviewComment, 'review')
+
+
+def load_related(context, instance, name, loader, key):
+    """Return ``instance.<name>`` if the queryset already fetched it, else batch it."""
+    prefetched = getattr(instance, '_prefetched_objects_cache', {})
+    if name in prefetched:
+        return list(prefetched[name])
+    if name in instance._state.fields_cache:
+        return instance._state.fields_cache[name]
+    return getattr(get_loaders(context), loader).load(key)
+
+
+def get_loaders(context):
+    """Return the loader registry attached to the request, creating it on first use."""
+    loaders = getattr(context, 'loaders', None)
+    if loaders is None:
+        loaders = Loaders()
+        context.loaders = loaders
+    return loaders
@@ -0,0 +1,183 @@
+"""Serving uploaded media.
+
+``serve_media`` replaces ``django.views.static.serve`` for ``MEDIA_URL``. It
+checks access by path prefix, answers conditional requests with 304s using a
+strong ETag and Last-Modified, serves single byte ranges, and can hand the
+file transfer itself to the front proxy with X-Accel-Redirect (nginx) or
+X-Sendfile (Apache, lighttpd) so workers never stream file bodies.
+"""
+import mimetypes
+import os
+import posixpath
+import re
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseForbidden, HttpResponseNotModified, StreamingHttpResponse,
+)
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from django.utils.module_loading import import_string
+from django.views.decorators.http import require_safe
+
+from avrit_backend.auth import get_request_user
+
+DEFAULTS = {
+    # Longest matching prefix wins. A policy is 'public', 'authenticated',
+    # 'staff', or the dotted path of a callable(request, path) -> bool that
+    # looks up the rows referring to the file and checks their owner.
+    'ACCESS': {'': 'staff'},
+    'SENDFILE': None,
+    'SENDFILE_PREFIX': '/protected-media/',
+    'MAX_AGE': 60 * 60 * 24,
+}
+READ_SIZE = 64 * 1024
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def media_setting(name):
+    return getattr(settings, 'MEDIA_SERVING', {}).get(name, DEFAULTS[name])
+
+
+def access_policy(path):
+    access = media_setting('ACCESS')
+    prefix = max((prefix for prefix in access if path.startswith(prefix)), key=len, default=None)
+    return 'staff' if prefix is None else access[prefix]
+
+
+def has_access(request, path, policy):
+    if policy == 'public':
+        return True
+    user = get_request_user(request)
+    if policy == 'authenticated':
+        return user is not None
+    if policy == 'staff':
+        return user is not None and user.is_staff
+    return bool(import_string(policy)(request, path))
+
+
+def make_etag(stat_result):
+    return quote_etag('%x-%x' % (stat_result.st_mtime_ns, stat_result.st_size))
+
+
+def not_modified(request, etag, mtime):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        tags = parse_etags(if_none_match)
+        return '*' in tags or etag in tags
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE'))
+    return if_modified_since is not None and int(mtime) <= if_modified_since
+
+
+def requested_range(request, size, etag, mtime):
+    """Return ``(start, end)`` for a satisfiable single range, ``None`` for the
+    whole file, or ``False`` if the range can't be satisfied."""
+    header = request.META.get('HTTP_RANGE')
+    if not header:
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range:
+        if if_range.startswith('"') or if_range.startswith('W/'):
+            if if_range != etag:
+                return None
+        elif parse_http_date_safe(if_range) != int(mtime):
+            return None
+    match = RANGE.match(header.strip())
+    if match is None:
+        # Multiple or malformed ranges: serving the whole file is allowed.
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, end
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length:
+            data = f.read(min(READ_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+@require_safe
+def serve_media(request, path):
+    """Serve ``path`` from ``MEDIA_ROOT``."""
+    path = posixpath.normpath(path).lstrip('/')
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+    except (ValueError, SuspiciousFileOperation):
+        raise Http404('File not found.')
+    try:
+        stat_result = os.stat(fullpath)
+    except OSError:
+        raise Http404('File not found.')
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise Http404('File not found.')
+
+    policy = access_policy(path)
+    if not has_access(request, path, policy):
+        return HttpResponseForbidden()
+
+    etag = make_etag(stat_result)
+    mtime = stat_result.st_mtime
+    if not_modified(request, etag, mtime):
+        response = HttpResponseNotModified()
+    else:
+        response = _file_response(request, path, fullpath, stat_result, etag, mtime)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(mtime)
+    if policy == 'public':
+        response['Cache-Control'] = 'public, max-age=%d' % media_setting('MAX_AGE')
+    else:
+        response['Cache-Control'] = 'private, no-cache'
+        response['Vary'] = 'Cookie, Authorization'
+    return response
+
+
+def _file_response(request, path, fullpath, stat_result, etag, mtime):
+    content_type, encoding = mimetypes.guess_type(fullpath)
+    content_type = content_type or 'application/octet-stream'
+    sendfile = media_setting('SENDFILE')
+    if sendfile:
+        # The proxy handles ranges and the transfer itself.
+        response = HttpResponse(content_type=content_type)
+        if sendfile == 'x-accel':
+            response['X-Accel-Redirect'] = media_setting('SENDFILE_PREFIX') + quote(path)
+        else:
+            response['X-Sendfile'] = fullpath
+    else:
+        size = stat_result.st_size
+        byte_range = requested_range(request, size, etag, mtime)
+        if byte_range is False:
+            response = HttpResponse(status=416, content_type=content_type)
+            response['Content-Range'] = 'bytes */%d' % size
+        elif byte_range is None:
+            response = FileResponse(open(fullpath, 'rb'), content_type=content_type)
+            response['Content-Length'] = size
+        else:
+            start, end = byte_range
+            length = end - start + 1
+            response = StreamingHttpResponse(_read_range(fullpath, start, length), status=206, content_type=content_type)
+            response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+            response['Content-Length'] = length
+    response['Accept-Ranges'] = 'bytes'
+    response['X-Content-Type-Options'] = 'nosniff'
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,112 @@
+"""Queryset planning driven by the GraphQL selection set.
+
+``optimize(queryset, info)`` reads the fields the client asked for and adds
+``select_related`` for single-valued relations, ``prefetch_related`` with
+``Prefetch`` objects for nested lists, and ``only()`` so wide text columns
+that were not selected are never pulled from the database.
+"""
+from django.db.models import Prefetch
+from graphene.utils.str_converters import to_snake_case
+from graphql.language.ast import FragmentSpread, InlineFragment
+
+
+def optimize(queryset, info):
+    """Return ``queryset`` planned for the selection of the field being resolved."""
+    selections = _collect(info.field_asts, info.fragments)
+    if 'edges' in selections:
+        selections = _collect(_collect(selections['edges'], info.fragments).get('node', []), info.fragments)
+    plan = _Plan(queryset.model)
+    plan.add(selections, info.fragments)
+    return plan.apply(queryset.all())
+
+
+def _collect(field_asts, fragments):
+    """Merge the sub-selections of ``field_asts`` into a dict of name -> field nodes."""
+    collected = {}
+
+    def walk(selection_set):
+        if selection_set is None:
+            return
+        for selection in selection_set.selections:
+            if isinstance(selection, FragmentSpread):
+                walk(fragments[selection.name.value].selection_set)
+            elif isinstance(selection, InlineFragment):
+                walk(selection.selection_set)
+            else:
+                collected.setdefault(selection.name.value, []).append(selection)
+
+    for field_ast in field_asts:
+        walk(field_ast.selection_set)
+    return collected
+
+
+def _relations(model):
+    """Map the names the schema uses for ``model`` to its fields and reverse relations."""
+    fields = {field.name: field for field in model._meta.get_fields() if not field.auto_created or field.concrete}
+    for rel in model._meta.related_objects:
+        fields[rel.get_accessor_name()] = rel
+    return fields
+
+
+class _Plan(object):
+    def __init__(self, model):
+        self.model = model
+        self.only = {model._meta.pk.name}
+        self.select = []
+        self.prefetch = []
+        self.prunable = True
+
+    def add(self, selections, fragments):
+        fields = _relations(self.model)
+        for name, field_asts in selections.items():
+            if name.startswith('__'):
+                continue
+            attr = to_snake_case(name)
+            if attr == 'id':
+                continue
+            field = fields.get(attr)
+            if field is None:
+                # A custom resolver may need any column, so keep them all.
+                self.prunable = False
+                continue
+            if field.many_to_many:
+                continue
+            nested = _collect(field_asts, fragments)
+            if field.concrete and not field.is_relation:
+                self.only.add(field.name)
+            elif field.concrete or field.one_to_one:
+                if field.concrete:
+                    self.only.add(field.name)
+                self._select(attr, field.related_model, nested, fragments)
+            elif 'edges' not in nested:
+                # Nested connections resolve and filter their own querysets.
+                self._prefetch(attr, field, nested, fragments)
+
+    def _select(self, attr, model, nested, fragments):
+        related = _Plan(model)
+        related.add(nested, fragments)
+        self.select.append(attr)
+        self.select.extend(attr + '__' + lookup for lookup in related.select)
+        self.prefetch.extend((attr + '__' + lookup, queryset) for lookup, queryset in related.prefetch)
+        if related.prunable:
+            self.only.update(attr + '__' + name for name in related.only)
+        else:
+            self.prunable = False
+
+    def _prefetch(self, attr, rel, nested, fragments):
+        related = _Plan(rel.related_model)
+        related.only.add(rel.field.name)
+        related.add(nested, fragments)
+        queryset = related.apply(rel.related_model._default_manager.order_by('pk'))
+        self.prefetch.append((attr, queryset))
+
+    def apply(self, queryset):
+        if self.select:
+            queryset = queryset.select_related(*self.select)
+        if self.prefetch:
+            queryset = queryset.prefetch_related(*[
+                Prefetch(lookup, queryset=related) for lookup, related in self.prefetch
+            ])
+        if self.prunable:
+            queryset = queryset.only(*self.only)
+        return queryset
@@ -0,0 +1,181 @@
+"""Keyset pagination for relay connections.
+
+Cursors encode the values of the queryset ordering (``created_at`` and the
+primary key by default) instead of an offset, so fetching any page is an
+index range scan of ``first + 1`` rows. Paging from a cursor costs one more
+query, checking whether any row is left on the other side of the cursor.
+``totalCount`` is only computed when the client selects it.
+"""
+import base64
+import datetime
+import json
+
+import graphene
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from graphene import relay
+from graphene_django.filter import DjangoFilterConnectionField
+from graphene_django.utils import maybe_queryset
+
+
+class KeysetConnection(relay.Connection):
+    total_count = graphene.Int()
+
+    class Meta:
+        abstract = True
+
+    def resolve_total_count(self, info):
+        return self.iterable.count()
+
+
+class KeysetConnectionField(DjangoFilterConnectionField):
+    """A ``DjangoFilterConnectionField`` paginated by keyset cursors.
+
+    Querysets that are not already ordered are ordered by ``ordering``; the
+    primary key is always appended as the tie-breaker.
+    """
+    def __init__(self, type, ordering=('-created_at', '-pk'), *args, **kwargs):
+        self.ordering = ordering
+        super(KeysetConnectionField, self).__init__(type, *args, **kwargs)
+        self._base_args.pop('offset', None)
+
+    def get_queryset_resolver(self):
+        resolve_queryset = super(KeysetConnectionField, self).get_queryset_resolver()
+        ordering = self.ordering
+
+        def resolve_ordered_queryset(connection, iterable, info, args):
+            queryset = resolve_queryset(connection, iterable, info, args)
+            if not queryset.query.order_by:
+                queryset = queryset.order_by(*ordering)
+            return queryset
+        return resolve_ordered_queryset
+
+    @classmethod
+    def resolve_connection(cls, connection, args, iterable, max_limit=None):
+        queryset = maybe_queryset(iterable)
+        ordering = get_ordering(queryset)
+        queryset = with_ordering_columns(queryset.order_by(*ordering), ordering)
+        first = args.get('first')
+        last = args.get('last')
+        after = args.get('after')
+        before = args.get('before')
+
+        page = queryset
+        if after:
+            after = decode_cursor(after)
+            page = page.filter(seek(queryset.model, ordering, after, forward=True))
+        if before:
+            before = decode_cursor(before)
+            page = page.filter(seek(queryset.model, ordering, before, forward=False))
+
+        if last is not None and first is None:
+            rows = list(page.reverse()[:last + 1])
+            has_previous_page = len(rows) > last
+            rows = rows[:last]
+            rows.reverse()
+            has_next_page = bool(before) and queryset.filter(
+                seek(queryset.model, ordering, before, forward=True, inclusive=True)
+            ).exists()
+        else:
+            limit = first if first is not None else max_limit
+            rows = list(page[:limit + 1] if limit is not None else page)
+            has_next_page = limit is not None and len(rows) > limit
+            rows = rows[:limit]
+            # Both first and last: the last ``last`` of the first ``first`` rows.
+            if last is not None and len(rows) > last:
+                rows = rows[len(rows) - last:]
+                has_previous_page = True
+            else:
+                has_previous_page = bool(after) and queryset.filter(
+                    seek(queryset.model, ordering, after, forward=False, inclusive=True)
+                ).exists()
+
+        edges = [connection.Edge(node=row, cursor=encode_cursor(row, ordering)) for row in rows]
+        result = connection(
+            edges=edges,
+            page_info=relay.PageInfo(
+                start_cursor=edges[0].cursor if edges else None,
+                end_cursor=edges[-1].cursor if edges else None,
+                has_previous_page=has_previous_page,
+                has_next_page=has_next_page,
+            ),
+        )
+        result.iterable = queryset
+        return result
+
+
+def get_ordering(queryset):
+    """Return the ordering of ``queryset`` with the primary key as the last column."""
+    ordering = [name for name in queryset.query.order_by if name.lstrip('-') not in ('pk', queryset.model._meta.pk.name)]
+    descending = ordering[-1].startswith('-') if ordering else True
+    ordering.append('-pk' if descending else 'pk')
+    return ordering
+
+
+def with_ordering_columns(queryset, ordering):
+    """Make sure a queryset narrowed with ``only()`` still loads the cursor columns."""
+    names, defer = queryset.query.deferred_loading
+    if defer or not names:
+        return queryset
+    columns = {name.lstrip('-') for name in ordering if name.lstrip('-') not in queryset.query.annotations}
+    columns.discard('pk')
+    return queryset.only(*(set(names) | columns))
+
+
+def _value(row, name):
+    name = name.lstrip('-')
+    return row.pk if name == 'pk' else getattr(row, name)
+
+
+def _json_default(value):
+    # Keep full microsecond precision, unlike DjangoJSONEncoder.
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_cursor(row, ordering):
+    values = [_value(row, name) for name in ordering]
+    return base64.urlsafe_b64encode(json.dumps(values, default=_json_default).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (TypeError, ValueError):
+        raise Exception('Invalid cursor.')
+    if not isinstance(values, list):
+        raise Exception('Invalid cursor.')
+    return values
+
+
+def seek(model, ordering, values, forward=True, inclusive=False):
+    """Build the filter selecting rows after (or before) the row with ``values``, and that row if ``inclusive``."""
+    if len(values) != len(ordering):
+        raise Exception('Invalid cursor.')
+    values = [_to_python(model, name, value) for name, value in zip(ordering, values)]
+    condition = Q()
+    for i, name in enumerate(ordering):
+        lookup = 'lt' if name.startswith('-') == forward else 'gt'
+        if inclusive and i == len(ordering) - 1:
+            lookup += 'e'
+        step = Q(**{'%s__%s' % (name.lstrip('-'), lookup): values[i]})
+        for previous, value in zip(ordering[:i], values):
+            step &= Q(**{previous.lstrip('-'): value})
+        condition |= step
+    # A plain range on the leading column lets the index bound the scan.
+    first = ordering[0]
+    bound = Q(**{'%s__%s' % (first.lstrip('-'), 'lte' if first.startswith('-') == forward else 'gte'): values[0]})
+    return bound & condition
+
+
+def _to_python(model, name, value):
+    name = name.lstrip('-')
+    try:
+        field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return value
+    try:
+        return field.to_python(value)
+    except ValidationError:
+        raise Exception('Invalid cursor.')
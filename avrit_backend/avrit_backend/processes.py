@@ -0,0 +1,18 @@
+"""Process pools for CPU-bound work such as password hashing.
+
+Workers are spawned rather than forked, since a web process has threads
+that may hold locks at the moment of a fork. Each worker sets Django up
+before its first task. This module imports no models, so the workers can
+load it before the app registry is ready.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+def setup_worker():
+    import django
+    django.setup()
+
+
+def process_pool(workers):
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'), initializer=setup_worker)
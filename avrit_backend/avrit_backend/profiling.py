@@ -0,0 +1,311 @@
+"""Per-request profiling and process metrics for the GraphQL endpoint.
+
+With ``GRAPHQL_PROFILING['ENABLED']`` on, every request records the time and
+call count of each resolved field (``ProfilingMiddleware``) and every SQL
+query run on any database connection, flagging queries executed more than
+once with the same parameters (usually an N+1). The report is returned in
+the response ``extensions`` when ``EXTENSIONS`` is on, and aggregated into
+the Prometheus text served at ``/metrics`` when ``METRICS`` is on.
+
+When profiling is off the middleware costs one attribute lookup per field
+and no SQL wrapper is installed. Metrics are counted per process; with
+``METRICS_DIR`` set every worker also writes its counters to a file there,
+and ``/metrics`` reports the sum over all the files.
+"""
+import json
+import os
+import threading
+import uuid
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections
+from promise import Promise, is_thenable
+
+DEFAULTS = {
+    'ENABLED': False,
+    'EXTENSIONS': False,
+    'SLOWEST_FIELDS': 10,
+    'METRICS': True,
+    'METRICS_TOKEN': None,
+    'METRICS_DIR': None,
+}
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Seconds between two writes of a worker's counters to METRICS_DIR.
+FLUSH_INTERVAL = 1.0
+
+
+def profiling_setting(name):
+    return getattr(settings, 'GRAPHQL_PROFILING', {}).get(name, DEFAULTS[name])
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+class Profile(object):
+    """Resolver and SQL timings of one request."""
+    def __init__(self):
+        self.started = perf_counter()
+        self.duration = None
+        self.fields = defaultdict(lambda: [0, 0.0])
+        self.queries = Counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        # Top-level fields may resolve on several threads, see AsyncGraphQLView.
+        self._lock = threading.Lock()
+
+    def record_field(self, key, duration):
+        with self._lock:
+            field = self.fields[key]
+            field[0] += 1
+            field[1] += duration
+
+    def _execute(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            with self._lock:
+                self.sql_count += 1
+                self.sql_time += perf_counter() - start
+                self.queries[(sql, repr(params))] += 1
+
+    @contextmanager
+    def capture_sql(self):
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self._execute))
+            yield
+
+    def finish(self):
+        self.duration = perf_counter() - self.started
+
+    def duplicates(self):
+        return [(sql, params, count) for (sql, params), count in self.queries.items() if count > 1]
+
+    def report(self):
+        slowest = sorted(self.fields.items(), key=lambda item: item[1][1], reverse=True)
+        duplicates = []
+        for sql, params, count in sorted(self.duplicates(), key=lambda item: item[2], reverse=True):
+            duplicate = {'sql': sql, 'count': count}
+            if settings.DEBUG:
+                duplicate['params'] = params
+            duplicates.append(duplicate)
+        return {
+            'duration': _ms(self.duration),
+            'resolvers': {
+                'count': sum(calls for calls, _ in self.fields.values()),
+                'slowest': [
+                    {'field': key, 'calls': calls, 'duration': _ms(duration)}
+                    for key, (calls, duration) in slowest[:profiling_setting('SLOWEST_FIELDS')]
+                ],
+            },
+            'sql': {
+                'count': self.sql_count,
+                'duration': _ms(self.sql_time),
+                'duplicates': duplicates,
+            },
+        }
+
+
+def start_profile(request):
+    """Attach a ``Profile`` to ``request`` if profiling is enabled."""
+    if not profiling_setting('ENABLED'):
+        return None
+    request.graphql_profile = Profile()
+    return request.graphql_profile
+
+
+class ProfilingMiddleware(object):
+    """Times every resolver of a profiled request, including deferred (DataLoader) results."""
+    def resolve(self, next, root, info, **args):
+        profile = getattr(info.context, 'graphql_profile', None)
+        if profile is None:
+            return next(root, info, **args)
+
+        key = '%s.%s' % (info.parent_type.name, info.field_name)
+        start = perf_counter()
+        try:
+            result = next(root, info, **args)
+        except Exception:
+            profile.record_field(key, perf_counter() - start)
+            raise
+        # Resolvers are usually wrapped in promises that are already settled;
+        # only DataLoader results are still pending here.
+        if not is_thenable(result) or (isinstance(result, Promise) and not result.is_pending):
+            profile.record_field(key, perf_counter() - start)
+            return result
+
+        def resolved(value):
+            profile.record_field(key, perf_counter() - start)
+            return value
+
+        def rejected(error):
+            profile.record_field(key, perf_counter() - start)
+            raise error
+        return Promise.resolve(result).then(resolved, rejected)
+
+
+class Metrics(object):
+    """Worker counters, rendered in the Prometheus text format.
+
+    With ``METRICS_DIR`` set, each process writes its counters to a file of
+    its own there, at most every ``FLUSH_INTERVAL`` seconds and before each
+    render, and ``render`` sums the files of all workers. Files of exited
+    workers are kept so that totals never go back; empty the directory when
+    the whole server restarts.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._path = None
+        self._flushed = None
+        self.reset()
+
+    def reset(self):
+        self.requests = Counter()
+        self.duration_sum = 0.0
+        self.duration_buckets = [0] * len(DURATION_BUCKETS)
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.sql_duplicates = 0
+        self.field_calls = Counter()
+        self.field_time = Counter()
+
+    def _check_process(self):
+        # A forked worker starts its own counters and file rather than
+        # reporting the ones it inherited a second time.
+        if self._pid != os.getpid():
+            if self._pid is not None:
+                self.reset()
+            self._pid = os.getpid()
+            self._path = None
+            self._flushed = None
+
+    def observe(self, duration, failed, profile=None):
+        with self._lock:
+            self._check_process()
+            self.requests['error' if failed else 'ok'] += 1
+            self.duration_sum += duration
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    self.duration_buckets[i] += 1
+            if profile is not None:
+                self.sql_count += profile.sql_count
+                self.sql_time += profile.sql_time
+                self.sql_duplicates += sum(count - 1 for _, _, count in profile.duplicates())
+                for key, (calls, field_time) in profile.fields.items():
+                    self.field_calls[key] += calls
+                    self.field_time[key] += field_time
+            directory = profiling_setting('METRICS_DIR')
+            if directory and (self._flushed is None or perf_counter() - self._flushed >= FLUSH_INTERVAL):
+                self._write(directory)
+
+    def _snapshot(self):
+        return {
+            'requests': dict(self.requests),
+            'duration_sum': self.duration_sum,
+            'duration_buckets': list(self.duration_buckets),
+            'sql_count': self.sql_count,
+            'sql_time': self.sql_time,
+            'sql_duplicates': self.sql_duplicates,
+            'field_calls': dict(self.field_calls),
+            'field_time': dict(self.field_time),
+        }
+
+    def _write(self, directory):
+        if self._path is None:
+            os.makedirs(directory, exist_ok=True)
+            self._path = os.path.join(directory, 'metrics-%d-%s.json' % (self._pid, uuid.uuid4().hex))
+        temporary = self._path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(self._snapshot(), f)
+        # Readers see either the previous file or the new one, never a partial write.
+        os.replace(temporary, self._path)
+        self._flushed = perf_counter()
+
+    def totals(self):
+        """Counters of this process, or of all workers with ``METRICS_DIR`` set."""
+        directory = profiling_setting('METRICS_DIR')
+        with self._lock:
+            self._check_process()
+            if not directory:
+                return self._snapshot()
+            self._write(directory)
+        totals = Metrics()._snapshot()
+        for name in sorted(os.listdir(directory)):
+            if not (name.startswith('metrics-') and name.endswith('.json')):
+                continue
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    _add(totals, json.load(f))
+            except (OSError, ValueError):
+                continue
+        return totals
+
+    def render(self, document_cache=None):
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for labels, value in samples:
+                label_text = ','.join('%s="%s"' % (key, _escape(val)) for key, val in labels)
+                lines.append('%s%s %s' % (name, '{%s}' % label_text if label_text else '', _number(value)))
+
+        totals = self.totals()
+        total = sum(totals['requests'].values())
+        metric('graphql_requests_total', 'counter', 'GraphQL requests handled.',
+               [((('status', status),), count) for status, count in sorted(totals['requests'].items())])
+        lines.append('# HELP graphql_request_duration_seconds GraphQL request duration.')
+        lines.append('# TYPE graphql_request_duration_seconds histogram')
+        for bound, count in zip(DURATION_BUCKETS, totals['duration_buckets']):
+            lines.append('graphql_request_duration_seconds_bucket{le="%s"} %d' % (_number(bound), count))
+        lines.append('graphql_request_duration_seconds_bucket{le="+Inf"} %d' % total)
+        lines.append('graphql_request_duration_seconds_sum %s' % _number(totals['duration_sum']))
+        lines.append('graphql_request_duration_seconds_count %s' % _number(total))
+        metric('graphql_sql_queries_total', 'counter', 'SQL queries run by profiled requests.',
+               [((), totals['sql_count'])])
+        metric('graphql_sql_duration_seconds_total', 'counter', 'Time spent in SQL by profiled requests.',
+               [((), totals['sql_time'])])
+        metric('graphql_sql_duplicate_queries_total', 'counter',
+               'Repeated identical SQL queries within a profiled request.', [((), totals['sql_duplicates'])])
+        metric('graphql_resolver_calls_total', 'counter', 'Resolver calls by field.',
+               [((('field', key),), calls) for key, calls in sorted(totals['field_calls'].items())])
+        metric('graphql_resolver_duration_seconds_total', 'counter', 'Resolver time by field.',
+               [((('field', key),), value) for key, value in sorted(totals['field_time'].items())])
+        if document_cache is not None:
+            metric('graphql_document_cache_hits_total', 'counter',
+                   'Parsed document cache hits in the process serving this scrape.', [((), document_cache['hits'])])
+            metric('graphql_document_cache_misses_total', 'counter',
+                   'Parsed document cache misses in the process serving this scrape.',
+                   [((), document_cache['misses'])])
+            metric('graphql_document_cache_size', 'gauge',
+                   'Documents in the parsed document cache of the process serving this scrape.',
+                   [((), document_cache['size'])])
+        return '\n'.join(lines) + '\n'
+
+
+def _add(totals, snapshot):
+    for key in ('requests', 'field_calls', 'field_time'):
+        for name, value in snapshot[key].items():
+            totals[key][name] = totals[key].get(name, 0) + value
+    for key in ('duration_sum', 'sql_count', 'sql_time', 'sql_duplicates'):
+        totals[key] += snapshot[key]
+    totals['duration_buckets'] = [a + b for a, b in zip(totals['duration_buckets'], snapshot['duration_buckets'])]
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+metrics = Metrics()
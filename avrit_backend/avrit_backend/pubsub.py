@@ -0,0 +1,199 @@
+"""Publish/subscribe for GraphQL subscriptions.
+
+``publish(channel, message)`` sends a JSON-serializable message once the
+current transaction commits, on the backend named by
+``SUBSCRIPTIONS['BACKEND']``. ``InMemoryPubSub`` only reaches subscribers
+in the same process. That suits tests and deployments where mutations are
+also served by the ASGI application. ``DatabasePubSub`` reaches every
+process that shares the database, such as gunicorn workers serving
+mutations next to a uvicorn process serving subscriptions. Subclass
+``BrokerPubSub`` to fan messages out through another broker.
+"""
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BACKEND': 'avrit_backend.pubsub.InMemoryPubSub',
+    'OPTIONS': {},
+    'KEEPALIVE': 20,
+}
+
+
+def subscriptions_setting(name):
+    return getattr(settings, 'SUBSCRIPTIONS', {}).get(name, DEFAULTS[name])
+
+
+class InMemoryPubSub(object):
+    """Delivers messages to the subscribers of this process."""
+    def __init__(self, **options):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel, callback):
+        """Call ``callback(message)`` for every message on ``channel``; returns an unsubscribe function.
+
+        Callbacks run on the publishing thread and must return quickly.
+        """
+        with self._lock:
+            self._subscribers[channel].add(callback)
+
+        def unsubscribe():
+            with self._lock:
+                callbacks = self._subscribers.get(channel)
+                if callbacks is not None:
+                    callbacks.discard(callback)
+                    if not callbacks:
+                        del self._subscribers[channel]
+        return unsubscribe
+
+    def publish(self, channel, message):
+        self.deliver(channel, message)
+
+    def deliver(self, channel, message):
+        with self._lock:
+            callbacks = list(self._subscribers.get(channel, ()))
+        for callback in callbacks:
+            try:
+                callback(message)
+            except Exception:
+                logger.exception('Subscriber of %s failed', channel)
+
+
+class BrokerPubSub(InMemoryPubSub):
+    """Base class for backends that fan messages out through an external broker.
+
+    Subclasses implement ``send(data)``, which hands a JSON string to the
+    broker. Every node listens to the broker, for example on a thread started
+    in ``__init__``, and passes each string it receives to ``receive(data)``.
+    """
+    def __init__(self, **options):
+        super(BrokerPubSub, self).__init__(**options)
+        self.options = options
+
+    def publish(self, channel, message):
+        self.send(json.dumps({'channel': channel, 'message': message}))
+
+    def send(self, data):
+        raise NotImplementedError('Broker backends must implement send().')
+
+    def receive(self, data):
+        payload = json.loads(data)
+        self.deliver(payload['channel'], payload['message'])
+
+
+class DatabasePubSub(BrokerPubSub):
+    """Fans messages out through the ``broker.Event`` table.
+
+    ``send`` inserts a row per message. A process reads the rows added
+    since its last poll every ``interval`` seconds, on a thread started by
+    its first subscription; with ``interval=None`` the caller runs
+    ``poll()`` itself. Rows are numbered in the order they were inserted
+    but can commit out of order, so numbers a poll skips over are looked
+    for again for ``grace`` seconds. Rows older than ``retention`` seconds
+    are deleted, so a process that stops polling for longer misses them.
+    """
+    def __init__(self, interval=0.5, grace=5, retention=60 * 60, batch_size=500, **options):
+        super(DatabasePubSub, self).__init__(**options)
+        self.interval = interval
+        self.grace = grace
+        self.retention = retention
+        self.batch_size = batch_size
+        self.last = None
+        self.missing = {}
+        self.cleaned_at = 0
+        self.listener = None
+        self.stopped = threading.Event()
+
+    def subscribe(self, channel, callback):
+        unsubscribe = super(DatabasePubSub, self).subscribe(channel, callback)
+        self.start()
+        return unsubscribe
+
+    def send(self, data):
+        from broker.models import Event
+
+        Event.objects.create(data=data)
+        if time.monotonic() - self.cleaned_at > self.retention / 10:
+            self.cleaned_at = time.monotonic()
+            Event.objects.filter(created_at__lt=timezone.now() - timedelta(seconds=self.retention)).delete()
+
+    def start(self):
+        """Skip the rows already stored and, with an ``interval``, start polling."""
+        from broker.models import Event
+
+        with self._lock:
+            if self.last is not None:
+                return
+            self.last = Event.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+            if self.interval is not None:
+                self.listener = threading.Thread(target=self.listen, name='avrit-pubsub', daemon=True)
+                self.listener.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.listener is not None:
+            self.listener.join()
+
+    def listen(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.poll()
+            except Exception:
+                logger.exception('Polling for pub/sub events failed')
+            finally:
+                close_old_connections()
+
+    def poll(self):
+        """Deliver the messages stored since the last poll; returns how many."""
+        from broker.models import Event
+
+        now = time.monotonic()
+        rows = list(Event.objects.filter(pk__gt=self.last).order_by('pk').values_list('pk', 'data')[:self.batch_size])
+        if self.missing:
+            rows.extend(Event.objects.filter(pk__in=list(self.missing)).values_list('pk', 'data'))
+        for pk, _ in rows:
+            if pk > self.last:
+                self.missing.update((number, now) for number in range(self.last + 1, pk))
+                self.last = pk
+        for pk, data in sorted(rows):
+            self.missing.pop(pk, None)
+            self.receive(data)
+        self.missing = {pk: seen for pk, seen in self.missing.items() if now - seen < self.grace}
+        return len(rows)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_pubsub():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = import_string(subscriptions_setting('BACKEND'))(**subscriptions_setting('OPTIONS'))
+    return _backend
+
+
+def _publish(channel, message):
+    try:
+        get_pubsub().publish(channel, message)
+    except Exception:
+        # The change itself has been committed already.
+        logger.exception('Publishing on %s failed', channel)
+
+
+def publish(channel, message, using=None):
+    """Publish ``message`` on ``channel`` once the current transaction commits."""
+    transaction.on_commit(lambda: _publish(channel, message), using=using)
@@ -0,0 +1,191 @@
+"""Token bucket rate limits for /graphql.
+
+Every request takes tokens from the bucket of its user class (anonymous,
+authenticated or staff), kept per user or, for anonymous clients, per IP
+address. A request takes one token per ``COST_PER_TOKEN`` of its static
+cost (see ``avrit_backend.cost``), and at least one. Root fields with a
+bucket of their own, such as ``Mutation.tokenAuth``, also take one token
+per use from a bucket kept per IP address, so password guessing and sign
+ups are limited however the client authenticates.
+
+A bucket holds up to ``CAPACITY`` tokens and refills at ``RATE`` tokens per
+second. Requests that find a bucket short are answered with 429 and a
+``Retry-After`` header, without running any resolver. Requests that need
+more than ``CAPACITY`` tokens at once, such as a batch of aliased
+``tokenAuth`` fields, could never be served and get 429 without one.
+
+Buckets are stored as the time at which they will be full again (the
+generic cell rate algorithm), so taking tokens is a single update.
+``LocalBackend`` keeps them in process memory, so each process allows the
+full rate; ``CacheBackend`` shares them between processes through a cache
+such as memcached or redis.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+from graphene_django.views import HttpError
+from graphql.language import ast
+
+from avrit_backend.cost import user_class
+
+DEFAULTS = {
+    'ENABLED': True,
+    'BACKEND': 'avrit_backend.ratelimit.LocalBackend',
+    'OPTIONS': {},
+    'BUCKETS': {
+        'anonymous': {'CAPACITY': 60, 'RATE': 2},
+        'authenticated': {'CAPACITY': 120, 'RATE': 5},
+        'staff': None,
+        'Mutation.tokenAuth': {'CAPACITY': 10, 'RATE': 1 / 30},
+        'Mutation.createUser': {'CAPACITY': 5, 'RATE': 1 / 600},
+    },
+    'COST_PER_TOKEN': 1000,
+    'IP_HEADER': None,
+}
+
+
+def rate_limit_setting(name):
+    return getattr(settings, 'GRAPHQL_RATE_LIMIT', {}).get(name, DEFAULTS[name])
+
+
+class LocalBackend(object):
+    """Buckets in the memory of this process; the least recently used are dropped past ``max_keys``."""
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self.full_at = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key, tokens, capacity, rate):
+        """Take ``tokens`` from bucket ``key``; return 0, or the seconds until it has enough."""
+        now = time.monotonic()
+        with self.lock:
+            full_at = max(self.full_at.get(key, now), now) + tokens / rate
+            wait = full_at - now - capacity / rate
+            if wait > 0:
+                return wait
+            self.full_at[key] = full_at
+            self.full_at.move_to_end(key)
+            if len(self.full_at) > self.max_keys:
+                self.full_at.popitem(last=False)
+        return 0
+
+
+class CacheBackend(object):
+    """Buckets in a Django cache shared by all processes.
+
+    Each bucket is an integer in milliseconds changed with ``incr``, which is
+    atomic on memcached and redis. A bucket that is left to refill is reset
+    with ``set``; clients racing for it at that moment may get a token each
+    for free. Buckets expire ``timeout`` seconds after their last reset.
+    """
+    def __init__(self, cache='default', prefix='rate-limit:', timeout=60 * 60):
+        self.cache = cache
+        self.prefix = prefix
+        self.timeout = timeout
+
+    def take(self, key, tokens, capacity, rate):
+        cache = caches[self.cache]
+        key = self.prefix + key
+        now = int(time.time() * 1000)
+        step = int(1000 * tokens / rate)
+        burst = int(1000 * capacity / rate)
+        timeout = max(self.timeout, 2 * burst // 1000)
+        try:
+            full_at = cache.incr(key, step)
+        except ValueError:
+            if cache.add(key, now + step, timeout):
+                return 0
+            full_at = cache.incr(key, step)
+        if full_at - step < now:
+            cache.set(key, now + step, timeout)
+            return 0
+        wait = full_at - now - burst
+        if wait > 0:
+            cache.decr(key, step)
+            return wait / 1000
+        return 0
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = import_string(rate_limit_setting('BACKEND'))(**rate_limit_setting('OPTIONS'))
+    return _backend
+
+
+def client_ip(request):
+    """The client address; with ``IP_HEADER`` set, the last address the front proxy added to it."""
+    header = rate_limit_setting('IP_HEADER')
+    if header and request.META.get(header):
+        return request.META[header].split(',')[-1].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _response_keys(selection_set, fragments, visited=frozenset()):
+    for selection in selection_set.selections:
+        if isinstance(selection, ast.Field):
+            yield (selection.alias or selection.name).value, selection.name.value
+        elif isinstance(selection, ast.InlineFragment):
+            yield from _response_keys(selection.selection_set, fragments, visited)
+        elif isinstance(selection, ast.FragmentSpread):
+            name = selection.name.value
+            if name in fragments and name not in visited:
+                yield from _response_keys(fragments[name].selection_set, fragments, visited | {name})
+
+
+def root_field_uses(document_ast, operation):
+    """How many times each root field of ``operation`` runs, by field name."""
+    fragments = {
+        definition.name.value: definition
+        for definition in document_ast.definitions
+        if isinstance(definition, ast.FragmentDefinition)
+    }
+    uses = {}
+    for _, name in set(_response_keys(operation.selection_set, fragments)):
+        uses[name] = uses.get(name, 0) + 1
+    return uses
+
+
+def throttle(request, schema, user, document_ast=None, operation=None, cost=None):
+    """Take the tokens of one GraphQL request; raise ``HttpError`` (429) if a bucket is short."""
+    if not rate_limit_setting('ENABLED'):
+        return
+    buckets = rate_limit_setting('BUCKETS')
+    name = user_class(user)
+    ip = client_ip(request)
+    tokens = max(1, math.ceil((cost or 0) / rate_limit_setting('COST_PER_TOKEN')))
+    takes = [(name, 'ip:' + ip if user is None else 'user:%s' % user.pk, tokens)]
+    if operation is not None:
+        root = {
+            'query': schema.get_query_type,
+            'mutation': schema.get_mutation_type,
+            'subscription': schema.get_subscription_type,
+        }[operation.operation]()
+        for field, uses in root_field_uses(document_ast, operation).items():
+            takes.append(('%s.%s' % (root.name, field), 'ip:' + ip, uses))
+    takes = [(name, client, tokens, buckets[name]) for name, client, tokens in takes if buckets.get(name)]
+    for name, _, tokens, bucket in takes:
+        if tokens > bucket['CAPACITY']:
+            raise HttpError(
+                HttpResponse(status=429),
+                'A request may take at most %d tokens from %s, not %d.' % (bucket['CAPACITY'], name, tokens),
+            )
+    backend = get_backend()
+    for name, client, tokens, bucket in takes:
+        wait = backend.take('%s:%s' % (name, client), tokens, bucket['CAPACITY'], bucket['RATE'])
+        if wait:
+            response = HttpResponse(status=429)
+            response['Retry-After'] = str(math.ceil(wait))
+            raise HttpError(response, 'Rate limit exceeded for %s; retry in %d seconds.' % (name, math.ceil(wait)))
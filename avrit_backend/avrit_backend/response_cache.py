@@ -0,0 +1,212 @@
+"""Response cache for anonymous read queries.
+
+Results are stored in Django's cache, keyed by the normalized query text,
+operation name and variables. Only anonymous query operations whose root
+fields all have a TTL hint in ``GRAPHQL_RESPONSE_CACHE['FIELD_TTLS']`` are
+cached, for the smallest TTL among them.
+
+While a cacheable query runs, ``CacheTagMiddleware`` records a tag for every
+model instance a field was resolved on, plus a model-wide tag for every
+connection. Model signals call ``invalidate()`` once the transaction that
+changed a row commits, so editing one post only evicts the queries that
+actually touched it.
+
+Invalidations are numbered by a counter in the cache, and each tag holds
+the number of its last invalidation. ``lookup`` reads the counter before
+the query runs and ``store`` saves it with the entry; an entry is served
+only while none of its tags was invalidated after that, so a change that
+commits while the query runs can't be cached as current.
+"""
+import hashlib
+import json
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import models, transaction
+from graphql.language import ast
+from graphql.language.printer import print_ast
+from graphql.type import GraphQLList
+
+from avrit_backend.documents import get_operation
+
+DEFAULTS = {
+    'CACHE': 'default',
+    'FIELD_TTLS': {},
+}
+
+
+def cache_setting(name):
+    return getattr(settings, 'GRAPHQL_RESPONSE_CACHE', {}).get(name, DEFAULTS[name])
+
+
+def get_cache():
+    return caches[cache_setting('CACHE')]
+
+
+def model_tag(model):
+    return model._meta.label
+
+
+def instance_tag(model, pk):
+    return '%s:%s' % (model._meta.label, pk)
+
+
+def _tag_key(tag):
+    return 'graphql-response-tag:' + tag
+
+
+GENERATION_KEY = 'graphql-response-generation'
+
+
+def _generation(cache, step=0):
+    """The number of the last invalidation, plus ``step``."""
+    # After an eviction the counter starts again past the numbers handed out before.
+    cache.add(GENERATION_KEY, int(time.time() * 1000), None)
+    return cache.incr(GENERATION_KEY, step)
+
+
+def _invalidate(tags):
+    cache = get_cache()
+    generation = _generation(cache, 1)
+    cache.set_many({_tag_key(tag): generation for tag in tags}, None)
+
+
+def invalidate(*tags, using=None):
+    """Evict every response that recorded one of ``tags``, once the current transaction commits."""
+    if tags:
+        transaction.on_commit(partial(_invalidate, tags), using=using)
+
+
+def _tags(model, pks, changed_list, related, lists):
+    tags = [instance_tag(model, pk) for pk in pks]
+    tags.extend(instance_tag(related_model, pk) for related_model, pk in related if pk is not None)
+    if changed_list:
+        tags.append(model_tag(model))
+    tags.extend(model_tag(listed) for listed in lists)
+    return tags
+
+
+def invalidate_instance(instance, changed_list=False, related=(), lists=()):
+    """Evict responses that touched ``instance`` or the ``related`` (model, pk) pairs.
+
+    ``changed_list`` also evicts every list of the instance's model, for
+    creations, deletions and edits that can move it in or out of a list or
+    within one; ``lists`` does the same for other models, such as a post
+    whose counters the instance changed.
+    """
+    tags = _tags(type(instance), [instance.pk], changed_list, related, lists)
+    invalidate(*tags, using=instance._state.db)
+
+
+def invalidate_instances(model, pks, changed_list=False, related=(), lists=(), using=None):
+    """``invalidate_instance`` for a batch of ``model`` rows, in one cache write."""
+    invalidate(*_tags(model, pks, changed_list, related, lists), using=using)
+
+
+class CachePlan(object):
+    def __init__(self, key, ttl):
+        self.key = key
+        self.ttl = ttl
+        # Set by lookup(), before the query runs.
+        self.generation = None
+
+
+def is_anonymous(request):
+    # Importing graphql_jwt loads all of its mutations; review.signals
+    # imports this module in every process, management commands included.
+    from graphql_jwt.utils import get_http_authorization
+
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return False
+    return get_http_authorization(request) is None
+
+
+def plan(request, document, variables, operation_name):
+    """Return a ``CachePlan`` if this request may be served from the cache."""
+    ttls = cache_setting('FIELD_TTLS')
+    if not ttls or not is_anonymous(request):
+        return None
+    operation = get_operation(document.document_ast, operation_name)
+    if operation is None or operation.operation != 'query':
+        return None
+    field_ttls = []
+    for selection in operation.selection_set.selections:
+        if not isinstance(selection, ast.Field):
+            return None
+        name = selection.name.value
+        if name == '__typename':
+            continue
+        if name not in ttls:
+            return None
+        field_ttls.append(ttls[name])
+    if not field_ttls:
+        return None
+
+    normalized = getattr(document, 'normalized', None)
+    if normalized is None:
+        normalized = document.normalized = print_ast(document.document_ast)
+    source = json.dumps([normalized, operation_name, variables or {}], sort_keys=True, default=str)
+    return CachePlan('graphql-response:' + hashlib.sha256(source.encode('utf-8')).hexdigest(), min(field_ttls))
+
+
+def lookup(cache_plan):
+    """Return the cached data for ``cache_plan`` if none of its tags changed since it was stored."""
+    cache = get_cache()
+    cache_plan.generation = _generation(cache)
+    entry = cache.get(cache_plan.key)
+    if entry is None:
+        return None
+    versions = cache.get_many([_tag_key(tag) for tag in entry['tags']])
+    for tag in entry['tags']:
+        # A tag missing from the cache may have been evicted along with its last invalidation.
+        version = versions.get(_tag_key(tag))
+        if version is None or version > entry['generation']:
+            return None
+    return entry['data']
+
+
+def store(cache_plan, data, tags):
+    """Cache ``data`` as of the generation ``lookup`` saw before the query ran."""
+    cache = get_cache()
+    versions = cache.get_many([_tag_key(tag) for tag in tags])
+    for tag in tags:
+        if _tag_key(tag) not in versions:
+            cache.add(_tag_key(tag), 0, None)
+    entry = {
+        'data': data,
+        'tags': sorted(tags),
+        'generation': cache_plan.generation,
+    }
+    cache.set(cache_plan.key, entry, cache_plan.ttl)
+
+
+def _listed_model(info):
+    """The model listed by a connection field, or by a list field on the root type."""
+    graphql_type = info.return_type
+    is_list = False
+    while hasattr(graphql_type, 'of_type'):
+        is_list = is_list or isinstance(graphql_type, GraphQLList)
+        graphql_type = graphql_type.of_type
+    meta = getattr(getattr(graphql_type, 'graphene_type', None), '_meta', None)
+    node = getattr(meta, 'node', None)
+    if node is not None:
+        return getattr(node._meta, 'model', None)
+    if is_list and info.parent_type is info.schema.get_query_type():
+        return getattr(meta, 'model', None)
+    return None
+
+
+class CacheTagMiddleware(object):
+    """Record the cache tags of a cacheable query on ``info.context.cache_tags``."""
+    def resolve(self, next, root, info, **args):
+        tags = getattr(info.context, 'cache_tags', None)
+        if tags is not None:
+            if isinstance(root, models.Model):
+                tags.add(instance_tag(type(root), root.pk))
+            model = _listed_model(info)
+            if model is not None:
+                tags.add(model_tag(model))
+        return next(root, info, **args)
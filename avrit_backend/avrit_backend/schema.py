@@ -5,7 +5,10 @@ import profiles_api.schema
 class Query(profiles_api.schema.Query, review.schema.QueryPost, graphene.ObjectType):
     pass
 
-class Mutation(profiles_api.schema.Mutation, graphene.ObjectType):
+class Mutation(profiles_api.schema.Mutation, review.schema.MutationPost, graphene.ObjectType):
     pass
 
-schema = graphene.Schema(query=Query, mutation=Mutation)
+class Subscription(review.schema.SubscriptionPost, graphene.ObjectType):
+    pass
+
+schema = graphene.Schema(query=Query, mutation=Mutation, subscription=Subscription)
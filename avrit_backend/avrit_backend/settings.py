@@ -40,14 +40,17 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'graphene_django',
     'corsheaders',
-    'review',
-    'profiles_api',
+    'review.apps.ReviewConfig',
+    'profiles_api.apps.ProfilesApiConfig',
+    'blobs.apps.BlobsConfig',
+    'broker.apps.BrokerConfig',
     
 ]
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'avrit_backend.db.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -80,13 +83,38 @@ WSGI_APPLICATION = 'avrit_backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
+# Connections stay open for CONN_MAX_AGE seconds and are reused by the
+# next request on the same thread, so each worker thread keeps one
+# connection per database.
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
     }
 }
 
+# Read replicas: add each one to DATABASES and list its alias in
+# DATABASE_ROUTING['REPLICAS'], e.g.
+#
+#     DATABASES['replica'] = dict(DATABASES['default'], NAME=..., TEST={'MIRROR': 'default'})
+#
+# GraphQL queries and GET requests read from a replica; mutations, reads
+# after a write in the same request, and requests from a client that wrote
+# within PIN_SECONDS go to the primary. See avrit_backend.db.
+if os.environ.get('DB_REPLICA_NAME'):
+    DATABASES['replica'] = dict(
+        DATABASES['default'], NAME=os.environ['DB_REPLICA_NAME'], TEST={'MIRROR': 'default'}
+    )
+
+DATABASE_ROUTERS = ['avrit_backend.db.ReplicaRouter']
+
+DATABASE_ROUTING = {
+    'REPLICAS': ['replica'],
+    'PIN_SECONDS': 5,
+    'PIN_COOKIE': 'db_pin',
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -140,11 +168,147 @@ GRAPHENE = {
     'SCHEMA': 'avrit_backend.schema.schema',
      'MIDDLEWARE': [
         'graphql_jwt.middleware.JSONWebTokenMiddleware',
+        'avrit_backend.response_cache.CacheTagMiddleware',
+        'avrit_backend.profiling.ProfilingMiddleware',
     ],
 }
 
+# Static cost limits per user class, checked before a query runs. Fields
+# with a selection cost 1 and scalars 0 unless listed in FIELD_COSTS;
+# connections multiply by first/last and plain lists by LIST_SIZE.
+GRAPHQL_COST = {
+    'LIMITS': {
+        'anonymous': {'MAX_DEPTH': 10, 'MAX_COST': 5000},
+        'authenticated': {'MAX_DEPTH': 12, 'MAX_COST': 20000},
+        'staff': {'MAX_DEPTH': None, 'MAX_COST': None},
+    },
+    'FIELD_COSTS': {
+        'Mutation.tokenAuth': 10,
+    },
+    'LIST_SIZE': 20,
+}
+
+# Token buckets for /graphql: CAPACITY tokens, refilled at RATE per second.
+# Requests take a token per COST_PER_TOKEN of their cost from the bucket of
+# their user class, and the root fields listed here one per use from a bucket
+# per IP address. Set IP_HEADER (e.g. 'HTTP_X_FORWARDED_FOR') behind a proxy,
+# and use avrit_backend.ratelimit.CacheBackend to share buckets between
+# processes.
+GRAPHQL_RATE_LIMIT = {
+    'BACKEND': 'avrit_backend.ratelimit.LocalBackend',
+    'BUCKETS': {
+        'anonymous': {'CAPACITY': 60, 'RATE': 2},
+        'authenticated': {'CAPACITY': 120, 'RATE': 5},
+        'staff': None,
+        'Mutation.tokenAuth': {'CAPACITY': 10, 'RATE': 1 / 30},
+        'Mutation.createUser': {'CAPACITY': 5, 'RATE': 1 / 600},
+    },
+    'COST_PER_TOKEN': 1000,
+    'IP_HEADER': None,
+}
+
+# Resolver and SQL profiling of /graphql requests. EXTENSIONS returns each
+# request's profile in the response; METRICS aggregates them at /metrics,
+# open to staff users and to "Authorization: Bearer <METRICS_TOKEN>".
+GRAPHQL_PROFILING = {
+    'ENABLED': DEBUG,
+    'EXTENSIONS': DEBUG,
+    'METRICS': True,
+    'METRICS_TOKEN': os.environ.get('METRICS_TOKEN'),
+    # Directory where every worker writes its counters so that /metrics
+    # reports all of them; without it each worker only reports its own.
+    'METRICS_DIR': os.environ.get('METRICS_DIR'),
+}
+
+GRAPHQL_DOCUMENTS = {
+    'CACHE_SIZE': 500,
+    'PERSISTED_QUERIES_CACHE': 'default',
+    'PERSISTED_QUERIES_TIMEOUT': 60 * 60 * 24,
+}
+
+GRAPHQL_RESPONSE_CACHE = {
+    'CACHE': 'default',
+    # Root fields that anonymous clients may be served from cache, with
+    # their TTL in seconds. Queries touching any other root field bypass it.
+    'FIELD_TTLS': {
+        'allPost': 60,
+        'post': 300,
+        'pubAllProfile': 300,
+        'pubProfile': 300,
+    },
+}
+
+# Background work such as profile image resizing, run by
+# `manage.py run_tasks` workers. Use avrit_backend.tasks.ThreadPoolBackend
+# to run tasks in the web process instead, ImmediateBackend to run them
+# inline, or subclass avrit_backend.tasks.BrokerBackend to hand them to an
+# external broker.
+TASK_QUEUE = {
+    'BACKEND': 'avrit_backend.tasks.DatabaseBackend',
+    'OPTIONS': {'visibility_timeout': 10 * 60, 'retry_delay': 60, 'max_attempts': 3},
+}
+
+# Post and review file uploads. Sizes are in bytes; chunked uploads must
+# send CHUNK_SIZE chunks, one at a time, each within CHUNK_TIMEOUT seconds,
+# and abandoned sessions expire after SESSION_TIMEOUT seconds. Run
+# `manage.py clear_upload_sessions` to reclaim their disk space.
+UPLOADS = {
+    'MAX_FILE_SIZE': 100 * 1024 * 1024,
+    'USER_QUOTA': 1024 * 1024 * 1024,
+    'CHUNK_SIZE': 4 * 1024 * 1024,
+    'SESSION_TIMEOUT': 60 * 60 * 24,
+    'CHUNK_TIMEOUT': 10 * 60,
+}
+
+# Access to MEDIA_URL by path prefix under MEDIA_ROOT; the longest match
+# wins. Post and review files are checked against the uploads that refer
+# to them, see review.access. Set SENDFILE to 'x-accel' (nginx, with an internal location at
+# SENDFILE_PREFIX aliased to MEDIA_ROOT) or 'x-sendfile' to let the front
+# proxy send file bodies.
+MEDIA_SERVING = {
+    'ACCESS': {
+        '': 'staff',
+        'post/': 'review.access.post_file',
+        'review/': 'review.access.review_file',
+        'profileimagesdata/': 'public',
+    },
+    'SENDFILE': None,
+    'SENDFILE_PREFIX': '/protected-media/',
+    'MAX_AGE': 60 * 60 * 24,
+}
+
+# Uploaded files are stored once per content hash, see blobs.storage. Run
+# `manage.py collect_blobs` to delete files that nothing has referred to for
+# GRACE_PERIOD seconds.
+DEFAULT_FILE_STORAGE = 'blobs.storage.ContentAddressedStorage'
+
+BLOBS = {
+    'GRACE_PERIOD': 60 * 60 * 24,
+}
+
+# Worker boot. With PRELOAD the URLconf and the GraphQL schema are loaded
+# when avrit_backend.wsgi or .asgi is imported, so `gunicorn --preload`
+# builds them once in the master for every worker. `manage.py
+# profile_startup` reports import time per module and fails if
+# django.setup() imports any of LAZY_MODULES.
+STARTUP = {
+    'PRELOAD': os.environ.get('STARTUP_PRELOAD') == '1',
+    'LAZY_MODULES': ('PIL', 'profiles_api.images', 'review.imports', 'multiprocessing', 'graphql_jwt'),
+}
+
+# Replaced revisions of text uploads are kept as line deltas against the
+# next revision, see review.revisions.
+REVISIONS = {
+    'DELTA_MAX_SIZE': 1024 * 1024,
+    'DELTA_MAX_RATIO': 0.5,
+    'KEYFRAME_INTERVAL': 10,
+}
+
+# Multipart uploads are streamed to temporary files and hashed on the way in.
+FILE_UPLOAD_HANDLERS = ['avrit_backend.uploads.HashingFileUploadHandler']
+
 AUTHENTICATION_BACKENDS = [
-    'graphql_jwt.backends.JSONWebTokenBackend',
+    'avrit_backend.auth.CachedJSONWebTokenBackend',
     'django.contrib.auth.backends.ModelBackend',
 ]
 
@@ -153,6 +317,64 @@ GRAPHQL_JWT = {
     'JWT_EXPIRATION_DELTA': timedelta(days=1),
 }
 
+# Verified JWT payloads are cached until the token expires (at most
+# TOKEN_TIMEOUT seconds) and users for USER_TIMEOUT seconds; saving a
+# UserProfile or changing its groups or permissions drops it from the cache.
+AUTH_CACHE = {
+    'CACHE': 'default',
+    'TOKEN_TIMEOUT': 60 * 60,
+    'USER_TIMEOUT': 60,
+}
+
+# /graphql as an async view, on by default under avrit_backend.asgi. Requests
+# run on REQUEST_WORKERS threads and the top-level fields of a query on
+# FIELD_WORKERS threads; each thread holds its own database connection.
+GRAPHQL_ASYNC = {
+    'ENABLED': os.environ.get('GRAPHQL_ASYNC') == '1',
+    'REQUEST_WORKERS': 32,
+    'FIELD_WORKERS': 16,
+}
+
+# Pub/sub for GraphQL subscriptions over websockets (avrit_backend.asgi).
+# DatabasePubSub passes messages through the database, so mutations served
+# by gunicorn workers reach subscribers of the uvicorn process; OPTIONS sets
+# its polling interval. InMemoryPubSub only reaches clients connected to
+# the process that made the change.
+SUBSCRIPTIONS = {
+    'BACKEND': 'avrit_backend.pubsub.DatabasePubSub',
+    'OPTIONS': {'interval': 0.5},
+    'KEEPALIVE': 20,
+}
+
+# suggestedReviewers ranks public profiles by research interest, dividing
+# each score by 1 + LOAD_PENALTY * reviews written in the last
+# LOAD_WINDOW_DAYS days.
+REVIEWER_MATCHING = {
+    'CACHE': 'default',
+    'LOAD_WINDOW_DAYS': 30,
+    'LOAD_PENALTY': 0.25,
+    'MAX_SUGGESTIONS': 50,
+}
+
+# /export/<resource>.<ndjson|csv> and the export_data command stream rows
+# in CHUNK_SIZE batches from a server-side cursor. Staff users may export,
+# as may requests with "Authorization: Bearer <TOKEN>" when TOKEN is set.
+EXPORT = {
+    'CHUNK_SIZE': 2000,
+    'OVERLAP': 60,
+    'TOKEN': os.environ.get('EXPORT_TOKEN'),
+}
+
+# Bulk imports (manage.py import_data, Posts > Bulk import in the admin)
+# validate and insert CHUNK_SIZE rows per transaction and hash passwords on
+# HASH_WORKERS processes (None: one per CPU). Imports from the admin run on
+# the TASK_QUEUE.
+IMPORT = {
+    'CHUNK_SIZE': 1000,
+    'HASH_WORKERS': None,
+    'MAX_ERRORS': 1000,
+}
+
 STATIC_URL = '/static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT=os.path.join(BASE_DIR, "upload")
@@ -0,0 +1,12 @@
+"""Settings for ``manage.py test``.
+
+The tests get a read replica that, unlike a mirror, is a database of its
+own: it only holds the rows a test copies to it, so a read routed to it
+misses recent writes the way a lagging replica does.
+"""
+import os
+
+from avrit_backend.settings import *  # noqa: F401,F403
+from avrit_backend.settings import BASE_DIR, DATABASES
+
+DATABASES['replica'] = dict(DATABASES['default'], NAME=os.path.join(BASE_DIR, 'db_replica.sqlite3'), TEST={})
@@ -0,0 +1,137 @@
+"""Worker boot: preloading before fork, and measuring import time.
+
+``preload`` does the work each worker would otherwise do on its first
+request: it loads the URLconf with every view and builds the GraphQL
+schema. With ``STARTUP['PRELOAD']`` it runs when ``avrit_backend.wsgi`` or
+``avrit_backend.asgi`` is imported, so under ``gunicorn --preload`` the
+master process does it once and the workers share the result copy-on-write.
+``gc.freeze()`` moves everything loaded so far out of the collector's reach,
+since a collection in a worker would otherwise write to every page it scans.
+
+Heavy modules that only some code paths need (Pillow, the bulk importer and
+its process pool, graphql_jwt) are imported where they are used, not at
+module level. ``profile_imports`` boots Django in a fresh interpreter under
+``python -X importtime``; ``manage.py profile_startup`` reports the result
+and fails if ``django.setup()`` imports any of ``LAZY_MODULES`` or boot
+time regresses against a baseline.
+"""
+import gc
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+
+DEFAULTS = {
+    'PRELOAD': False,
+    'LAZY_MODULES': ('PIL', 'profiles_api.images', 'review.imports', 'multiprocessing', 'graphql_jwt'),
+}
+# What a management command loads, and what a worker loads before its first request.
+STAGES = {
+    'setup': 'import django\ndjango.setup()\n',
+    'server': (
+        'import django\ndjango.setup()\n'
+        'from avrit_backend.startup import preload\npreload(freeze=False)\n'
+    ),
+}
+IMPORT_TIME = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+TIMER = 'import time\n_started = time.perf_counter()\n%sprint(time.perf_counter() - _started)\n'
+
+
+def startup_setting(name):
+    return getattr(settings, 'STARTUP', {}).get(name, DEFAULTS[name])
+
+
+def preload(freeze=True):
+    """Load the URLconf and the GraphQL schema now; call before the server forks."""
+    from django.urls import get_resolver
+    from graphene_django.settings import graphene_settings
+    from graphql import parse, validate
+
+    get_resolver().url_patterns
+    # Validation sets up the schema's lookup tables on first use.
+    validate(graphene_settings.SCHEMA, parse('{ __typename }'))
+    if freeze:
+        gc.collect()
+        gc.freeze()
+
+
+def _boot(stage, importtime=False):
+    command = [sys.executable]
+    if importtime:
+        command += ['-X', 'importtime']
+    command += ['-c', TIMER % STAGES[stage]]
+    # manage.py has put the settings module, --settings included, in the environment.
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    result = subprocess.run(command, cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+    if result.returncode:
+        raise Exception('Booting Django failed:\n%s' % result.stderr[-2000:])
+    return float(result.stdout.split()[-1]) * 1000, result.stderr
+
+
+def parse_importtime(output):
+    """``{module: (self ms, cumulative ms, depth)}`` from ``-X importtime`` output."""
+    modules = {}
+    for line in output.splitlines():
+        match = IMPORT_TIME.match(line)
+        if match is not None:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules[name] = (int(self_us) / 1000, int(cumulative_us) / 1000, len(indent) // 2)
+    return modules
+
+
+def by_package(modules):
+    """Self time of ``modules`` summed by top-level package."""
+    packages = {}
+    for name, (self_ms, _, _) in modules.items():
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0) + self_ms
+    return packages
+
+
+def profile_imports(stage, runs=5):
+    """Boot ``stage`` ``runs`` times; returns the median boot time and the modules it imported.
+
+    Boot times are measured without ``-X importtime``, which slows every
+    import down. Module times are the fastest of as many runs with it.
+    """
+    _boot(stage)  # Writes any stale bytecode first.
+    boot_ms = statistics.median(_boot(stage)[0] for _ in range(runs))
+    modules = {}
+    for _ in range(runs):
+        for name, times in parse_importtime(_boot(stage, importtime=True)[1]).items():
+            modules[name] = min(modules[name], times) if name in modules else times
+    return {'boot_ms': boot_ms, 'modules': modules}
+
+
+def eager_imports(modules):
+    """The ``LAZY_MODULES`` that were imported anyway."""
+    return [
+        name for name in startup_setting('LAZY_MODULES')
+        if any(module == name or module.startswith(name + '.') for module in modules)
+    ]
+
+
+def compare(results, baseline, tolerance=0.25, floor=20.0, package_floor=5.0):
+    """Describe each regression of ``results`` (by stage) against ``baseline``.
+
+    Boot time counts when it exceeds the baseline by more than the tolerance
+    fraction and by more than ``floor`` milliseconds. A package that the
+    baseline did not import counts when it takes more than ``package_floor``
+    milliseconds. Import times of single packages vary too much between runs
+    to compare otherwise.
+    """
+    regressions = []
+    for stage, result in sorted(results.items()):
+        base = baseline.get(stage)
+        if base is None:
+            continue
+        if result['boot_ms'] > max(base['boot_ms'] * (1 + tolerance), base['boot_ms'] + floor):
+            regressions.append('%s: boot %.0f ms, baseline %.0f ms' % (stage, result['boot_ms'], base['boot_ms']))
+        for package, self_ms in sorted(result['packages'].items()):
+            if package not in base['packages'] and self_ms > package_floor:
+                regressions.append('%s: %s is now imported (%.1f ms)' % (stage, package, self_ms))
+    return regressions
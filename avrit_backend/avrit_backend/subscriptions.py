@@ -0,0 +1,299 @@
+"""GraphQL over websockets, served by the ASGI application.
+
+``GraphQLWebSocketApplication`` speaks both the ``graphql-transport-ws``
+protocol and the older Apollo ``graphql-ws`` protocol. A connection
+authenticates once with a JWT in the ``connection_init`` payload, either as
+``authToken`` or as an ``Authorization: JWT <token>`` entry. Cookies are not
+used, so a page on another origin can't act as the user.
+
+Documents go through the same parse-and-validate cache and cost limits as
+``/graphql``. A subscription resolver returns
+``info.context.listen(channel)``, an Rx observable of the messages
+published on that pub/sub channel, usually mapped to model instances.
+Each message is executed against the subscription's selection in a worker
+thread. Messages for one subscription are handled in the order they were
+published.
+"""
+import asyncio
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from graphene_django.settings import graphene_settings
+from graphene_django.views import GraphQLView
+from graphql.execution import ExecutionResult
+from promise import is_thenable
+from rx import Observable
+from rx.subjects import Subject
+
+from avrit_backend.auth import get_token_user
+from avrit_backend.cost import check_cost
+from avrit_backend.documents import document_backend
+from avrit_backend.pubsub import get_pubsub, subscriptions_setting
+
+logger = logging.getLogger(__name__)
+
+GRAPHQL_WS = 'graphql-ws'
+GRAPHQL_TRANSPORT_WS = 'graphql-transport-ws'
+PROTOCOLS = (GRAPHQL_TRANSPORT_WS, GRAPHQL_WS)
+
+# Close codes of graphql-transport-ws.
+INVALID_MESSAGE = 4400
+UNAUTHORIZED = 4401
+SUBSCRIBER_EXISTS = 4409
+TOO_MANY_INIT_REQUESTS = 4429
+
+
+class SubscriptionContext(object):
+    """``info.context`` of an operation run over a websocket."""
+    def __init__(self, user):
+        self.user = user
+        self.loaders = None
+        self.channels = []
+
+    def listen(self, channel):
+        """An observable of the messages published on ``channel`` while the operation runs."""
+        subject = Subject()
+        self.channels.append((channel, subject))
+        return subject
+
+
+class Operation(object):
+    def __init__(self, context):
+        self.context = context
+        self.results = []
+        self.disposable = None
+        self.unsubscribers = []
+        self.task = None
+
+    def stop(self):
+        for unsubscribe in self.unsubscribers:
+            unsubscribe()
+        if self.disposable is not None:
+            self.disposable.dispose()
+        if self.task is not None:
+            self.task.cancel()
+
+
+def _settle(value):
+    return value.get() if is_thenable(value) else value
+
+
+def format_result(result):
+    data = result.data
+    if data:
+        data = {key: _settle(value) for key, value in data.items()}
+    return ExecutionResult(data=data, errors=result.errors, invalid=result.invalid).to_dict(
+        format_error=GraphQLView.format_error, dict_class=dict
+    )
+
+
+def execute(context, payload):
+    """Run the operation in ``payload``; returns an ``ExecutionResult`` or, for a subscription, an observable."""
+    query = payload.get('query')
+    variables = payload.get('variables') or {}
+    operation_name = payload.get('operationName')
+    if not isinstance(query, str) or not isinstance(variables, dict):
+        return ExecutionResult(errors=[Exception('Must provide a query string.')], invalid=True)
+    close_old_connections()
+    try:
+        document = document_backend.document_from_string(graphene_settings.SCHEMA, query)
+    except Exception as e:
+        return ExecutionResult(errors=[e], invalid=True)
+    if document.valid:
+        _, error = check_cost(graphene_settings.SCHEMA, document, variables, operation_name, context.user)
+        if error is not None:
+            return ExecutionResult(errors=[error], invalid=True)
+    result = document.execute(
+        context_value=context,
+        variable_values=variables,
+        operation_name=operation_name,
+        allow_subscriptions=True,
+    )
+    if not isinstance(result, Observable):
+        result = format_result(result)
+    close_old_connections()
+    return result
+
+
+def deliver(operation, subject, message):
+    """Push one pub/sub message through an operation; returns the payloads to send."""
+    close_old_connections()
+    operation.context.loaders = None
+    try:
+        subject.on_next(message)
+    finally:
+        close_old_connections()
+    payloads, operation.results[:] = list(operation.results), []
+    return payloads
+
+
+class GraphQLWebSocket(object):
+    """One websocket connection."""
+    def __init__(self, scope, receive, send):
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.protocol = None
+        self.user = None
+        self.acknowledged = False
+        self.operations = {}
+        self.keepalive = None
+        self.loop = asyncio.get_event_loop()
+
+    async def run(self):
+        try:
+            while True:
+                event = await self.receive()
+                if event['type'] == 'websocket.connect':
+                    if not await self.connect():
+                        return
+                elif event['type'] == 'websocket.receive':
+                    if not await self.received(event.get('text') or (event.get('bytes') or b'').decode('utf-8', 'replace')):
+                        return
+                elif event['type'] == 'websocket.disconnect':
+                    return
+        finally:
+            for operation in self.operations.values():
+                operation.stop()
+            self.operations.clear()
+            if self.keepalive is not None:
+                self.keepalive.cancel()
+
+    async def connect(self):
+        offered = self.scope.get('subprotocols') or []
+        self.protocol = next((protocol for protocol in PROTOCOLS if protocol in offered), None)
+        if self.protocol is None:
+            await self.send({'type': 'websocket.close', 'code': 1002})
+            return False
+        await self.send({'type': 'websocket.accept', 'subprotocol': self.protocol})
+        return True
+
+    async def send_message(self, type, id=None, payload=None):
+        message = {'type': type}
+        if id is not None:
+            message['id'] = id
+        if payload is not None:
+            message['payload'] = payload
+        await self.send({'type': 'websocket.send', 'text': json.dumps(message)})
+
+    async def close(self, code, reason=''):
+        await self.send({'type': 'websocket.close', 'code': code, 'reason': reason})
+
+    async def received(self, text):
+        """Handle one client message; returns ``False`` once the connection is closed."""
+        try:
+            message = json.loads(text)
+            type = message['type']
+        except (ValueError, KeyError, TypeError):
+            await self.close(INVALID_MESSAGE, 'Invalid message.')
+            return False
+
+        if type == 'connection_init':
+            return await self.init(message.get('payload') or {})
+        if type == 'connection_terminate':
+            await self.close(1000)
+            return False
+        if type == 'ping':
+            await self.send_message('pong')
+            return True
+        if type == 'pong':
+            return True
+        if not self.acknowledged:
+            await self.close(UNAUTHORIZED, 'Unauthorized.')
+            return False
+        if type in ('start', 'subscribe'):
+            return await self.start(message.get('id'), message.get('payload') or {})
+        if type in ('stop', 'complete'):
+            operation = self.operations.pop(message.get('id'), None)
+            if operation is not None:
+                operation.stop()
+            return True
+        await self.close(INVALID_MESSAGE, 'Unknown message type %s.' % type)
+        return False
+
+    async def init(self, payload):
+        if self.acknowledged:
+            await self.close(TOO_MANY_INIT_REQUESTS, 'Too many initialisation requests.')
+            return False
+        token = payload.get('authToken') if isinstance(payload, dict) else None
+        if not token and isinstance(payload, dict):
+            authorization = payload.get('Authorization') or payload.get('authorization') or ''
+            prefix, _, token = authorization.partition(' ')
+            token = token if prefix == 'JWT' else None
+        if token:
+            self.user = await sync_to_async(get_token_user, thread_sensitive=False)(token)
+            if self.user is None:
+                if self.protocol == GRAPHQL_WS:
+                    await self.send_message('connection_error', payload={'message': 'Invalid token.'})
+                await self.close(UNAUTHORIZED, 'Invalid token.')
+                return False
+        self.acknowledged = True
+        await self.send_message('connection_ack')
+        if self.protocol == GRAPHQL_WS:
+            await self.send_message('ka')
+            self.keepalive = asyncio.ensure_future(self.keep_alive())
+        return True
+
+    async def keep_alive(self):
+        while True:
+            await asyncio.sleep(subscriptions_setting('KEEPALIVE'))
+            await self.send_message('ka')
+
+    async def start(self, id, payload):
+        if not isinstance(id, str) or not id:
+            await self.close(INVALID_MESSAGE, 'Operation id is missing.')
+            return False
+        if id in self.operations:
+            if self.protocol == GRAPHQL_TRANSPORT_WS:
+                await self.close(SUBSCRIBER_EXISTS, 'Subscriber for %s already exists.' % id)
+                return False
+            self.operations.pop(id).stop()
+
+        operation = Operation(SubscriptionContext(self.user))
+        self.operations[id] = operation
+        result = await sync_to_async(execute, thread_sensitive=False)(operation.context, payload)
+        if self.operations.get(id) is not operation:
+            # Stopped while executing.
+            operation.stop()
+            return True
+        if not isinstance(result, Observable):
+            del self.operations[id]
+            if result.get('errors') and 'data' not in result:
+                await self.send_message('error', id, result['errors'] if self.protocol == GRAPHQL_TRANSPORT_WS else result['errors'][0])
+            else:
+                await self.send_message('next' if self.protocol == GRAPHQL_TRANSPORT_WS else 'data', id, result)
+            await self.send_message('complete', id)
+            return True
+
+        operation.disposable = result.subscribe(
+            on_next=lambda result: operation.results.append(format_result(result)),
+            on_error=lambda error: operation.results.append({'errors': [GraphQLView.format_error(error)]}),
+        )
+        queue = asyncio.Queue()
+        pubsub = get_pubsub()
+        for channel, subject in operation.context.channels:
+            def callback(message, subject=subject):
+                self.loop.call_soon_threadsafe(queue.put_nowait, (subject, message))
+            # Broker backends may reach the broker to subscribe.
+            operation.unsubscribers.append(await sync_to_async(pubsub.subscribe, thread_sensitive=False)(channel, callback))
+        operation.task = asyncio.ensure_future(self.pump(id, operation, queue))
+        return True
+
+    async def pump(self, id, operation, queue):
+        while True:
+            subject, message = await queue.get()
+            try:
+                payloads = await sync_to_async(deliver, thread_sensitive=False)(operation, subject, message)
+            except Exception:
+                logger.exception('Subscription %s failed on %r', id, message)
+                continue
+            for payload in payloads:
+                await self.send_message('next' if self.protocol == GRAPHQL_TRANSPORT_WS else 'data', id, payload)
+
+
+class GraphQLWebSocketApplication(object):
+    """ASGI application for websocket connections to the GraphQL endpoint."""
+    async def __call__(self, scope, receive, send):
+        await GraphQLWebSocket(scope, receive, send).run()
@@ -0,0 +1,177 @@
+"""Background work queue.
+
+``enqueue('package.module.function', *args)`` runs a task after the current
+transaction commits, on the backend named by ``TASK_QUEUE['BACKEND']``.
+Tasks are referred to by dotted path and take JSON-serializable arguments, so
+a broker backend can ship them to workers in another process.
+
+``ThreadPoolBackend`` runs tasks in the web process, so a task queued just
+before the process exits is lost. ``DatabaseBackend`` stores tasks in the
+``broker.Job`` table, in the transaction that queues them, for
+``manage.py run_tasks`` workers to run; a task whose worker dies runs again.
+"""
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BACKEND': 'avrit_backend.tasks.ThreadPoolBackend',
+    'OPTIONS': {},
+}
+
+
+def run_task(task, args):
+    """Run one task in the current process, the way every backend does; returns whether it succeeded."""
+    close_old_connections()
+    try:
+        import_string(task)(*args)
+    except Exception:
+        logger.exception('Task %s%r failed', task, tuple(args))
+        return False
+    finally:
+        close_old_connections()
+    return True
+
+
+class ImmediateBackend(object):
+    """Runs tasks inline; useful for tests and debugging."""
+    def __init__(self, **options):
+        pass
+
+    def submit(self, task, args):
+        run_task(task, args)
+
+
+class ThreadPoolBackend(object):
+    """Runs tasks on a thread pool inside the web process."""
+    def __init__(self, max_workers=2, **options):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='avrit-task')
+
+    def submit(self, task, args):
+        self.executor.submit(run_task, task, args)
+
+
+class BrokerBackend(object):
+    """Base class for backends that hand tasks to an external broker.
+
+    Subclasses implement ``publish(message)``; workers pass each message they
+    receive to ``consume(message)``.
+    """
+    def __init__(self, **options):
+        self.options = options
+
+    def submit(self, task, args):
+        self.publish(json.dumps({'task': task, 'args': list(args)}))
+
+    def publish(self, message):
+        raise NotImplementedError('Broker backends must implement publish().')
+
+    @staticmethod
+    def consume(message):
+        payload = json.loads(message)
+        return run_task(payload['task'], payload['args'])
+
+
+class DatabaseBackend(BrokerBackend):
+    """Hands tasks to ``manage.py run_tasks`` workers through the ``broker.Job`` table.
+
+    A worker claims a job for ``visibility_timeout`` seconds, after which
+    another worker may run it again, so tasks must be safe to repeat. A
+    task that fails is retried after ``retry_delay`` seconds, up to
+    ``max_attempts`` runs in all.
+    """
+    # Jobs are inserted in the transaction that queues them, when it is on
+    # the jobs' database.
+    transactional = True
+
+    def __init__(self, visibility_timeout=10 * 60, retry_delay=60, max_attempts=3, **options):
+        super(DatabaseBackend, self).__init__(**options)
+        self.visibility_timeout = visibility_timeout
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+
+    @staticmethod
+    def database():
+        from broker.models import Job
+
+        return router.db_for_write(Job)
+
+    def publish(self, message):
+        from broker.models import Job
+
+        Job.objects.create(data=message)
+
+    def claim(self):
+        """Claim the next job that is due; returns it, or ``None`` if there is none."""
+        from broker.models import Job
+
+        now = timezone.now()
+        for job in Job.objects.filter(run_after__lte=now).order_by('run_after', 'pk')[:10]:
+            # Only one worker can move run_after on from the value it read.
+            claimed = Job.objects.filter(pk=job.pk, run_after=job.run_after).update(
+                run_after=now + timedelta(seconds=self.visibility_timeout), attempts=F('attempts') + 1,
+            )
+            if claimed:
+                job.attempts += 1
+                return job
+        return None
+
+    def run_next(self):
+        """Run the next job that is due; returns whether there was one."""
+        from broker.models import Job
+
+        job = self.claim()
+        if job is None:
+            return False
+        if self.consume(job.data) or job.attempts >= self.max_attempts:
+            Job.objects.filter(pk=job.pk).delete()
+        else:
+            Job.objects.filter(pk=job.pk).update(run_after=timezone.now() + timedelta(seconds=self.retry_delay))
+        return True
+
+    def work(self, interval=1, stop=None):
+        """Run jobs as they fall due, checking for new ones every ``interval`` seconds, until ``stop()``."""
+        while stop is None or not stop():
+            try:
+                ran = self.run_next()
+            except Exception:
+                logger.exception('Running a queued task failed')
+                ran = False
+            finally:
+                close_old_connections()
+            if not ran:
+                time.sleep(interval)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                config = dict(DEFAULTS, **getattr(settings, 'TASK_QUEUE', {}))
+                _backend = import_string(config['BACKEND'])(**config['OPTIONS'])
+    return _backend
+
+
+def enqueue(task, *args, using=None):
+    """Queue ``task(*args)`` to run once the current transaction commits."""
+    backend = get_backend()
+    if getattr(backend, 'transactional', False) and backend.database() == (using or DEFAULT_DB_ALIAS):
+        backend.submit(task, args)
+    else:
+        transaction.on_commit(lambda: backend.submit(task, args), using=using)
@@ -0,0 +1,144 @@
+"""Streaming file uploads.
+
+Files reach the server either inside a GraphQL multipart request (see
+https://github.com/jaydenseric/graphql-multipart-request-spec) or in chunks
+through an upload session. Either way they are written to disk as they
+arrive, never buffered whole, and hashed on the way in.
+
+The content hash is a hash list: the sha256 of every ``CHUNK_SIZE`` block,
+hashed again in order. Blocks are independent, so a session can hash each
+chunk as it is received without keeping any hashing state between requests,
+and both upload paths produce the same hash for the same file.
+"""
+import hashlib
+import os
+import tempfile
+
+import graphene
+from django.conf import settings
+from django.core.files import File
+from django.core.files.uploadhandler import SkipFile, TemporaryFileUploadHandler
+
+DEFAULTS = {
+    'MAX_FILE_SIZE': 100 * 1024 * 1024,
+    'USER_QUOTA': 1024 * 1024 * 1024,
+    'CHUNK_SIZE': 4 * 1024 * 1024,
+    'SESSION_TIMEOUT': 60 * 60 * 24,
+    'CHUNK_TIMEOUT': 10 * 60,
+    'TEMP_DIR': None,
+}
+
+
+def uploads_setting(name):
+    return getattr(settings, 'UPLOADS', {}).get(name, DEFAULTS[name])
+
+
+def temp_dir():
+    path = uploads_setting('TEMP_DIR') or os.path.join(
+        settings.FILE_UPLOAD_TEMP_DIR or tempfile.gettempdir(), 'avrit-uploads'
+    )
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class ContentHasher(object):
+    """Incrementally computes the block hash list of a stream."""
+    def __init__(self, block_size=None):
+        self.block_size = block_size or uploads_setting('CHUNK_SIZE')
+        self.blocks = []
+        self._block = hashlib.sha256()
+        self._filled = 0
+
+    def update(self, data):
+        view = memoryview(data)
+        while view:
+            take = min(len(view), self.block_size - self._filled)
+            self._block.update(view[:take])
+            self._filled += take
+            view = view[take:]
+            if self._filled == self.block_size:
+                self.blocks.append(self._block.hexdigest())
+                self._block = hashlib.sha256()
+                self._filled = 0
+
+    def finish(self):
+        """Close the trailing partial block and return the block hashes."""
+        if self._filled:
+            self.blocks.append(self._block.hexdigest())
+            self._block = hashlib.sha256()
+            self._filled = 0
+        return ''.join(self.blocks)
+
+    def hexdigest(self):
+        return combine(self.finish())
+
+
+def combine(block_hashes):
+    """The content hash of a file from its concatenated hex block hashes."""
+    return hashlib.sha256(bytes.fromhex(block_hashes)).hexdigest()
+
+
+class HashingFileUploadHandler(TemporaryFileUploadHandler):
+    """Streams multipart files to a temporary file, hashing them as they arrive.
+
+    Completed files carry a ``content_hash``. Files larger than
+    ``UPLOADS['MAX_FILE_SIZE']`` are dropped from ``request.FILES``.
+    """
+    def new_file(self, *args, **kwargs):
+        super(HashingFileUploadHandler, self).new_file(*args, **kwargs)
+        self.hasher = ContentHasher()
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > uploads_setting('MAX_FILE_SIZE'):
+            raise SkipFile()
+        self.hasher.update(raw_data)
+        return super(HashingFileUploadHandler, self).receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        upload = super(HashingFileUploadHandler, self).file_complete(file_size)
+        upload.content_hash = self.hasher.hexdigest()
+        return upload
+
+
+class TemporaryFile(File):
+    """A file on local disk that storage may move into place instead of copying."""
+    def __init__(self, path, name):
+        super(TemporaryFile, self).__init__(open(path, 'rb'), name)
+        self.path = path
+
+    def temporary_file_path(self):
+        return self.path
+
+
+class Upload(graphene.Scalar):
+    """A file sent with the GraphQL multipart request spec."""
+    @staticmethod
+    def serialize(value):
+        return value
+
+    @staticmethod
+    def parse_literal(node):
+        return None
+
+    @staticmethod
+    def parse_value(value):
+        return value
+
+
+def place_files(operations, files_map, files):
+    """Put the uploaded ``files`` into ``operations`` at the paths in ``files_map``."""
+    for key, paths in files_map.items():
+        upload = files.get(key)
+        for path in paths:
+            target = operations
+            parts = path.split('.')
+            for part in parts[:-1]:
+                target = target[int(part)] if isinstance(target, list) else target[part]
+            last = parts[-1]
+            if isinstance(target, list):
+                target[int(last)] = upload
+            else:
+                target[last] = upload
+    return operations
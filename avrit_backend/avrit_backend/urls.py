@@ -16,18 +16,29 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import re_path, path, include
 from django.conf import settings
-from django.conf.urls.static import static
-from graphene_django.views import GraphQLView
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth import views as auth_views
 from graphql_jwt.decorators import jwt_cookie
 from profiles_api import views as profile_view
+from review import views as review_view
+from avrit_backend.media import serve_media
+from avrit_backend.views import AsyncGraphQLView, GraphQLView, async_setting, async_view, metrics_view
+
+if async_setting('ENABLED'):
+    graphql_view = async_view(csrf_exempt(jwt_cookie(AsyncGraphQLView.as_view(graphiql=True))))
+else:
+    graphql_view = csrf_exempt(jwt_cookie(GraphQLView.as_view(graphiql=True)))
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('graphql', csrf_exempt(jwt_cookie(GraphQLView.as_view(graphiql=True)))),
+    path('graphql', graphql_view),
+    path('metrics', metrics_view, name="metrics"),
     path('delcookie', profile_view.deleteJWT, name="delete_jwt_cookie"),
+    path('uploads/<uuid:session_id>', review_view.upload_chunk, name="upload_chunk"),
+    path('uploads/<slug:kind>/<int:pk>/content', review_view.upload_content, name="upload_content"),
+    path('export/<slug:resource>.<slug:fmt>', review_view.export, name="export"),
+    re_path(r'^%s(?P<path>.+)$' % settings.MEDIA_URL.lstrip('/'), serve_media, name="media"),
     path(
         'password_reset/',
         auth_views.PasswordResetView.as_view(),
@@ -52,5 +63,3 @@ urlpatterns = [
 
 ]
 
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-
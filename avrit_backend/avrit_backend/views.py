@@ -0,0 +1,325 @@
+import contextvars
+import copy
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import wraps
+from time import perf_counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from graphene_django.views import GraphQLView as BaseGraphQLView, HttpError
+from graphql.execution import ExecutionResult, execute
+from graphql.language import ast
+
+from avrit_backend import response_cache
+from avrit_backend.auth import get_request_user
+from avrit_backend.cost import check_cost
+from avrit_backend.db import use_replicas
+from avrit_backend.documents import document_backend, documents_setting, get_operation, query_hash
+from avrit_backend.profiling import metrics, profiling_setting, start_profile
+from avrit_backend.ratelimit import throttle
+from avrit_backend.uploads import place_files
+
+ASYNC_DEFAULTS = {
+    'ENABLED': False,
+    'REQUEST_WORKERS': 32,
+    'FIELD_WORKERS': 16,
+}
+
+
+class GraphQLView(BaseGraphQLView):
+    """The /graphql endpoint.
+
+    Documents come from the shared parsed-and-validated cache, and clients may
+    send Apollo-style automatic persisted queries: a sha256 hash in
+    ``extensions.persistedQuery``, with the full query text only after the
+    server answers ``PersistedQueryNotFound``.
+
+    Operations over the cost or depth limits of the user are rejected before
+    execution, and requests over the user's rate limits get a 429 (see
+    ``avrit_backend.ratelimit``). Anonymous read queries are answered from the
+    response cache when possible.
+
+    Files may be uploaded with the GraphQL multipart request spec; they are
+    passed to resolvers as ``Upload`` variables.
+
+    Anything stored in ``request.graphql_extensions`` is returned in the
+    response ``extensions``, such as the profile of a profiled request.
+    """
+    def get_backend(self, request):
+        return document_backend
+
+    def parse_body(self, request):
+        data = super(GraphQLView, self).parse_body(request)
+        if self.get_content_type(request) != 'multipart/form-data' or 'operations' not in data:
+            return data
+        try:
+            operations = json.loads(data['operations'])
+            files_map = json.loads(data.get('map') or '{}')
+            return place_files(operations, files_map, request.FILES)
+        except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+            raise HttpError(HttpResponseBadRequest('Invalid multipart GraphQL request.'))
+
+    def execute_graphql_request(self, request, data, query, variables, operation_name, show_graphiql=False):
+        started = perf_counter()
+        profile = start_profile(request)
+        if profile is None:
+            result = self.execute_cached_request(request, data, query, variables, operation_name, show_graphiql)
+        else:
+            with profile.capture_sql():
+                result = self.execute_cached_request(request, data, query, variables, operation_name, show_graphiql)
+            profile.finish()
+            if profiling_setting('EXTENSIONS'):
+                add_extension(request, 'profile', profile.report())
+        if result is not None and profiling_setting('METRICS'):
+            metrics.observe(perf_counter() - started, bool(result.errors) or result.invalid, profile)
+        return result
+
+    def execute_cached_request(self, request, data, query, variables, operation_name, show_graphiql=False):
+        cache_plan = None
+        document_ast = operation = cost = error = None
+        user = get_request_user(request)
+        if query and not show_graphiql:
+            try:
+                document = self.get_backend(request).document_from_string(self.schema, query)
+            except Exception:
+                document = None
+            if document is not None and document.valid:
+                document_ast = document.document_ast
+                operation = get_operation(document_ast, operation_name)
+                use_replicas(operation is not None and operation.operation == 'query')
+                report, error = check_cost(self.schema, document, variables, operation_name, user)
+                if report is not None:
+                    add_extension(request, 'cost', report)
+                    cost = report['cost']
+                if error is None:
+                    cache_plan = response_cache.plan(request, document, variables, operation_name)
+        # Over-cost and invalid requests are charged like the cheapest one.
+        throttle(request, self.schema, user, document_ast, operation, None if error else cost)
+        if error is not None:
+            return ExecutionResult(errors=[error], invalid=True)
+        if cache_plan is None:
+            return self.execute_operation(request, data, query, variables, operation_name, show_graphiql)
+
+        cached = response_cache.lookup(cache_plan)
+        if cached is not None:
+            return ExecutionResult(data=cached)
+        request.cache_tags = set()
+        result = self.execute_operation(request, data, query, variables, operation_name, show_graphiql)
+        if result is not None and not result.errors and not result.invalid:
+            response_cache.store(cache_plan, result.data, request.cache_tags)
+        return result
+
+    def execute_operation(self, request, data, query, variables, operation_name, show_graphiql=False):
+        return super(GraphQLView, self).execute_graphql_request(
+            request, data, query, variables, operation_name, show_graphiql
+        )
+
+    def json_encode(self, request, d, pretty=False):
+        extensions = getattr(request, 'graphql_extensions', None)
+        if extensions and not self.batch:
+            d = dict(d, extensions=extensions)
+        return super(GraphQLView, self).json_encode(request, d, pretty)
+
+    def get_graphql_params(self, request, data):
+        query, variables, operation_name, id = super(GraphQLView, self).get_graphql_params(request, data)
+        digest = self.get_persisted_query_hash(request, data)
+        if digest is None:
+            return query, variables, operation_name, id
+
+        store = caches[documents_setting('PERSISTED_QUERIES_CACHE')]
+        key = 'persisted-query:' + digest
+        if query:
+            if query_hash(query) != digest:
+                raise HttpError(HttpResponseBadRequest('provided sha does not match query'))
+            store.set(key, query, documents_setting('PERSISTED_QUERIES_TIMEOUT'))
+        else:
+            query = store.get(key)
+            if query is None:
+                raise HttpError(HttpResponse(status=200), 'PersistedQueryNotFound')
+        return query, variables, operation_name, id
+
+    @staticmethod
+    def get_persisted_query_hash(request, data):
+        extensions = request.GET.get('extensions') or data.get('extensions')
+        if not extensions:
+            return None
+        if isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpError(HttpResponseBadRequest('Extensions are invalid JSON.'))
+        persisted = extensions.get('persistedQuery') if isinstance(extensions, dict) else None
+        if not persisted:
+            return None
+        if persisted.get('version') != 1:
+            raise HttpError(HttpResponseBadRequest('Unsupported persisted query version.'))
+        digest = persisted.get('sha256Hash')
+        if not isinstance(digest, str):
+            raise HttpError(HttpResponseBadRequest('Persisted query is missing sha256Hash.'))
+        return digest.lower()
+
+
+class AsyncGraphQLView(GraphQLView):
+    """``GraphQLView`` for the ASGI application, see ``async_view``.
+
+    The top-level fields of a query are independent, so each one runs on
+    its own thread from the ``FIELD_WORKERS`` pool, with its own database
+    connection and DataLoaders. Mutations still run their fields in order.
+    """
+    def execute_operation(self, request, data, query, variables, operation_name, show_graphiql=False):
+        field_documents = self.split_operation(request, query, operation_name)
+        if field_documents is None:
+            return super(AsyncGraphQLView, self).execute_operation(
+                request, data, query, variables, operation_name, show_graphiql
+            )
+        executor = get_executor('FIELD_WORKERS')
+        futures = [
+            executor.submit(
+                contextvars.copy_context().run, self.execute_field, request, document_ast, variables, operation_name
+            )
+            for document_ast in field_documents
+        ]
+        data, errors = {}, []
+        for future in futures:
+            result = future.result()
+            errors.extend(result.errors or [])
+            if data is not None:
+                data = None if result.data is None else dict(data, **result.data)
+        return ExecutionResult(data=data, errors=errors or None)
+
+    def split_operation(self, request, query, operation_name):
+        """One document per top-level field of a query, or ``None`` to run it whole."""
+        if not query or request.method.lower() not in ('get', 'post'):
+            return None
+        try:
+            document = self.get_backend(request).document_from_string(self.schema, query)
+        except Exception:
+            return None
+        if not document.valid:
+            return None
+        operation = get_operation(document.document_ast, operation_name)
+        if operation is None or operation.operation != 'query':
+            return None
+        fields = operation.selection_set.selections
+        if len(fields) < 2 or not all(isinstance(field, ast.Field) for field in fields):
+            return None
+        keys = [(field.alias or field.name).value for field in fields]
+        if len(set(keys)) != len(keys):
+            return None
+        fragments = [
+            definition for definition in document.document_ast.definitions
+            if isinstance(definition, ast.FragmentDefinition)
+        ]
+        return [
+            ast.Document(definitions=[ast.OperationDefinition(
+                operation='query',
+                name=operation.name,
+                variable_definitions=operation.variable_definitions,
+                directives=operation.directives,
+                selection_set=ast.SelectionSet(selections=[field]),
+            )] + fragments)
+            for field in fields
+        ]
+
+    def execute_field(self, request, document_ast, variables, operation_name):
+        # A copy of the request keeps DataLoaders, which aren't thread-safe,
+        # apart; the cache tags and profile are shared.
+        field_request = copy.copy(request)
+        field_request.loaders = None
+        profile = getattr(request, 'graphql_profile', None)
+        close_old_connections()
+        try:
+            with profile.capture_sql() if profile is not None else ExitStack():
+                options = {'executor': self.executor} if self.executor else {}
+                return execute(
+                    self.schema,
+                    document_ast,
+                    root_value=self.get_root_value(request),
+                    context_value=field_request,
+                    variable_values=variables,
+                    operation_name=operation_name,
+                    middleware=self.get_middleware(request),
+                    **options
+                )
+        except Exception as e:
+            return ExecutionResult(errors=[e], invalid=True)
+        finally:
+            close_old_connections()
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name):
+    """The shared thread pool sized by ``GRAPHQL_ASYNC[name]``."""
+    with _executors_lock:
+        if name not in _executors:
+            _executors[name] = ThreadPoolExecutor(max_workers=async_setting(name), thread_name_prefix='avrit-graphql-%s' % name.lower())
+        return _executors[name]
+
+
+def async_setting(name):
+    return getattr(settings, 'GRAPHQL_ASYNC', {}).get(name, ASYNC_DEFAULTS[name])
+
+
+def _run_view(view, request, *args, **kwargs):
+    close_old_connections()
+    try:
+        return view(request, *args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def async_view(view):
+    """Serve the sync ``view`` from the ASGI event loop on the ``REQUEST_WORKERS`` pool.
+
+    Django runs plain sync views on one shared thread under ASGI, so only one
+    would run at a time; this runs up to ``REQUEST_WORKERS`` at once, each on
+    its own database connection. Decorators such as ``jwt_cookie`` stay on
+    the sync view, and ``csrf_exempt`` is copied over by ``wraps``.
+    """
+    @wraps(view)
+    async def wrapped_view(request, *args, **kwargs):
+        run = sync_to_async(_run_view, thread_sensitive=False, executor=get_executor('REQUEST_WORKERS'))
+        return await run(view, request, *args, **kwargs)
+    return wrapped_view
+
+
+def add_extension(request, key, value):
+    """Return ``value`` under ``key`` in the response ``extensions``."""
+    if not hasattr(request, 'graphql_extensions'):
+        request.graphql_extensions = {}
+    request.graphql_extensions[key] = value
+
+
+def _may_read_metrics(request):
+    token = profiling_setting('METRICS_TOKEN')
+    if token and constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer ' + token):
+        return True
+    user = get_request_user(request)
+    return user is not None and user.is_staff
+
+
+def metrics_view(request):
+    """Prometheus text metrics, for staff users and ``Bearer`` requests with ``METRICS_TOKEN``.
+
+    Request, SQL and resolver counters cover only the process serving the
+    scrape unless ``GRAPHQL_PROFILING['METRICS_DIR']`` is shared by all
+    workers; the document cache metrics always do.
+    """
+    if not profiling_setting('METRICS'):
+        raise Http404('Metrics are disabled.')
+    if not _may_read_metrics(request):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        metrics.render(document_backend.cache_info()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
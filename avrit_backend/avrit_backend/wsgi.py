@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'avrit_backend.settings')
 
 application = get_wsgi_application()
+
+from avrit_backend.startup import preload, startup_setting  # noqa: E402
+
+if startup_setting('PRELOAD'):
+    preload()
@@ -0,0 +1,10 @@
+from django.contrib import admin
+
+from blobs.models import Blob
+
+
+@admin.register(Blob)
+class BlobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'size', 'refcount', 'updated_at')
+    readonly_fields = ('name', 'content_hash', 'size', 'refcount', 'created_at', 'updated_at')
+    search_fields = ('name', 'content_hash')
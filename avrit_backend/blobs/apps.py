@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class BlobsConfig(AppConfig):
+    name = 'blobs'
+
+    def ready(self):
+        import blobs.signals  # noqa: F401
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from blobs.references import collect_garbage, recount
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete stored files that no row has referred to for BLOBS["GRACE_PERIOD"] seconds. '
+        '--recount first rebuilds every reference count from the database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recount', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            self.stdout.write('Corrected %d reference counts.' % recount())
+        files, freed = collect_garbage()
+        self.stdout.write(self.style.SUCCESS('Deleted %d files, %s.' % (files, filesizeformat(freed))))
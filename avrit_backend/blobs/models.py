@@ -0,0 +1,19 @@
+from django.db import models
+
+
+class Blob(models.Model):
+    """A file in ContentAddressedStorage and how many file fields refer to it"""
+    name = models.CharField(max_length=255, unique=True)
+    content_hash = models.CharField(max_length=64, db_index=True)
+    size = models.BigIntegerField()
+    refcount = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['refcount', 'updated_at'], name='blob_refcount_updated_at_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
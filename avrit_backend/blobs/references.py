@@ -0,0 +1,124 @@
+"""Reference counts of blobs, and garbage collection of unreferenced ones.
+
+``Blob.refcount`` is adjusted with single UPDATE statements using ``F()``
+when a model with a file field in ``ContentAddressedStorage`` is saved,
+bulk saved or deleted (see ``blobs.signals``). Names outside the storage,
+such as files stored before it, have no ``Blob`` and are not counted.
+
+Writes that skip the signals, like ``QuerySet.update``, can leave a count
+wrong, so ``collect_garbage`` checks that nothing refers to a blob before
+removing it and ``recount`` rebuilds every count. A blob is only removed
+once it has been unreferenced for ``BLOBS['GRACE_PERIOD']`` seconds, since
+files are stored before the row that refers to them is saved.
+"""
+import os
+from collections import Counter
+from datetime import timedelta
+
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Count, F, FileField
+from django.utils import timezone
+
+from blobs.models import Blob
+from blobs.storage import TEMP_DIR, ContentAddressedStorage, blobs_setting, is_blob_name
+
+_fields = {}
+
+
+def blob_fields(model):
+    """The file fields of ``model`` stored in ``ContentAddressedStorage``."""
+    if model not in _fields:
+        _fields[model] = [
+            field for field in model._meta.concrete_fields
+            if isinstance(field, FileField) and isinstance(field.storage, ContentAddressedStorage)
+        ]
+    return _fields[model]
+
+
+def all_blob_fields():
+    return [(model, field) for model in apps.get_models() for field in blob_fields(model)]
+
+
+def add_references(names, delta=1, using=None):
+    """Add ``delta`` to the count of each blob in ``names``, once per occurrence."""
+    for name, count in Counter(name for name in names if is_blob_name(name)).items():
+        Blob.objects.using(using).filter(name=name).update(refcount=F('refcount') + delta * count)
+
+
+def remove_references(names, using=None):
+    add_references(names, -1, using)
+
+
+def reference_counts(names=None):
+    """Count the rows that refer to each stored name, or to each of ``names``."""
+    counts = Counter()
+    for model, field in all_blob_fields():
+        queryset = model._default_manager.exclude(**{field.attname: ''})
+        if names is not None:
+            queryset = queryset.filter(**{field.attname + '__in': names})
+        for name, count in queryset.order_by().values_list(field.attname).annotate(n=Count('pk')):
+            counts[name] += count
+    return counts
+
+
+def recount():
+    """Set every ``refcount`` from the rows that refer to it; returns how many were wrong."""
+    counts = reference_counts()
+    fixed = 0
+    for pk, name, refcount in Blob.objects.values_list('pk', 'name', 'refcount').iterator():
+        if refcount != counts.get(name, 0):
+            Blob.objects.filter(pk=pk).update(refcount=counts.get(name, 0))
+            fixed += 1
+    return fixed
+
+
+def collect_garbage(storage=None):
+    """Remove unreferenced blobs and stray files older than the grace period.
+
+    Returns ``(files, bytes)`` removed.
+    """
+    if storage is None:
+        storage = default_storage
+    cutoff = timezone.now() - timedelta(seconds=blobs_setting('GRACE_PERIOD'))
+    files = freed = 0
+
+    candidates = Blob.objects.filter(refcount__lte=0, updated_at__lt=cutoff)
+    for blob in candidates.iterator():
+        referenced = reference_counts([blob.name]).get(blob.name, 0)
+        if referenced:
+            Blob.objects.filter(pk=blob.pk).update(refcount=referenced)
+            continue
+        with transaction.atomic():
+            # A save reusing the blob meanwhile has moved updated_at on.
+            if candidates.select_for_update().filter(pk=blob.pk).exists():
+                storage.remove(blob.name)
+                Blob.objects.filter(pk=blob.pk).delete()
+                files += 1
+                freed += blob.size
+
+    # Files without a Blob: written by a transaction that rolled back, or
+    # left in the temporary directory by an interrupted save.
+    oldest = cutoff.timestamp()
+    for directory, _, filenames in os.walk(storage.location):
+        relative = os.path.relpath(directory, storage.location).replace(os.sep, '/')
+        in_temp = relative == TEMP_DIR or relative.startswith(TEMP_DIR + '/')
+        names = {}
+        for filename in filenames:
+            name = filename if relative == '.' else relative + '/' + filename
+            if in_temp or is_blob_name(name):
+                names[name] = os.path.join(directory, filename)
+        if not in_temp:
+            for name in Blob.objects.filter(name__in=list(names)).values_list('name', flat=True):
+                del names[name]
+        for name, path in names.items():
+            try:
+                stat_result = os.stat(path)
+                if stat_result.st_mtime < oldest:
+                    os.remove(path)
+                    files += 1
+                    freed += stat_result.st_size
+            except FileNotFoundError:
+                pass
+    return files, freed
@@ -0,0 +1,65 @@
+from django.apps import apps
+from django.db.models.signals import post_delete, post_init, post_save
+
+from avrit_backend.bulk import bulk_saved
+from blobs.references import add_references, blob_fields, remove_references
+
+
+def _name(value):
+    return getattr(value, 'name', value) or None
+
+
+def remember_names(sender, instance, **kwargs):
+    # Deferred fields are left out; reading them here would query.
+    instance._blob_names = {
+        field.attname: _name(instance.__dict__[field.attname])
+        for field in blob_fields(sender) if field.attname in instance.__dict__
+    }
+
+
+def _changes(sender, instances, created, update_fields):
+    added, removed = [], []
+    for instance in instances:
+        names = getattr(instance, '_blob_names', {})
+        for field in blob_fields(sender):
+            if field.attname not in instance.__dict__:
+                continue
+            if update_fields is not None and field.name not in update_fields:
+                continue
+            name = _name(instance.__dict__[field.attname])
+            old = None if created else names.get(field.attname)
+            if name != old:
+                added.append(name)
+                removed.append(old)
+            names[field.attname] = name
+        instance._blob_names = names
+    return added, removed
+
+
+def count_saved(sender, instance, created=False, update_fields=None, using=None, **kwargs):
+    added, removed = _changes(sender, [instance], created, update_fields)
+    add_references(added, using=using)
+    remove_references(removed, using=using)
+
+
+def count_bulk_saved(sender, instances, created=False, update_fields=None, using=None, **kwargs):
+    added, removed = _changes(sender, instances, created, update_fields)
+    add_references(added, using=using)
+    remove_references(removed, using=using)
+
+
+def count_deleted(sender, instance, using=None, **kwargs):
+    # The stored names, even if the file was cleared before the delete.
+    names = getattr(instance, '_blob_names', {})
+    remove_references([
+        names[field.attname] if field.attname in names else _name(instance.__dict__.get(field.attname))
+        for field in blob_fields(sender)
+    ], using=using)
+
+
+for model in apps.get_models():
+    if blob_fields(model):
+        post_init.connect(remember_names, sender=model)
+        post_save.connect(count_saved, sender=model)
+        bulk_saved.connect(count_bulk_saved, sender=model)
+        post_delete.connect(count_deleted, sender=model)
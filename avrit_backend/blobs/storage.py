@@ -0,0 +1,124 @@
+"""Content-addressed file storage.
+
+``ContentAddressedStorage`` names each file after the hash of its content
+(the block hash list of ``avrit_backend.uploads``), so a file uploaded many
+times is stored once and saving never probes for a free name. A file saved
+as ``post/notes.pdf`` is stored as ``post/ab/cd/<rest of hash>.pdf``. The
+``upload_to`` prefix is kept, so ``MEDIA_SERVING`` access rules by path
+still apply, and so is the extension, which sets the content type.
+
+Files are written to a temporary file under ``MEDIA_ROOT`` and renamed into
+place, so a reader never sees part of a file. Uploads that were already
+hashed (``content_hash``) are not read again, and those already on disk are
+moved rather than copied.
+
+Every stored name has a ``Blob`` row counting the file fields that refer to
+it, see ``blobs.references``. Deleting a file through the storage leaves it
+alone; ``manage.py collect_blobs`` removes files nobody refers to.
+"""
+import os
+import posixpath
+import re
+import tempfile
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+from avrit_backend.uploads import ContentHasher
+from blobs.models import Blob
+
+DEFAULTS = {
+    'GRACE_PERIOD': 60 * 60 * 24,
+}
+TEMP_DIR = '.blobs-tmp'
+BLOB_NAME = re.compile(r'(?:^|/)[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{60}(?:\.[0-9a-z]{1,10})?$')
+EXTENSION = re.compile(r'^\.[0-9a-z]{1,10}$')
+# Characters of a stored name after its prefix: "/ab/cd/" and 60 hex digits.
+HASHED_LENGTH = 67
+
+
+def blobs_setting(name):
+    return getattr(settings, 'BLOBS', {}).get(name, DEFAULTS[name])
+
+
+def is_blob_name(name):
+    return bool(name and BLOB_NAME.search(name))
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # The stored name comes from the content, so it is only checked for
+        # length here; the extension goes first if the name would not fit.
+        prefix, extension = posixpath.dirname(name), os.path.splitext(name)[1].lower()
+        if not EXTENSION.match(extension):
+            extension = ''
+        if max_length is not None and len(prefix) + HASHED_LENGTH + len(extension) > max_length:
+            extension = ''
+            if len(prefix) + HASHED_LENGTH > max_length:
+                raise SuspiciousFileOperation('Storage can not find an available filename for "%s".' % name)
+        return posixpath.join(prefix, 'file' + extension)
+
+    def blob_name(self, name, content_hash):
+        """The stored name of ``content_hash`` for a file saved as ``name``."""
+        return posixpath.join(
+            posixpath.dirname(name),
+            content_hash[:2],
+            content_hash[2:4],
+            content_hash[4:] + os.path.splitext(name)[1],
+        )
+
+    def reuse(self, name):
+        """Keep an existing blob; false if it has to be written."""
+        return bool(Blob.objects.filter(name=name).update(updated_at=timezone.now())) and self.exists(name)
+
+    def _save(self, name, content):
+        content_hash = getattr(content, 'content_hash', None)
+        if content_hash and self.reuse(self.blob_name(name, content_hash)):
+            return self.blob_name(name, content_hash)
+
+        temp_dir = self.path(TEMP_DIR)
+        os.makedirs(temp_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=temp_dir)
+        try:
+            if content_hash and hasattr(content, 'temporary_file_path'):
+                os.close(fd)
+                file_move_safe(content.temporary_file_path(), temp_path, allow_overwrite=True)
+                # collect_blobs goes by age until the Blob row exists.
+                os.utime(temp_path)
+            else:
+                hasher = None if content_hash else ContentHasher()
+                with os.fdopen(fd, 'wb') as temp:
+                    for data in content.chunks():
+                        if hasher is not None:
+                            hasher.update(data)
+                        temp.write(data)
+                if hasher is not None:
+                    content_hash = hasher.hexdigest()
+                    if self.reuse(self.blob_name(name, content_hash)):
+                        return self.blob_name(name, content_hash)
+            name = self.blob_name(name, content_hash)
+            full_path = self.path(name)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            os.chmod(temp_path, self.file_permissions_mode or 0o644)
+            os.replace(temp_path, full_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        Blob.objects.update_or_create(
+            name=name, defaults={'content_hash': content_hash, 'size': os.path.getsize(full_path)}
+        )
+        return name
+
+    def delete(self, name):
+        # Blobs may be shared; collect_blobs removes them once unreferenced.
+        if not is_blob_name(name):
+            super(ContentAddressedStorage, self).delete(name)
+
+    def remove(self, name):
+        """Delete the file of a blob."""
+        super(ContentAddressedStorage, self).delete(name)
@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from blobs.models import Blob
+from blobs.storage import TEMP_DIR
+from profiles_api.models import UserProfile
+from review.models import Post, PostUpload
+
+
+# The test replica only holds what a test copies to it.
+@override_settings(DATABASE_ROUTING={'REPLICAS': []})
+class BlobTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings = self.settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        author = UserProfile.objects.create_user('author@example.com', 'Author')
+        self.post = Post.objects.create(
+            user_profile=author, title='Post', type_of_submission='EL', course_name='c', subject='physics',
+            description='d',
+        )
+
+    def upload(self, content, name='notes.txt'):
+        return PostUpload.objects.create(post=self.post, description='file', file_upload=ContentFile(content, name))
+
+    def refcounts(self):
+        return dict(Blob.objects.values_list('name', 'refcount'))
+
+    def collect(self):
+        call_command('collect_blobs', stdout=StringIO())
+
+    def age(self, name):
+        Blob.objects.filter(name=name).update(updated_at=timezone.now() - timedelta(days=2))
+
+    def test_equal_content_is_stored_once(self):
+        first, second = self.upload(b'same'), self.upload(b'same', 'copy.txt')
+        other = self.upload(b'other')
+        self.assertEqual(first.file_upload.name, second.file_upload.name)
+        self.assertNotEqual(first.file_upload.name, other.file_upload.name)
+        self.assertEqual(self.refcounts(), {first.file_upload.name: 2, other.file_upload.name: 1})
+        with default_storage.open(first.file_upload.name) as f:
+            self.assertEqual(f.read(), b'same')
+
+    def test_refcount_follows_saves_and_deletes(self):
+        first, second = self.upload(b'old'), self.upload(b'old')
+        old = first.file_upload.name
+        first.file_upload = ContentFile(b'new', 'notes.txt')
+        first.save()
+        new = first.file_upload.name
+        self.assertEqual(self.refcounts(), {old: 1, new: 1})
+        first.description = 'renamed'
+        first.save()
+        self.assertEqual(self.refcounts(), {old: 1, new: 1})
+        second.delete()
+        first.delete()
+        self.assertEqual(self.refcounts(), {old: 0, new: 0})
+        # Shared files stay until collect_blobs removes them.
+        self.assertTrue(default_storage.exists(old))
+
+    def test_collect_blobs_waits_for_the_grace_period(self):
+        upload = self.upload(b'gone')
+        name = upload.file_upload.name
+        upload.delete()
+        self.collect()
+        self.assertTrue(default_storage.exists(name))
+        self.age(name)
+        self.collect()
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(Blob.objects.filter(name=name).exists())
+
+    def test_collect_blobs_keeps_referenced_blobs_with_a_wrong_count(self):
+        name = self.upload(b'kept').file_upload.name
+        Blob.objects.filter(name=name).update(refcount=0)
+        self.age(name)
+        self.collect()
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(self.refcounts(), {name: 1})
+
+    def test_collect_blobs_removes_old_stray_files(self):
+        os.makedirs(os.path.join(self.media_root, TEMP_DIR))
+        stray, recent = (os.path.join(self.media_root, TEMP_DIR, name) for name in ('stray', 'recent'))
+        for path in (stray, recent):
+            with open(path, 'wb') as f:
+                f.write(b'partial')
+        old = (timezone.now() - timedelta(days=2)).timestamp()
+        os.utime(stray, (old, old))
+        self.collect()
+        self.assertFalse(os.path.exists(stray))
+        self.assertTrue(os.path.exists(recent))
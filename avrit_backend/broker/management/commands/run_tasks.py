@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from avrit_backend.tasks import DatabaseBackend, get_backend
+
+
+class Command(BaseCommand):
+    help = (
+        'Run the tasks queued through TASK_QUEUE["BACKEND"] = avrit_backend.tasks.DatabaseBackend. '
+        'Start as many workers as the load needs; --once exits when no task is due.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=1, help='Seconds to wait when no task is due.')
+        parser.add_argument('--once', action='store_true')
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        if not isinstance(backend, DatabaseBackend):
+            raise CommandError('TASK_QUEUE["BACKEND"] is %s, not a DatabaseBackend.' % type(backend).__name__)
+        if options['once']:
+            ran = 0
+            while backend.run_next():
+                ran += 1
+            self.stdout.write(self.style.SUCCESS('Ran %d tasks.' % ran))
+            return
+        self.stdout.write('Waiting for tasks.')
+        backend.work(options['interval'])
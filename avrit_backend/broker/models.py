@@ -0,0 +1,24 @@
+from django.db import models
+from django.utils import timezone
+
+
+class Event(models.Model):
+    """A pub/sub message on its way to the subscribers of every process, see avrit_backend.pubsub"""
+    data = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return 'Event %s' % self.pk
+
+
+class Job(models.Model):
+    """A background task waiting for a worker, see avrit_backend.tasks.DatabaseBackend"""
+    data = models.TextField()
+    # A worker that claims the job pushes this forward by the visibility
+    # timeout, so the job runs again if the worker dies.
+    run_after = models.DateTimeField(default=timezone.now, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return 'Job %s' % self.pk
@@ -5,7 +5,9 @@ import sys
 
 
 def main():
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'avrit_backend.settings')
+    # The test suite runs against a replica of its own, see avrit_backend.settings_test.
+    test = sys.argv[1:2] == ['test']
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'avrit_backend.settings_test' if test else 'avrit_backend.settings')
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
@@ -0,0 +1,58 @@
+"""Profile image processing, run from the background work queue."""
+import io
+import os
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+
+from profiles_api.models import ProfileImage, ProfileImageVariant
+
+VARIANT_SIZES = (300, 150, 64)
+VARIANT_FORMATS = (
+    ('JPEG', 'jpg'),
+    ('WEBP', 'webp'),
+)
+
+
+def process_profile_image(image_id):
+    """Render every size/format variant of a ProfileImage and mark it done."""
+    from PIL import Image
+
+    updated = ProfileImage.objects.filter(pk=image_id, status='P').update(status='R')
+    if not updated:
+        return
+    profile_image = ProfileImage.objects.get(pk=image_id)
+    try:
+        with profile_image.image.open('rb') as source:
+            image = Image.open(source)
+            # Let the JPEG decoder downscale while decoding, which is much
+            # cheaper than decoding at full size and resizing afterwards.
+            image.draft('RGB', (max(VARIANT_SIZES), max(VARIANT_SIZES)))
+            image = image.convert('RGB')
+            renders = []
+            for size in VARIANT_SIZES:
+                image.thumbnail((size, size), Image.LANCZOS)
+                for image_format, extension in VARIANT_FORMATS:
+                    buffer = io.BytesIO()
+                    image.save(buffer, image_format, quality=85)
+                    renders.append((size, image_format, extension, image.size, buffer.getvalue()))
+    except Exception:
+        ProfileImage.objects.filter(pk=image_id).update(status='F')
+        raise
+
+    stem = os.path.splitext(os.path.basename(profile_image.image.name))[0]
+    with transaction.atomic():
+        for variant in profile_image.variants.all():
+            variant.file.delete(save=False)
+            variant.delete()
+        for size, image_format, extension, (width, height), content in renders:
+            variant = ProfileImageVariant(
+                image=profile_image,
+                size=size,
+                format=image_format,
+                width=width,
+                height=height,
+            )
+            variant.file.save('%s_%d.%s' % (stem, size, extension), ContentFile(content), save=False)
+            variant.save()
+        ProfileImage.objects.filter(pk=image_id).update(status='D')
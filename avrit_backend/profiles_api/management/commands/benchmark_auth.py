@@ -0,0 +1,66 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from graphql_jwt.shortcuts import get_token
+
+from avrit_backend.auth import forget_token, forget_user
+from avrit_backend.ratelimit import rate_limit_setting
+from profiles_api.models import UserProfile
+
+BACKENDS = (
+    ('uncached', ['graphql_jwt.backends.JSONWebTokenBackend', 'django.contrib.auth.backends.ModelBackend']),
+    ('cached', ['avrit_backend.auth.CachedJSONWebTokenBackend', 'django.contrib.auth.backends.ModelBackend']),
+)
+QUERY = '{"query": "{ me { name } }"}'
+
+
+class Command(BaseCommand):
+    help = 'Compare authenticated /graphql requests per second with and without the JWT and user caches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        # Every request comes from the one benchmark user, far over its
+        # real rate limit; unlimited buckets still run the limiter.
+        rate_limit = dict(getattr(settings, 'GRAPHQL_RATE_LIMIT', {}), BUCKETS={
+            name: {'CAPACITY': 10 ** 9, 'RATE': 10 ** 9} for name in rate_limit_setting('BUCKETS')
+        })
+        # Everything runs in a transaction that is rolled back, so the
+        # benchmark user never reaches the database.
+        with transaction.atomic():
+            user = UserProfile.objects.create_user('benchmark-auth@example.com', 'benchmark', 'benchmark')
+            token = get_token(user)
+            headers = {'HTTP_AUTHORIZATION': 'JWT ' + token}
+            results = []
+            for name, backends in BACKENDS:
+                with override_settings(
+                    AUTHENTICATION_BACKENDS=backends, ALLOWED_HOSTS=['testserver'], GRAPHQL_RATE_LIMIT=rate_limit,
+                ):
+                    forget_token(token)
+                    forget_user(user)
+                    results.append((name,) + self.run(count, headers))
+            forget_token(token)
+            forget_user(user)
+            transaction.set_rollback(True)
+
+        for name, rate, queries in results:
+            self.stdout.write('%-9s %8.1f req/s  %.2f auth queries/request' % (name, rate, queries))
+        self.stdout.write(self.style.SUCCESS('Speedup: %.2fx' % (results[1][1] / results[0][1])))
+
+    def run(self, count, headers):
+        client = Client()
+        client.post('/graphql', QUERY, content_type='application/json', **headers)
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            for _ in range(count):
+                response = client.post('/graphql', QUERY, content_type='application/json', **headers)
+                assert response.status_code == 200, response.content
+            elapsed = time.perf_counter() - started
+        auth_queries = sum(1 for query in queries.captured_queries if 'profiles_api_userprofile' in query['sql'])
+        return count / elapsed, auth_queries / count
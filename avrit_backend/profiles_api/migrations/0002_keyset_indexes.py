@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles_api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='profiledetails',
+            index=models.Index(fields=['-created_at', '-user'], name='profile_created_at_user_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles_api', '0002_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profileimage',
+            name='status',
+            field=models.CharField(choices=[('P', 'PENDING'), ('R', 'PROCESSING'), ('D', 'DONE'), ('F', 'FAILED')], default='P', max_length=1),
+        ),
+        migrations.CreateModel(
+            name='ProfileImageVariant',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('size', models.PositiveIntegerField()),
+                ('format', models.CharField(max_length=10)),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('file', models.ImageField(upload_to='profileimagesdata/variants')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='variants', related_query_name='variant', to='profiles_api.profileimage')),
+            ],
+            options={
+                'unique_together': {('image', 'size', 'format')},
+            },
+        ),
+    ]
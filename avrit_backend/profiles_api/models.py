@@ -2,8 +2,7 @@ from django.db import models
 from django.contrib.auth.models import AbstractBaseUser
 from django.contrib.auth.models import PermissionsMixin
 from django.contrib.auth.models import BaseUserManager
-from PIL import Image
-from avrit_backend.settings import MEDIA_ROOT
+from avrit_backend.tasks import enqueue
 
 
 class UserProfileManager(BaseUserManager):
@@ -68,6 +67,12 @@ class ProfileDetails(models.Model):
     arrange = models.CharField(max_length=225, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-user'], name='profile_created_at_user_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.allow_public_view:
             self.allow_public_view ='N'
@@ -76,22 +81,60 @@ class ProfileDetails(models.Model):
         """Return profile user name"""
         return self.user.name
 
+IMAGE_STATUS = (
+            ('P', 'PENDING'),
+            ('R', 'PROCESSING'),
+            ('D', 'DONE'),
+            ('F', 'FAILED'),
+               )
 class ProfileImage(models.Model):
     """ProfileImage"""
     user = models.OneToOneField(UserProfile,
                     on_delete=models.CASCADE)
     image = models.ImageField(upload_to="profileimagesdata")
+    status = models.CharField(max_length=1, choices=IMAGE_STATUS, default='P')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(ProfileImage, cls).from_db(db, field_names, values)
+        instance._saved_image = dict(zip(field_names, values)).get('image')
+        return instance
+
     def save(self, *args, **kwargs):
         if self.image.name:
+            # Resizing happens off the request, see profiles_api.images; only a new file needs it.
+            changed = not self.image._committed or self.image.name != getattr(self, '_saved_image', None)
+            if changed:
+                self.status = 'P'
             super(ProfileImage, self).save(*args, **kwargs)
-            filename = MEDIA_ROOT + "/" + self.image.name
-            size = (300,300)
-            image = Image.open(filename)
-            image.thumbnail(size,Image.ANTIALIAS)
-            image.save(image.filename)        
+            self._saved_image = self.image.name
+            if changed:
+                enqueue('profiles_api.images.process_profile_image', self.pk)
     def __str__(self):
         """Return profile image"""
         return self.image.url  
 
+class ProfileImageVariant(models.Model):
+    """A resized copy of a ProfileImage"""
+    image = models.ForeignKey(
+        ProfileImage,
+        on_delete=models.CASCADE,
+        related_name="variants",
+        related_query_name="variant",
+    )
+    size = models.PositiveIntegerField()
+    format = models.CharField(max_length=10)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    file = models.ImageField(upload_to="profileimagesdata/variants")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('image', 'size', 'format')
+
+    def __str__(self):
+        """Return variant url"""
+        return self.file.url
+
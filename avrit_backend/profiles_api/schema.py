@@ -5,29 +5,60 @@ import django_filters
 import graphene
 import graphql_jwt
 from graphene_django import DjangoObjectType
-from profiles_api.models import ProfileImage, ProfileDetails
+from profiles_api.models import ProfileImage, ProfileImageVariant, ProfileDetails
 from graphql_jwt.decorators import login_required
 from graphql_relay.node.node import from_global_id
 from graphql_jwt.decorators import staff_member_required
+from avrit_backend.loaders import load_related
+from avrit_backend.optimizer import optimize
+from avrit_backend.pagination import KeysetConnection, KeysetConnectionField
+from avrit_backend.uploads import Upload
 
 
 class UserType(DjangoObjectType):
     class Meta:
         model = get_user_model()
-        exclude_fields = ('password')
+        exclude_fields = ('password',)
+
+    def resolve_profiledetails(self, info):
+        return load_related(info.context, self, 'profiledetails', 'profile_details', self.pk)
+
+    def resolve_profileimage(self, info):
+        return load_related(info.context, self, 'profileimage', 'profile_image', self.pk)
+
+class ProfileImageVariantType(DjangoObjectType):
+    url = graphene.String()
+    class Meta:
+        model = ProfileImageVariant
+        exclude_fields = ('image',)
+
+    def resolve_url(self, info):
+        return self.file.url
 
 class ProfileImageType(DjangoObjectType):
+    variants = graphene.List(graphene.NonNull(ProfileImageVariantType), required=True)
     class Meta:
         model = ProfileImage
         filter_fields = ['user__name']
         interfaces = (relay.Node, )
 
+    def resolve_variants(self, info):
+        return load_related(info.context, self, 'variants', 'profile_image_variants', self.pk)
+
 class ProfileDetailsNode(DjangoObjectType):
     class Meta:
         model = ProfileDetails
         filter_fields = ['user__name'] 
         exclude_fields = ('arrange', 'created_at', 'updated_at')
         interfaces = (relay.Node, )
+        connection_class = KeysetConnection
+
+    @classmethod
+    def get_queryset(cls, queryset, info):
+        return optimize(queryset, info)
+
+    def resolve_user(self, info):
+        return load_related(info.context, self, 'user', 'user', self.user_id)
 
 class ProfilePubFilter(django_filters.FilterSet):
     class Meta:
@@ -45,7 +76,7 @@ class Query(ObjectType):
     user = graphene.Field(UserType, id=graphene.Int(required=True))
     me = graphene.Field(UserType)
     profile = graphene.Field(ProfileDetailsNode)
-    pub_all_profile = DjangoFilterConnectionField(ProfileDetailsNode, filterset_class=ProfilePubFilter)
+    pub_all_profile = KeysetConnectionField(ProfileDetailsNode, filterset_class=ProfilePubFilter)
     pub_profile = graphene.Field(ProfileDetailsNode, id=graphene.ID(required=True))
     @staff_member_required
     def resolve_all_users(self, info, **kwargs):
@@ -96,11 +127,14 @@ class CreateUser(graphene.Mutation):
 class CreateProfileImage(graphene.Mutation):
     profile_image = graphene.Field(ProfileImageType)
 
+    class Arguments:
+        image_file = Upload()
+
     @classmethod
     @login_required
-    def mutate(cls, root, info):
+    def mutate(cls, root, info, image_file=None):
         user = info.context.user
-        files = info.context.FILES['imageFile']
+        files = image_file or info.context.FILES['imageFile']
         imgobj = ProfileImage(user=user, image=files)
         imgobj.save()
         return CreateProfileImage(profile_image=imgobj)
@@ -149,7 +183,7 @@ class UpdateProfileDetails(relay.ClientIDMutation):
         profile_qid = input.get('profile_id')
         profile_id = from_global_id(profile_qid)[1]
         profile_obj = ProfileDetails.objects.get(user_id=profile_id)
-        if profile_obj.user != user:
+        if profile_obj.user_id != user.pk:
             raise Exception('Not permitted to update this profile.')
         address = input.get('address')
         research_interest = input.get('research_interest')
@@ -172,7 +206,7 @@ class UpdateProfileDetails(relay.ClientIDMutation):
             profile_obj.publications = publications
         else:
             profile_obj.publications = ""
-        profile_obj.save()
+        profile_obj.save(update_fields=['address', 'research_interest', 'education', 'experience', 'publications', 'updated_at'])
 
         return UpdateProfileDetails(profile_details=profile_obj)
 
@@ -0,0 +1,42 @@
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.dispatch import receiver
+
+from avrit_backend import response_cache
+from profiles_api.models import UserProfile, ProfileDetails, ProfileImage
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def invalidate_user(sender, instance, **kwargs):
+    # avrit_backend.auth needs graphql_jwt, which only requests should load.
+    from avrit_backend.auth import forget_user
+
+    forget_user(instance)
+    response_cache.invalidate_instance(instance)
+
+
+@receiver(m2m_changed, sender=UserProfile.groups.through)
+@receiver(m2m_changed, sender=UserProfile.user_permissions.through)
+def forget_user_permissions(sender, instance, action, reverse, pk_set=None, **kwargs):
+    from avrit_backend.auth import forget_users
+
+    if not reverse and action in ('post_add', 'post_remove', 'post_clear'):
+        forget_users([instance.pk])
+    elif reverse and action in ('post_add', 'post_remove'):
+        forget_users(pk_set)
+    elif reverse and action == 'pre_clear':
+        # A group or permission loses all its users.
+        forget_users(instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=ProfileDetails)
+@receiver(post_delete, sender=ProfileDetails)
+def invalidate_profile_details(sender, instance, **kwargs):
+    # Any edit can change allow_public_view, which decides membership of pubAllProfile.
+    response_cache.invalidate_instance(instance, changed_list=True, related=[(UserProfile, instance.user_id)])
+
+
+@receiver(post_save, sender=ProfileImage)
+@receiver(post_delete, sender=ProfileImage)
+def invalidate_profile_image(sender, instance, **kwargs):
+    response_cache.invalidate_instance(instance, related=[(UserProfile, instance.user_id)])
@@ -1,3 +1,178 @@
-from django.test import TestCase
+import io
+import json
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from graphql_jwt.shortcuts import get_token
+
+from avrit_backend import auth, tasks
+from broker.models import Job
+from profiles_api.models import ProfileDetails, ProfileImage, UserProfile
+
+PUB_ALL_PROFILE = '''{
+  pubAllProfile(first: 100) {
+    edges { node { researchInterest user { name } } }
+  }
+}'''
+ME = '{ me { name email profiledetails { researchInterest } profileimage { id } } }'
+
+
+def create_profiles(count, start=0):
+    for i in range(start, start + count):
+        user = UserProfile.objects.create_user('user%d@example.com' % i, 'User %d' % i)
+        ProfileDetails.objects.create(user=user, address='a', research_interest='physics', allow_public_view='Y')
+
+
+# The test replica only holds what a test copies to it.
+@override_settings(DATABASE_ROUTING={'REPLICAS': []})
+class QueryCountTests(TestCase):
+    def setUp(self):
+        # Anonymous responses and authenticated users are cached.
+        cache.clear()
+
+    def query(self, query, **headers):
+        response = self.client.post('/graphql', json.dumps({'query': query}), content_type='application/json', **headers)
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()
+        self.assertNotIn('errors', data)
+        return data['data']
+
+    def test_pub_all_profile_at_two_sizes(self):
+        for total in (5, 30):
+            create_profiles(total - ProfileDetails.objects.count(), start=ProfileDetails.objects.count())
+            cache.clear()
+            with self.assertNumQueries(1):
+                data = self.query(PUB_ALL_PROFILE)
+            self.assertEqual(len(data['pubAllProfile']['edges']), total)
+
+    def test_me_at_two_sizes(self):
+        for total in (5, 30):
+            create_profiles(total - ProfileDetails.objects.count(), start=ProfileDetails.objects.count())
+            user = UserProfile.objects.get(email='user0@example.com')
+            cache.clear()
+            with self.assertNumQueries(3):
+                data = self.query(ME, HTTP_AUTHORIZATION='JWT ' + get_token(user))
+            self.assertEqual(data['me']['name'], 'User 0')
+
+
+class RateLimitTests(TestCase):
+    def test_aliased_token_auth_batch_is_rejected(self):
+        aliases = ' '.join(
+            'guess%d: tokenAuth(email: "user0@example.com", password: "guess%d") { token }' % (i, i) for i in range(40)
+        )
+        response = self.client.post(
+            '/graphql', json.dumps({'query': 'mutation { %s }' % aliases}), content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 429)
+        self.assertNotIn('Retry-After', response)
+
+
+def png(color):
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (400, 300), color).save(buffer, 'PNG')
+    return SimpleUploadedFile('%s.png' % color, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(DATABASE_ROUTING={'REPLICAS': []})
+class TaskQueueTests(TransactionTestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings = self.settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.backend = tasks.DatabaseBackend(retry_delay=60, max_attempts=2)
+        patcher = mock.patch.object(tasks, '_backend', self.backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = UserProfile.objects.create_user('image@example.com', 'Image')
+
+    def test_only_a_new_image_is_processed(self):
+        image = ProfileImage.objects.create(user=self.user, image=png('red'))
+        self.assertEqual(Job.objects.count(), 1)
+        self.assertTrue(self.backend.run_next())
+        self.assertFalse(self.backend.run_next())
+        image = ProfileImage.objects.get()
+        self.assertEqual(image.status, 'D')
+        self.assertEqual(image.variants.count(), 6)
+
+        image.save()
+        ProfileImage.objects.get().save()
+        self.assertEqual(Job.objects.count(), 0)
+
+        image.image = png('blue')
+        image.save()
+        self.assertEqual(ProfileImage.objects.get().status, 'P')
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_a_job_is_queued_with_its_transaction(self):
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                tasks.enqueue('json.loads', '{}')
+                raise ValueError
+        self.assertEqual(Job.objects.count(), 0)
+
+    def test_a_claimed_job_is_not_claimed_again_until_it_times_out(self):
+        tasks.enqueue('json.loads', '{}')
+        job = self.backend.claim()
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNone(tasks.DatabaseBackend().claim())
+        Job.objects.update(run_after=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(tasks.DatabaseBackend().claim().attempts, 2)
+
+    def test_failed_tasks_are_retried_up_to_max_attempts(self):
+        tasks.enqueue('json.loads', 'not json')
+        with self.assertLogs('avrit_backend.tasks', 'ERROR'):
+            self.assertTrue(self.backend.run_next())
+        job = Job.objects.get()
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=30))
+        Job.objects.update(run_after=timezone.now())
+        with self.assertLogs('avrit_backend.tasks', 'ERROR'):
+            self.assertTrue(self.backend.run_next())
+        self.assertFalse(Job.objects.exists())
+
+
+class AuthCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = UserProfile.objects.create_user('cached@example.com', 'Cached', 'secret')
+        self.token = get_token(self.user)
+
+    def cached(self):
+        return cache.get('auth-user:%d' % self.user.pk)
+
+    def test_users_are_cached_by_pk_without_the_password(self):
+        auth.get_token_user(self.token)
+        self.assertEqual(sorted(self.cached()), sorted(auth.USER_FIELDS))
+        with self.assertNumQueries(0):
+            user = auth.get_token_user(self.token)
+            self.assertEqual((user.pk, user.email, user.name, user.is_staff), (self.user.pk, 'cached@example.com', 'Cached', False))
+        self.assertIn('password', user.get_deferred_fields())
+        with self.assertNumQueries(1):
+            self.assertTrue(user.check_password('secret'))
+
+    def test_group_and_permission_changes_drop_the_user(self):
+        group = Group.objects.create(name='editors')
+        auth.get_token_user(self.token)
+        self.user.groups.add(group)
+        self.assertIsNone(self.cached())
+        auth.get_token_user(self.token)
+        group.user_set.clear()
+        self.assertIsNone(self.cached())
+
+    def test_a_changed_email_no_longer_authenticates(self):
+        auth.get_token_user(self.token)
+        self.user.email = 'moved@example.com'
+        self.user.save()
+        self.assertIsNone(self.cached())
+        self.assertIsNone(auth.get_token_user(self.token))
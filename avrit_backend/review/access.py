@@ -0,0 +1,42 @@
+"""Who may download post and review files.
+
+Posts are public, as in ``allPost``, so their files are open to everyone.
+A review's files are open to the reviewer, the author of the reviewed post
+and staff. Stored files are shared by content hash, so a file is open to
+whoever may see any upload that refers to it; a file no upload refers to
+any more is left to staff until ``collect_blobs`` removes it.
+
+``post_file`` and ``review_file`` are ``MEDIA_SERVING['ACCESS']`` policies
+for the ``post/`` and ``review/`` prefixes; ``can_view_upload`` checks one
+upload row, for revisions served without a file.
+"""
+from django.db.models import Q
+
+from avrit_backend.auth import get_request_user
+from review.models import PostUpload, ReviewUpload
+
+
+def _review_uploads_of(user):
+    return ReviewUpload.objects.filter(Q(review__user_profile=user) | Q(review__post_id__user_profile=user))
+
+
+def can_view_upload(user, upload):
+    if isinstance(upload, PostUpload):
+        return True
+    if user is None:
+        return False
+    return user.is_staff or _review_uploads_of(user).filter(pk=upload.pk).exists()
+
+
+def post_file(request, path):
+    if PostUpload.objects.filter(file_upload=path).exists():
+        return True
+    user = get_request_user(request)
+    return user is not None and user.is_staff
+
+
+def review_file(request, path):
+    user = get_request_user(request)
+    if user is None:
+        return False
+    return user.is_staff or _review_uploads_of(user).filter(file_upload=path).exists()
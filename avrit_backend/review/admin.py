@@ -1,5 +1,71 @@
+import json
+
+from django import forms
 from django.contrib import admin
-from review.models import Post
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db import transaction
+from django.http import HttpResponseRedirect
+from django.shortcuts import get_object_or_404
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+
+from avrit_backend.tasks import enqueue
+from review.models import ImportJob, Post
+
+
+class ImportForm(forms.Form):
+    kind = forms.ChoiceField(choices=(('users', 'Users and profiles'), ('posts', 'Posts and files')))
+    file = forms.FileField(help_text='CSV, or NDJSON with a .ndjson or .jsonl name.')
+    archive = forms.FileField(required=False, help_text='Zip of the files named in the "file" column of posts.')
+
+
+@admin.register(Post)
+class PostAdmin(admin.ModelAdmin):
+    def get_urls(self):
+        return [
+            path('import/', self.admin_site.admin_view(self.import_view), name='review_post_import'),
+            path('import/<int:job_id>/', self.admin_site.admin_view(self.import_job_view), name='review_post_import_job'),
+        ] + super(PostAdmin, self).get_urls()
+
+    @method_decorator(csrf_exempt)
+    def import_view(self, request):
+        """Store an uploaded import file and queue its import; the rows are reported by ``import_job_view``."""
+        # Import files are not limited to UPLOADS['MAX_FILE_SIZE'] like post
+        # files are. The handlers must be replaced before the CSRF check
+        # reads the body, so it runs afterwards.
+        request.upload_handlers = [TemporaryFileUploadHandler(request)]
+        return self._import_view(request)
+
+    @method_decorator(csrf_protect)
+    def _import_view(self, request):
+        form = ImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            upload = form.cleaned_data['file']
+            job = ImportJob(
+                user_profile=request.user,
+                kind=form.cleaned_data['kind'],
+                format='ndjson' if upload.name.lower().endswith(('.ndjson', '.jsonl')) else 'csv',
+                file=upload,
+                archive=form.cleaned_data['archive'] or '',
+            )
+            with transaction.atomic():
+                job.save()
+                enqueue('review.imports.run_import_job', job.pk)
+            return HttpResponseRedirect(reverse('admin:review_post_import_job', args=[job.pk]))
+        return self.render_import(request, form=form, jobs=ImportJob.objects.order_by('-pk')[:10])
 
+    def import_job_view(self, request, job_id):
+        """The progress of an import and, once it has run, its per-row report."""
+        job = get_object_or_404(ImportJob, pk=job_id)
+        return self.render_import(request, job=job, report=json.loads(job.report) if job.report else None)
 
-admin.site.register(Post)
+    def render_import(self, request, **context):
+        context = dict(
+            self.admin_site.each_context(request),
+            opts=self.model._meta,
+            title='Bulk import',
+            **context
+        )
+        return TemplateResponse(request, 'admin/review/post/import.html', context)
@@ -0,0 +1,211 @@
+"""Batch creation and updates of posts, reviews and comments.
+
+Every item of a batch is validated first, with foreign keys and unique
+values checked in one query per batch rather than per item. Items that pass
+are written in a single transaction with ``bulk_insert``/``bulk_change``;
+the others are reported by index. With ``all_or_nothing`` a single bad item
+means nothing is written.
+"""
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from graphql_relay.node.node import from_global_id
+
+from avrit_backend.bulk import ItemErrors, bulk_change, bulk_insert, bulk_setting
+from review.models import Post, PostComment, Review, ReviewComment
+
+POST_FIELDS = ('title', 'type_of_submission', 'course_name', 'subject', 'description', 'backup_link')
+REVIEW_FIELDS = ('description', 'backup_link')
+
+
+def check_batch_size(items):
+    if len(items) > bulk_setting('MAX_ITEMS'):
+        raise Exception('At most %d items can be sent at once.' % bulk_setting('MAX_ITEMS'))
+
+
+def _values(item, fields):
+    values = {}
+    for name in fields:
+        if item.get(name) is not None:
+            values[name] = item[name]
+    # An empty backup link means none; '' would collide with other blanks.
+    if 'backup_link' in values and not values['backup_link']:
+        values['backup_link'] = None
+    return values
+
+
+def _clean(instance, index, errors, exclude):
+    try:
+        instance.full_clean(exclude=exclude, validate_unique=False)
+    except ValidationError as e:
+        errors.add_validation_error(index, e)
+
+
+def _check_unique(model, objects, field, errors):
+    """Report values of a unique ``field`` repeated in the batch or already stored."""
+    seen = {}
+    for index, obj in enumerate(objects):
+        value = getattr(obj, field)
+        if value is None or index in errors:
+            continue
+        if value in seen:
+            errors.add(index, field, 'Duplicate %s in this batch.' % field)
+        else:
+            seen[value] = index
+    if not seen:
+        return
+    existing = (
+        model.objects.filter(**{field + '__in': list(seen)})
+        .exclude(pk__in=[obj.pk for obj in objects if obj.pk is not None])
+        .values_list(field, flat=True)
+    )
+    for value in existing:
+        errors.add(seen[value], field, '%s with this %s already exists.' % (model._meta.verbose_name.capitalize(), field))
+
+
+def _decode_ids(items, key, node_type, errors):
+    """Map item index to the primary key in its relay global ID ``key``."""
+    pks = {}
+    for index, item in enumerate(items):
+        if item.get(key) is None:
+            continue
+        try:
+            type_name, pk = from_global_id(item[key])
+        except Exception:
+            type_name, pk = None, None
+        if type_name != node_type or not pk:
+            errors.add(index, key, 'Invalid %s ID.' % node_type)
+        else:
+            pks[index] = pk
+    return pks
+
+
+def _results(objects, errors, all_or_nothing):
+    if errors and all_or_nothing:
+        return [None] * len(objects), []
+    return [None if index in errors else obj for index, obj in enumerate(objects)], [
+        obj for index, obj in enumerate(objects) if index not in errors
+    ]
+
+
+def create_posts(user, items, all_or_nothing=False):
+    """Return ``(posts, errors)``, with ``None`` in place of posts that failed."""
+    check_batch_size(items)
+    errors = ItemErrors()
+    posts = []
+    for index, item in enumerate(items):
+        post = Post(user_profile=user, **_values(item, POST_FIELDS))
+        _clean(post, index, errors, exclude=['user_profile', 'search_vector'])
+        posts.append(post)
+    _check_unique(Post, posts, 'backup_link', errors)
+
+    results, valid = _results(posts, errors, all_or_nothing)
+    with transaction.atomic():
+        bulk_insert(Post, valid, key=('user_profile', 'title'))
+    return results, errors.errors
+
+
+def update_posts(user, items, all_or_nothing=False):
+    """Apply the given fields to the user's posts; returns ``(posts, errors)``."""
+    check_batch_size(items)
+    errors = ItemErrors()
+    pks = _decode_ids(items, 'id', 'PostNode', errors)
+    with transaction.atomic():
+        stored = Post.objects.select_for_update().filter(user_profile=user).in_bulk(set(pks.values()))
+        posts = []
+        changed = set()
+        for index, item in enumerate(items):
+            post = stored.get(int(pks[index])) if index in pks and pks[index].isdigit() else None
+            if post is None:
+                if index not in errors:
+                    errors.add(index, 'id', 'Post not found or not permitted.')
+                posts.append(Post())
+                continue
+            values = _values(item, POST_FIELDS)
+            for name, value in values.items():
+                setattr(post, name, value)
+            changed.update(values)
+            _clean(post, index, errors, exclude=['user_profile', 'search_vector'])
+            posts.append(post)
+        _check_unique(Post, posts, 'backup_link', errors)
+
+        results, valid = _results(posts, errors, all_or_nothing)
+        if changed:
+            bulk_change(Post, valid, sorted(changed))
+    return results, errors.errors
+
+
+def create_reviews(user, items, all_or_nothing=False):
+    """Review many posts at once; returns ``(reviews, errors)``."""
+    check_batch_size(items)
+    errors = ItemErrors()
+    pks = _decode_ids(items, 'post_id', 'PostNode', errors)
+    posts = Post.objects.only('pk').in_bulk([pk for pk in pks.values() if pk.isdigit()])
+    reviewed = set(
+        Review.objects.filter(user_profile=user, post_id__in=list(posts)).values_list('post_id', flat=True)
+    )
+    reviews = []
+    batch_posts = set()
+    for index, item in enumerate(items):
+        review = Review(user_profile=user, **_values(item, REVIEW_FIELDS))
+        post = posts.get(int(pks[index])) if index in pks and pks[index].isdigit() else None
+        if post is None:
+            if index not in errors:
+                errors.add(index, 'post_id', 'Post not found.')
+        elif post.pk in reviewed or post.pk in batch_posts:
+            errors.add(index, 'post_id', 'You have already reviewed this post.')
+        else:
+            review.post_id = post
+            batch_posts.add(post.pk)
+        _clean(review, index, errors, exclude=['user_profile', 'post_id'])
+        reviews.append(review)
+    _check_unique(Review, reviews, 'backup_link', errors)
+
+    results, valid = _results(reviews, errors, all_or_nothing)
+    with transaction.atomic():
+        bulk_insert(Review, valid)
+    return results, errors.errors
+
+
+def add_comments(items, all_or_nothing=False):
+    """Comment on posts and reviews; returns ``(post_comments, review_comments, errors)``.
+
+    Each item names either a ``post_id`` or a ``review_id``. Both result lists
+    follow the order of ``items``, with ``None`` where an item belongs to the
+    other list or failed.
+    """
+    check_batch_size(items)
+    errors = ItemErrors()
+    for index, item in enumerate(items):
+        if (item.get('post_id') is None) == (item.get('review_id') is None):
+            errors.add(index, None, 'Give either a postId or a reviewId.')
+    post_pks = _decode_ids(items, 'post_id', 'PostNode', errors)
+    posts = Post.objects.only('pk').in_bulk([pk for pk in post_pks.values() if pk.isdigit()])
+    review_pks = _decode_ids(items, 'review_id', 'ReviewType', errors)
+    reviews = Review.objects.only('pk', 'post_id').in_bulk([pk for pk in review_pks.values() if pk.isdigit()])
+
+    comments = []
+    for index, item in enumerate(items):
+        if index in errors:
+            comments.append(None)
+            continue
+        if index in post_pks:
+            parent = posts.get(int(post_pks[index])) if post_pks[index].isdigit() else None
+            comment = PostComment(post=parent, comment=item.get('comment')) if parent else None
+            field = 'post_id'
+        else:
+            parent = reviews.get(int(review_pks[index])) if review_pks[index].isdigit() else None
+            comment = ReviewComment(review=parent, comment=item.get('comment')) if parent else None
+            field = 'review_id'
+        if comment is None:
+            errors.add(index, field, 'Not found.')
+        else:
+            _clean(comment, index, errors, exclude=['post', 'review'])
+        comments.append(comment)
+
+    results, _ = _results(comments, errors, all_or_nothing)
+    post_comments = [obj if isinstance(obj, PostComment) else None for obj in results]
+    review_comments = [obj if isinstance(obj, ReviewComment) else None for obj in results]
+    with transaction.atomic():
+        bulk_insert(PostComment, [obj for obj in post_comments if obj is not None], key=('post', 'comment'))
+        bulk_insert(ReviewComment, [obj for obj in review_comments if obj is not None], key=('review', 'comment'))
+    return post_comments, review_comments, errors.errors
@@ -0,0 +1,61 @@
+"""Review and comment counters kept on ``Post``.
+
+``review_count``, ``comment_count`` (comments on the post and on its reviews)
+and ``last_reviewed_at`` are adjusted with single UPDATE statements using
+``F()`` expressions when reviews and comments are created or deleted, so
+concurrent writers never lose an increment. ``refresh`` recomputes them
+from the related tables, for bulk writes and the ``rebuild_post_counters``
+command.
+"""
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from review.models import Post, PostComment, Review, ReviewComment
+
+
+def _count(queryset, field):
+    counts = queryset.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(n=Count('pk')).values('n')
+    return Coalesce(Subquery(counts), Value(0))
+
+
+def _latest_review():
+    return Subquery(Review.objects.filter(post_id=OuterRef('pk')).order_by('-created_at').values('created_at')[:1])
+
+
+def _decrement(name):
+    return Greatest(F(name) - 1, Value(0))
+
+
+def refresh(pks=None, using=None):
+    """Recompute the counters of the posts in ``pks``, or of every post."""
+    queryset = Post.objects.using(using)
+    if pks is not None:
+        queryset = queryset.filter(pk__in=list(pks))
+    return queryset.update(
+        review_count=_count(Review.objects.all(), 'post_id'),
+        comment_count=_count(PostComment.objects.all(), 'post') + _count(ReviewComment.objects.all(), 'review__post_id'),
+        last_reviewed_at=_latest_review(),
+    )
+
+
+def review_added(review, using=None):
+    created_at = Value(review.created_at)
+    Post.objects.using(using).filter(pk=review.post_id_id).update(
+        review_count=F('review_count') + 1,
+        last_reviewed_at=Greatest(Coalesce('last_reviewed_at', created_at), created_at),
+    )
+
+
+def review_removed(review, using=None):
+    Post.objects.using(using).filter(pk=review.post_id_id).update(
+        review_count=_decrement('review_count'),
+        last_reviewed_at=_latest_review(),
+    )
+
+
+def comment_added(post_pk, using=None):
+    Post.objects.using(using).filter(pk=post_pk).update(comment_count=F('comment_count') + 1)
+
+
+def comment_removed(post_pk, using=None):
+    Post.objects.using(using).filter(pk=post_pk).update(comment_count=_decrement('comment_count'))
@@ -0,0 +1,34 @@
+"""Pub/sub channels for the review subscriptions.
+
+Messages carry only primary keys; subscribers load the rows themselves, so
+the same messages work through an external broker.
+"""
+from avrit_backend.pubsub import publish
+from review.models import PostComment, Review, ReviewComment
+
+COMMENT_MODELS = {'postcomment': PostComment, 'reviewcomment': ReviewComment}
+
+
+def review_channel(post_pk):
+    return 'review-added:%s' % post_pk
+
+
+def comment_channel(post_pk):
+    return 'comment-added:%s' % post_pk
+
+
+def review_added(review, using=None):
+    publish(review_channel(review.post_id_id), {'pk': review.pk}, using)
+
+
+def comment_added(comment, post_pk, using=None):
+    publish(comment_channel(post_pk), {'model': comment._meta.model_name, 'pk': comment.pk}, using)
+
+
+def load_review(message):
+    return Review.objects.filter(pk=message['pk']).first()
+
+
+def load_comment(message):
+    model = COMMENT_MODELS.get(message.get('model'))
+    return model.objects.filter(pk=message['pk']).first() if model else None
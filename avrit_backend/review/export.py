@@ -0,0 +1,129 @@
+"""Streaming bulk export of posts, reviews and their uploads and comments.
+
+``export_chunks`` reads one resource with a server-side cursor
+(``iterator(chunk_size=...)``) and yields NDJSON or CSV as bytes, optionally
+gzipped, so memory use doesn't grow with the table. The export view and the
+``export_data`` command both use it.
+
+Exports are incremental. Rows are selected by ``updated_at`` in
+``[since - OVERLAP, until)``, and ``until`` defaults to the start of the
+export. It is returned as the watermark to pass as ``since`` next time. The
+overlap re-sends rows whose transaction committed after an earlier export
+had already passed their ``updated_at``, so consumers should upsert by
+``id``. Deletions are not exported.
+"""
+import csv
+import json
+import zlib
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from review.models import Post, PostComment, PostUpload, Review, ReviewComment, ReviewUpload
+
+DEFAULTS = {
+    'CHUNK_SIZE': 2000,
+    'OVERLAP': 60,
+    'TOKEN': None,
+    'GZIP_LEVEL': 6,
+}
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+RESOURCES = {
+    'posts': (Post, (
+        'id', 'user_profile_id', 'title', 'type_of_submission', 'course_name', 'subject', 'description',
+        'backup_link', 'review_count', 'comment_count', 'last_reviewed_at', 'created_at', 'updated_at',
+    )),
+    'reviews': (Review, (
+        'id', 'post_id', 'user_profile_id', 'description', 'backup_link', 'created_at', 'updated_at',
+    )),
+    'post_uploads': (PostUpload, (
+        'id', 'post_id', 'description', 'revision', 'parent_id', 'sequence', 'latest', 'file_upload',
+        'content_hash', 'size', 'created_at', 'updated_at',
+    )),
+    'review_uploads': (ReviewUpload, (
+        'id', 'review_id', 'description', 'revision', 'parent_id', 'sequence', 'latest', 'file_upload',
+        'content_hash', 'size', 'created_at', 'updated_at',
+    )),
+    'post_comments': (PostComment, ('id', 'post_id', 'comment', 'created_at', 'updated_at')),
+    'review_comments': (ReviewComment, ('id', 'review_id', 'comment', 'created_at', 'updated_at')),
+}
+# Bytes collected before a chunk is handed to the response.
+WRITE_SIZE = 64 * 1024
+
+
+def export_setting(name):
+    return getattr(settings, 'EXPORT', {}).get(name, DEFAULTS[name])
+
+
+def parse_watermark(value):
+    """Parse an ISO 8601 ``since``/``until`` value; naive times are UTC."""
+    if not value:
+        return None
+    try:
+        moment = parse_datetime(value)
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise Exception('Invalid timestamp %r; use ISO 8601.' % value)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment, timezone.utc)
+    return moment
+
+
+def export_queryset(resource, since=None, until=None):
+    model, fields = RESOURCES[resource]
+    queryset = model._default_manager.filter(updated_at__lt=until)
+    if since is not None:
+        queryset = queryset.filter(updated_at__gte=since - timedelta(seconds=export_setting('OVERLAP')))
+    return queryset.order_by('updated_at', 'pk').values_list(*fields)
+
+
+def _value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+class _Line(object):
+    """File-like target for csv.writer that hands back what was written."""
+    def write(self, value):
+        return value
+
+
+def _lines(resource, fmt, rows):
+    fields = RESOURCES[resource][1]
+    if fmt == 'csv':
+        writer = csv.writer(_Line())
+        yield writer.writerow(fields)
+        for row in rows:
+            yield writer.writerow(['' if value is None else _value(value) for value in row])
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(fields, map(_value, row))), ensure_ascii=False) + '\n'
+
+
+def export_chunks(resource, fmt, since=None, until=None, compress=False, chunk_size=None):
+    """Yield ``resource`` rows updated in the export window as encoded, optionally gzipped, bytes."""
+    rows = export_queryset(resource, since, until or timezone.now()).iterator(
+        chunk_size=chunk_size or export_setting('CHUNK_SIZE')
+    )
+    compressor = zlib.compressobj(export_setting('GZIP_LEVEL'), zlib.DEFLATED, 31) if compress else None
+    buffer, size = [], 0
+    for line in _lines(resource, fmt, rows):
+        data = line.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= WRITE_SIZE:
+            data = b''.join(buffer)
+            buffer, size = [], 0
+            data = compressor.compress(data) if compressor else data
+            if data:
+                yield data
+    data = b''.join(buffer)
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
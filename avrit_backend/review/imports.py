@@ -0,0 +1,341 @@
+"""Bulk import of users with their profiles, and of posts with their files.
+
+Rows are read from a CSV or NDJSON stream and processed ``CHUNK_SIZE`` at a
+time:
+
+1. Each row is validated with ``full_clean``. References and unique values
+   are checked with one query per chunk.
+2. Passwords are hashed on a process pool.
+3. The valid rows are written with ``bulk_insert`` in one transaction per
+   chunk.
+
+Problems are collected per row, by line number. A row that fails never
+stops the others.
+
+``users`` rows have the columns in ``USER_COLUMNS``. Rows without a
+password get an unusable one, so the user sets it through the password
+reset. Profile columns are optional, but a row that gives any of them
+needs ``address`` and ``research_interest``.
+
+``posts`` rows have the columns in ``POST_COLUMNS``. ``author`` is the
+email of an existing user. ``file`` names a member of the zip archive given
+with the import; it is stored as a ``PostUpload`` and deduplicated by
+content hash like any other upload.
+
+Imports started from the admin are stored as an ``ImportJob`` and run by
+``run_import_job`` on the task queue, which records the progress after
+every chunk.
+"""
+import csv
+import io
+import json
+import os
+import zipfile
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import NON_FIELD_ERRORS, ValidationError
+from django.core.files import File
+from django.db import DatabaseError, transaction
+
+from avrit_backend.bulk import bulk_insert
+from avrit_backend.processes import process_pool
+from avrit_backend.uploads import uploads_setting
+from profiles_api.models import ProfileDetails, UserProfile
+from review.models import ImportJob, Post, PostUpload
+from review.uploads import hash_file, store_file
+
+DEFAULTS = {
+    'CHUNK_SIZE': 1000,
+    'HASH_WORKERS': None,
+    'MAX_ERRORS': 1000,
+}
+USER_COLUMNS = (
+    'email', 'name', 'password', 'address', 'research_interest', 'education', 'experience', 'publications',
+    'allow_public_view',
+)
+PROFILE_COLUMNS = ('address', 'research_interest', 'education', 'experience', 'publications', 'allow_public_view')
+POST_COLUMNS = (
+    'author', 'title', 'type_of_submission', 'course_name', 'subject', 'description', 'backup_link', 'file',
+    'file_description',
+)
+FORMATS = ('csv', 'ndjson')
+# Chunks with fewer passwords than this are hashed inline.
+POOL_THRESHOLD = 16
+
+
+def import_setting(name):
+    return getattr(settings, 'IMPORT', {}).get(name, DEFAULTS[name])
+
+
+def read_rows(stream, fmt):
+    """Yield ``(line, row)`` from a binary CSV or NDJSON stream, without reading it all."""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line, data in enumerate(text, 1):
+        if not data.strip():
+            continue
+        try:
+            row = json.loads(data)
+        except ValueError:
+            row = None
+        yield line, row if isinstance(row, dict) else {'__invalid__': True}
+
+
+def _text(row, name):
+    value = row.get(name)
+    if value is None:
+        return ''
+    return value.strip() if isinstance(value, str) else str(value)
+
+
+class ImportReport(object):
+    """Counts and per-row errors of one import; only the first ``MAX_ERRORS`` errors are kept."""
+    def __init__(self):
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+
+    def add(self, line, field, *messages):
+        if len(self.errors) < import_setting('MAX_ERRORS'):
+            self.errors.append((line, field, list(messages)))
+
+    def as_dict(self):
+        return {
+            'created': self.created,
+            'failed': self.failed,
+            'errors': [{'line': line, 'field': field, 'messages': messages} for line, field, messages in self.errors],
+        }
+
+
+class RowErrors(object):
+    """The lines of the current chunk that failed, with their messages."""
+    def __init__(self, report):
+        self.report = report
+        self.failed = set()
+
+    def add(self, line, field, *messages):
+        if line not in self.failed:
+            self.failed.add(line)
+            self.report.failed += 1
+        self.report.add(line, field, *messages)
+
+    def add_validation_error(self, line, error):
+        for field, messages in error.message_dict.items():
+            self.add(line, None if field == NON_FIELD_ERRORS else field, *messages)
+
+    def __contains__(self, line):
+        return line in self.failed
+
+
+class Importer(object):
+    """Runs one import; use as a context manager so the hashing pool is shut down."""
+    def __init__(self, kind, archive=None, chunk_size=None, hash_workers=None, progress=None):
+        if kind not in ('users', 'posts'):
+            raise Exception('Unknown import %r.' % kind)
+        self.kind = kind
+        self.archive = zipfile.ZipFile(archive) if archive is not None else None
+        self.members = {info.filename: info for info in self.archive.infolist()} if self.archive else {}
+        self.chunk_size = chunk_size or import_setting('CHUNK_SIZE')
+        self.hash_workers = hash_workers or import_setting('HASH_WORKERS') or os.cpu_count() or 1
+        self.pool = None
+        self.report = ImportReport()
+        # Called with the report after every chunk.
+        self.progress = progress
+        # Unique values seen in earlier chunks of this file.
+        self.seen = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.pool is not None:
+            self.pool.shutdown()
+        if self.archive is not None:
+            self.archive.close()
+
+    def run(self, rows):
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if not chunk:
+                return self.report
+            errors = RowErrors(self.report)
+            for line, row in chunk:
+                if row.get('__invalid__'):
+                    errors.add(line, None, 'Not a JSON object.')
+            chunk = [(line, row) for line, row in chunk if line not in errors]
+            if self.kind == 'users':
+                self.import_users(chunk, errors)
+            else:
+                self.import_posts(chunk, errors)
+            if self.progress is not None:
+                self.progress(self.report)
+
+    def hash_passwords(self, passwords):
+        if len(passwords) < POOL_THRESHOLD or self.hash_workers < 2:
+            return [make_password(password) for password in passwords]
+        if self.pool is None:
+            self.pool = process_pool(self.hash_workers)
+        return list(self.pool.map(make_password, passwords, chunksize=max(1, len(passwords) // (self.hash_workers * 4))))
+
+    def check_unique(self, model, field, values, errors):
+        """Report lines whose ``values[line]`` repeats an earlier row or a stored value."""
+        first = {}
+        for line, value in values.items():
+            if value in self.seen or value in first:
+                errors.add(line, field, 'Duplicate %s in this file.' % field)
+            else:
+                first[value] = line
+        for value in model.objects.filter(**{field + '__in': list(first)}).values_list(field, flat=True):
+            errors.add(first[value], field, '%s with this %s already exists.' % (
+                model._meta.verbose_name.capitalize(), field
+            ))
+        self.seen.update(first)
+
+    def write(self, lines, errors, write):
+        """Run ``write()`` in a transaction; on a database error every line of the chunk fails."""
+        try:
+            with transaction.atomic():
+                write()
+        except DatabaseError as e:
+            for line in lines:
+                errors.add(line, None, 'Not imported: %s' % e)
+            return False
+        self.report.created += len(lines)
+        return True
+
+    def import_users(self, chunk, errors):
+        users, profiles, passwords = {}, {}, {}
+        for line, row in chunk:
+            user = UserProfile(email=UserProfile.objects.normalize_email(_text(row, 'email')), name=_text(row, 'name'))
+            try:
+                user.full_clean(exclude=['password'], validate_unique=False)
+            except ValidationError as e:
+                errors.add_validation_error(line, e)
+            users[line] = user
+            if _text(row, 'password'):
+                passwords[line] = _text(row, 'password')
+            if any(_text(row, name) for name in PROFILE_COLUMNS):
+                profile = ProfileDetails(**{name: _text(row, name) for name in PROFILE_COLUMNS})
+                profile.allow_public_view = profile.allow_public_view.upper() or 'N'
+                try:
+                    profile.full_clean(exclude=['user'], validate_unique=False)
+                except ValidationError as e:
+                    errors.add_validation_error(line, e)
+                profiles[line] = profile
+        self.check_unique(
+            UserProfile, 'email', {line: user.email for line, user in users.items() if line not in errors}, errors
+        )
+
+        valid = [line for line in users if line not in errors]
+        hashed = dict(zip(
+            [line for line in valid if line in passwords],
+            self.hash_passwords([passwords[line] for line in valid if line in passwords]),
+        ))
+        for line in valid:
+            if line in hashed:
+                users[line].password = hashed[line]
+            else:
+                users[line].set_unusable_password()
+
+        def write():
+            bulk_insert(UserProfile, [users[line] for line in valid])
+            for line in valid:
+                if line in profiles:
+                    profiles[line].user = users[line]
+            bulk_insert(ProfileDetails, [profiles[line] for line in valid if line in profiles])
+        self.write(valid, errors, write)
+
+    def import_posts(self, chunk, errors):
+        authors = UserProfile.objects.filter(
+            email__in={UserProfile.objects.normalize_email(_text(row, 'author')) for _, row in chunk}
+        ).in_bulk(field_name='email')
+        posts, files = {}, {}
+        for line, row in chunk:
+            author = authors.get(UserProfile.objects.normalize_email(_text(row, 'author')))
+            if author is None:
+                errors.add(line, 'author', 'No user with this email.')
+            post = Post(
+                user_profile=author,
+                backup_link=_text(row, 'backup_link') or None,
+                **{name: _text(row, name) for name in ('title', 'type_of_submission', 'course_name', 'subject', 'description')}
+            )
+            try:
+                post.full_clean(exclude=['user_profile', 'search_vector'], validate_unique=False)
+            except ValidationError as e:
+                errors.add_validation_error(line, e)
+            posts[line] = post
+            name = _text(row, 'file')
+            if name:
+                info = self.members.get(name)
+                if info is None or info.is_dir():
+                    errors.add(line, 'file', 'Not found in the archive.')
+                elif info.file_size > uploads_setting('MAX_FILE_SIZE'):
+                    errors.add(line, 'file', 'File exceeds the maximum upload size.')
+                else:
+                    files[line] = (info, _text(row, 'file_description'))
+        self.check_unique(Post, 'backup_link', {
+            line: post.backup_link for line, post in posts.items() if post.backup_link and line not in errors
+        }, errors)
+
+        valid = [line for line in posts if line not in errors]
+
+        def write():
+            bulk_insert(Post, [posts[line] for line in valid])
+            uploads = []
+            for line in valid:
+                if line in files:
+                    info, description = files[line]
+                    upload = PostUpload(post=posts[line], description=description)
+                    with self.archive.open(info) as member:
+                        content = File(member, name=os.path.basename(info.filename))
+                        content.size = info.file_size
+                        store_file(upload, content, content.name, hash_file(content), info.file_size)
+                    uploads.append(upload)
+            bulk_insert(PostUpload, uploads)
+        self.write(valid, errors, write)
+
+
+def import_file(kind, stream, fmt, archive=None, chunk_size=None, hash_workers=None, progress=None):
+    """Import every row of ``stream``; returns the ``ImportReport``."""
+    if fmt not in FORMATS:
+        raise Exception('Unknown format %r.' % fmt)
+    with Importer(kind, archive, chunk_size, hash_workers, progress) as importer:
+        return importer.run(read_rows(stream, fmt))
+
+
+def run_import_job(job_id):
+    """Run a pending ``ImportJob``, then let go of its files."""
+    if not ImportJob.objects.filter(pk=job_id, status='P').update(status='R'):
+        return
+    job = ImportJob.objects.get(pk=job_id)
+
+    def progress(report):
+        ImportJob.objects.filter(pk=job_id).update(
+            created=report.created, failed=report.failed, report=json.dumps(report.as_dict()),
+        )
+
+    try:
+        with job.file.open('rb') as stream:
+            archive = job.archive.open('rb') if job.archive else None
+            try:
+                report = import_file(job.kind, stream, job.format, archive, progress=progress)
+            finally:
+                if archive is not None:
+                    archive.close()
+    except Exception as e:
+        ImportJob.objects.filter(pk=job_id).update(status='F', report=json.dumps({'error': str(e)}))
+        raise
+    else:
+        progress(report)
+        ImportJob.objects.filter(pk=job_id).update(status='D')
+    finally:
+        job.refresh_from_db()
+        job.file = job.archive = ''
+        job.save(update_fields=['file', 'archive', 'updated_at'])
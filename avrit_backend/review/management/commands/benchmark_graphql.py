@@ -0,0 +1,84 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from avrit_backend import benchmarks
+from avrit_backend.ratelimit import rate_limit_setting
+from avrit_backend.views import async_setting
+
+
+class Command(BaseCommand):
+    help = (
+        'Run the GraphQL benchmark catalog against the data from generate_benchmark_data and report '
+        'latency percentiles, SQL statements and memory per query. Fails when a query regresses '
+        'against the baseline file; --save-baseline records a new one, and with --check a missing '
+        'baseline is an error too.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--query', action='append', dest='names', metavar='NAME',
+                            choices=[benchmark.name for benchmark in benchmarks.CATALOG],
+                            help='Only run this catalog entry; may be repeated.')
+        parser.add_argument('--baseline', default=os.path.join(settings.BASE_DIR, 'benchmark_baseline.json'))
+        parser.add_argument('--save-baseline', action='store_true')
+        parser.add_argument('--check', action='store_true', help='Fail when there is no baseline to compare with.')
+        parser.add_argument('--latency-tolerance', type=float, default=0.5,
+                            help='Allowed p50 slowdown as a fraction of the baseline.')
+        parser.add_argument('--memory-tolerance', type=float, default=0.25,
+                            help='Allowed memory growth as a fraction of the baseline.')
+
+    def handle(self, *args, **options):
+        if async_setting('ENABLED'):
+            # Mutations are rolled back, which needs them on this thread.
+            raise CommandError('Run the benchmark with GRAPHQL_ASYNC disabled.')
+        # Benchmark clients go over any real rate limit. Unlimited buckets
+        # keep the cost of the limiter itself in the measurements.
+        rate_limit = dict(getattr(settings, 'GRAPHQL_RATE_LIMIT', {}), BUCKETS={
+            name: {'CAPACITY': 10 ** 9, 'RATE': 10 ** 9} for name in rate_limit_setting('BUCKETS')
+        })
+        try:
+            with override_settings(ALLOWED_HOSTS=['testserver'], GRAPHQL_RATE_LIMIT=rate_limit):
+                results = benchmarks.run(options['iterations'], options['warmup'], options['names'])
+        except Exception as e:
+            raise CommandError(str(e))
+        dataset = benchmarks.dataset()
+
+        self.stdout.write('%-24s %9s %9s %9s %6s %10s' % ('query', 'p50 ms', 'p95 ms', 'p99 ms', 'sql', 'KiB'))
+        for name, result in results.items():
+            self.stdout.write('%-24s %9.2f %9.2f %9.2f %6d %10.1f' % (
+                name, result['p50'], result['p95'], result['p99'], result['sql'], result['memory_kib']
+            ))
+
+        if options['save_baseline']:
+            baseline = {'dataset': dataset, 'queries': results}
+            if options['names'] and os.path.exists(options['baseline']):
+                with open(options['baseline']) as f:
+                    previous = json.load(f)
+                baseline['queries'] = dict(previous.get('queries', {}), **results)
+            with open(options['baseline'], 'w') as f:
+                json.dump(baseline, f, indent=2, sort_keys=True)
+            self.stdout.write(self.style.SUCCESS('Baseline written to %s.' % options['baseline']))
+            return
+
+        if not os.path.exists(options['baseline']):
+            if options['check']:
+                raise CommandError('No baseline at %s; record one with --save-baseline.' % options['baseline'])
+            self.stdout.write(self.style.WARNING('No baseline at %s; nothing to compare.' % options['baseline']))
+            return
+        with open(options['baseline']) as f:
+            baseline = json.load(f)
+        if baseline.get('dataset') != dataset:
+            self.stdout.write(self.style.WARNING(
+                'The baseline was recorded on a different data set (%s); results may not compare.' % baseline.get('dataset')
+            ))
+        regressions = benchmarks.compare(
+            results, baseline, options['latency_tolerance'], options['memory_tolerance']
+        )
+        if regressions:
+            raise CommandError('Regressions against %s:\n  %s' % (options['baseline'], '\n  '.join(regressions)))
+        self.stdout.write(self.style.SUCCESS('No regressions against %s.' % options['baseline']))
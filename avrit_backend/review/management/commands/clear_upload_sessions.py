@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from review.uploads import clear_expired_sessions
+
+
+class Command(BaseCommand):
+    help = 'Delete expired upload sessions and their partial files.'
+
+    def handle(self, *args, **options):
+        count = clear_expired_sessions()
+        self.stdout.write(self.style.SUCCESS('Deleted %d expired upload sessions.' % count))
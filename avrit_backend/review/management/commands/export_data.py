@@ -0,0 +1,42 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from review.export import FORMATS, RESOURCES, export_chunks, parse_watermark
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream every row of a resource updated since --since as NDJSON or CSV, reading the database '
+        'with a server-side cursor. The watermark to pass as --since next time is printed to stderr.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('resource', choices=sorted(RESOURCES))
+        parser.add_argument('--format', dest='fmt', choices=sorted(FORMATS), default='ndjson')
+        parser.add_argument('--since', help='ISO 8601 watermark of the previous export.')
+        parser.add_argument('--until', help='ISO 8601 end of the window; defaults to now.')
+        parser.add_argument('--output', default='-', help='File to write, or - for stdout.')
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--chunk-size', type=int)
+
+    def handle(self, *args, **options):
+        try:
+            since = parse_watermark(options['since'])
+            until = parse_watermark(options['until']) or timezone.now()
+        except Exception as e:
+            raise CommandError(str(e))
+        chunks = export_chunks(
+            options['resource'], options['fmt'], since, until, options['gzip'], options['chunk_size']
+        )
+        if options['output'] == '-':
+            output = sys.stdout.buffer
+            for chunk in chunks:
+                output.write(chunk)
+            output.flush()
+        else:
+            with open(options['output'], 'wb') as output:
+                for chunk in chunks:
+                    output.write(chunk)
+        self.stderr.write('watermark %s' % until.isoformat())
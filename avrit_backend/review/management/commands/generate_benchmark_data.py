@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from avrit_backend import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        'Create the reproducible bench-* data set used by benchmark_graphql. '
+        'The same --seed and sizes always produce the same data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0)
+        for name, default in benchmarks.SCALE.items():
+            parser.add_argument('--' + name.replace('_', '-'), dest=name, type=int, default=default)
+        parser.add_argument('--clear', action='store_true', help='Delete an existing benchmark data set first.')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            self.stdout.write('Deleted %d rows.' % benchmarks.clear())
+        scale = {name: options[name] for name in benchmarks.SCALE}
+        try:
+            counts = benchmarks.generate(options['seed'], **scale)
+        except Exception as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS('Created %s.' % ', '.join(
+            '%d %s' % (count, name.replace('_', ' ')) for name, count in counts.items()
+        )))
@@ -0,0 +1,52 @@
+import csv
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from review.imports import FORMATS, import_file
+
+
+class Command(BaseCommand):
+    help = (
+        'Import users with profiles, or posts with files from a zip archive, from a CSV or NDJSON file. '
+        'Rows are validated and written in chunks; rows that fail are listed with their line numbers.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=('users', 'posts'))
+        parser.add_argument('file', help='CSV or NDJSON file, or - for stdin.')
+        parser.add_argument('--format', dest='fmt', choices=FORMATS,
+                            help='Defaults to ndjson for .ndjson/.jsonl names and csv otherwise.')
+        parser.add_argument('--archive', help='Zip with the files named in the "file" column of posts.')
+        parser.add_argument('--chunk-size', type=int)
+        parser.add_argument('--workers', type=int, help='Password hashing processes; defaults to the CPU count.')
+        parser.add_argument('--errors', help='Write the per-row errors to this CSV file instead of stderr.')
+
+    def handle(self, *args, **options):
+        fmt = options['fmt'] or ('ndjson' if options['file'].lower().endswith(('.ndjson', '.jsonl')) else 'csv')
+        try:
+            stream = sys.stdin.buffer if options['file'] == '-' else open(options['file'], 'rb')
+        except OSError as e:
+            raise CommandError(str(e))
+        try:
+            report = import_file(
+                options['kind'], stream, fmt, options['archive'], options['chunk_size'], options['workers']
+            )
+        except Exception as e:
+            raise CommandError(str(e))
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+
+        if report.errors:
+            output = open(options['errors'], 'w', newline='') if options['errors'] else self.stderr
+            try:
+                writer = csv.writer(output)
+                writer.writerow(('line', 'field', 'messages'))
+                for line, field, messages in report.errors:
+                    writer.writerow((line, field or '', ' '.join(messages)))
+            finally:
+                if options['errors']:
+                    output.close()
+        style = self.style.SUCCESS if not report.failed else self.style.WARNING
+        self.stdout.write(style('%d rows imported, %d rows failed.' % (report.created, report.failed)))
@@ -0,0 +1,111 @@
+import json
+import os
+import threading
+import time
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+QUERY = (
+    '{ allPost(first: 20) { edges { node { title reviewCount commentCount } } } '
+    'pubAllProfile(first: 20) { edges { node { researchInterest } } } }'
+)
+
+
+def process_tree(pid):
+    """``pid`` and all its descendants, read from /proc."""
+    pids = [pid]
+    for current in pids:
+        for task in os.listdir('/proc/%d/task' % current):
+            try:
+                with open('/proc/%d/task/%s/children' % (current, task)) as f:
+                    pids.extend(int(child) for child in f.read().split())
+            except OSError:
+                pass
+    return pids
+
+
+def rss_bytes(pids):
+    total = 0
+    for pid in pids:
+        try:
+            with open('/proc/%d/status' % pid) as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    return total
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Send concurrent GraphQL requests to a running server and report throughput, latency and, '
+        'given --pid, the peak memory of the server processes. Compare the WSGI and ASGI setups by '
+        'running it against `gunicorn -w N avrit_backend.wsgi` and `uvicorn --workers N '
+        'avrit_backend.asgi:application` with the same N.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000/graphql')
+        parser.add_argument('--query', default=QUERY)
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--duration', type=float, default=20.0, help='Seconds to run for.')
+        parser.add_argument('--token', help='JWT sent in the Authorization header.')
+        parser.add_argument('--pid', type=int, help='Server master process; its workers are included.')
+
+    def handle(self, *args, **options):
+        body = json.dumps({'query': options['query']})
+        headers = {'Content-Type': 'application/json'}
+        if options['token']:
+            headers['Authorization'] = 'JWT ' + options['token']
+        deadline = time.monotonic() + options['duration']
+        latencies = []
+        failures = []
+        lock = threading.Lock()
+
+        def worker():
+            session = requests.Session()
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    response = session.post(options['url'], data=body, headers=headers, timeout=60)
+                    failed = response.status_code != 200 or 'errors' in response.json()
+                except (requests.RequestException, ValueError) as e:
+                    failed = str(e)
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed)
+                    if failed:
+                        failures.append(failed)
+
+        try:
+            requests.post(options['url'], data=body, headers=headers, timeout=60).raise_for_status()
+        except requests.RequestException as e:
+            raise CommandError('Warm-up request failed: %s' % e)
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(options['concurrency'])]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        peak_rss = 0
+        while any(thread.is_alive() for thread in threads):
+            if options['pid']:
+                peak_rss = max(peak_rss, rss_bytes(process_tree(options['pid'])))
+            time.sleep(0.5)
+        elapsed = time.monotonic() - started
+
+        latencies.sort()
+        self.stdout.write('requests     %d (%d failed)' % (len(latencies), len(failures)))
+        self.stdout.write('throughput   %.1f req/s' % (len(latencies) / elapsed))
+        self.stdout.write('latency      p50 %.1f ms  p95 %.1f ms  p99 %.1f ms' % tuple(
+            percentile(latencies, fraction) * 1000 for fraction in (0.5, 0.95, 0.99)
+        ))
+        if options['pid']:
+            self.stdout.write('server RSS   %.1f MiB peak' % (peak_rss / 1024 / 1024))
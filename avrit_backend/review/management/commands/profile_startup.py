@@ -0,0 +1,81 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from avrit_backend import startup
+
+
+class Command(BaseCommand):
+    help = (
+        'Boot Django in fresh interpreters and report the boot time and the import time per module, '
+        'for a plain django.setup() and for a server worker up to its first request. Fails when '
+        'django.setup() imports one of STARTUP["LAZY_MODULES"] or boot time regresses against the '
+        'baseline file; --save-baseline records a new one, and with --check a missing baseline is an '
+        'error too.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Boots to take the median time of.')
+        parser.add_argument('--stage', choices=sorted(startup.STAGES), default='server',
+                            help='The stage to list modules of.')
+        parser.add_argument('--sort', choices=('self', 'cumulative'), default='cumulative')
+        parser.add_argument('--by-package', action='store_true', help='Sum self time by top-level package.')
+        parser.add_argument('--limit', type=int, default=30)
+        parser.add_argument('--baseline', default=os.path.join(settings.BASE_DIR, 'startup_baseline.json'))
+        parser.add_argument('--save-baseline', action='store_true')
+        parser.add_argument('--check', action='store_true', help='Fail when there is no baseline to compare with.')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed slowdown as a fraction of the baseline.')
+
+    def handle(self, *args, **options):
+        try:
+            profiles = {stage: startup.profile_imports(stage, options['runs']) for stage in startup.STAGES}
+        except Exception as e:
+            raise CommandError(str(e))
+        results = {
+            stage: {
+                'boot_ms': profile['boot_ms'],
+                'modules': len(profile['modules']),
+                'packages': startup.by_package(profile['modules']),
+            }
+            for stage, profile in profiles.items()
+        }
+
+        modules = profiles[options['stage']]['modules']
+        if options['by_package']:
+            rows = sorted(results[options['stage']]['packages'].items(), key=lambda item: -item[1])
+            self.stdout.write('%-48s %9s' % ('package', 'self ms'))
+            for package, self_ms in rows[:options['limit']]:
+                self.stdout.write('%-48s %9.1f' % (package, self_ms))
+        else:
+            column = 0 if options['sort'] == 'self' else 1
+            rows = sorted(modules.items(), key=lambda item: -item[1][column])
+            self.stdout.write('%-48s %9s %9s' % ('module', 'self ms', 'cum ms'))
+            for name, (self_ms, cumulative_ms, _) in rows[:options['limit']]:
+                self.stdout.write('%-48s %9.1f %9.1f' % (name, self_ms, cumulative_ms))
+        for stage, result in sorted(results.items()):
+            self.stdout.write('%s: boot %.0f ms, %d modules' % (stage, result['boot_ms'], result['modules']))
+
+        eager = startup.eager_imports(profiles['setup']['modules'])
+        if eager:
+            raise CommandError('django.setup() imports %s, which must stay lazy.' % ', '.join(eager))
+
+        if options['save_baseline']:
+            with open(options['baseline'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+            self.stdout.write(self.style.SUCCESS('Baseline written to %s.' % options['baseline']))
+            return
+
+        if not os.path.exists(options['baseline']):
+            if options['check']:
+                raise CommandError('No baseline at %s; record one with --save-baseline.' % options['baseline'])
+            self.stdout.write(self.style.WARNING('No baseline at %s; nothing to compare.' % options['baseline']))
+            return
+        with open(options['baseline']) as f:
+            baseline = json.load(f)
+        regressions = startup.compare(results, baseline, options['tolerance'])
+        if regressions:
+            raise CommandError('Regressions against %s:\n  %s' % (options['baseline'], '\n  '.join(regressions)))
+        self.stdout.write(self.style.SUCCESS('No regressions against %s.' % options['baseline']))
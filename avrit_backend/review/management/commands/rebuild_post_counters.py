@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from review import counters
+from review.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Recompute the review and comment counters of every post from the review and comment tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        using = options['database']
+        batch_size = options['batch_size']
+        pks = list(Post.objects.using(using).order_by('pk').values_list('pk', flat=True))
+        updated = 0
+        # One short transaction per batch keeps row locks brief on a live database.
+        for start in range(0, len(pks), batch_size):
+            with transaction.atomic(using=using):
+                updated += counters.refresh(pks[start:start + batch_size], using)
+        self.stdout.write(self.style.SUCCESS('Rebuilt counters of %d posts.' % updated))
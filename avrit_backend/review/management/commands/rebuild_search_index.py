@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from review.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Create the post search index structures and rebuild them from existing posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        using = options['database']
+        backend = get_backend(using)
+        backend.install(using)
+        backend.rebuild(using)
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt with %s.' % type(backend).__name__))
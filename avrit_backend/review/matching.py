@@ -0,0 +1,229 @@
+"""Suggest reviewers for a post by matching it against research interests.
+
+Each process keeps an inverted index from terms to the public profiles whose
+``research_interest`` mentions them. Profile weights are log term frequencies
+normalised to unit length, and query weights are log term frequencies
+scaled by the current idf (the SMART lnc.ltc scheme). Profile weights
+therefore don't depend on the rest of the collection, so a profile can be
+added or removed without touching any other entry.
+
+Ranking a post reads only the postings of the post's terms. Reviewers who
+already reviewed the post (``Review.unique_together``) and the post's author
+are skipped. Each score is divided by ``1 + LOAD_PENALTY * load``, where
+load is the number of reviews written in the last ``LOAD_WINDOW_DAYS``
+days, so work spreads across equally good matches.
+
+A saved or deleted profile updates the local index once the transaction
+commits, and bumps a version in the cache. Other processes compare versions
+before ranking and re-read the profiles changed since their last sync.
+"""
+import math
+import re
+import threading
+import uuid
+from collections import Counter, defaultdict
+from datetime import timedelta
+from heapq import nlargest
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from profiles_api.models import ProfileDetails
+from review.models import Review
+
+DEFAULTS = {
+    'CACHE': 'default',
+    'LOAD_WINDOW_DAYS': 30,
+    'LOAD_PENALTY': 0.25,
+    'MAX_SUGGESTIONS': 50,
+    # Re-read profiles saved this long before the last sync, in case their
+    # transactions committed late.
+    'SYNC_OVERLAP': 300,
+}
+VERSION_KEY = 'reviewer-index:version'
+STOP_WORDS = frozenset((
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in', 'into', 'is', 'it', 'its', 'of',
+    'on', 'or', 'that', 'the', 'to', 'with', 'etc', 'also', 'other', 'using', 'based', 'study', 'studies',
+))
+TOKEN_RE = re.compile(r'[^\W_]+', re.UNICODE)
+
+
+def matching_setting(name):
+    return getattr(settings, 'REVIEWER_MATCHING', {}).get(name, DEFAULTS[name])
+
+
+def _stem(word):
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 3 and word.endswith('s') and not word.endswith(('ss', 'us', 'is', 'ics')):
+        return word[:-1]
+    return word
+
+
+def terms(text):
+    """Lowercased, lightly stemmed words of ``text`` with stop words removed."""
+    return [
+        _stem(word) for word in TOKEN_RE.findall((text or '').lower())
+        if len(word) > 1 and word not in STOP_WORDS and not word.isdigit()
+    ]
+
+
+def _log_tf(count):
+    return 1 + math.log(count)
+
+
+def profile_weights(text):
+    weights = {term: _log_tf(count) for term, count in Counter(terms(text)).items()}
+    norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+    return {term: weight / norm for term, weight in weights.items()} if norm else {}
+
+
+def post_text(post):
+    return ' '.join(filter(None, (post.subject, post.course_name, post.title)))
+
+
+class ReviewerIndex(object):
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.postings = defaultdict(dict)
+        self.profiles = {}
+        self.version = None
+        self.synced_at = None
+        self.built = False
+
+    def _add(self, user_id, text):
+        self._remove(user_id)
+        weights = profile_weights(text)
+        if weights:
+            self.profiles[user_id] = weights
+            for term, weight in weights.items():
+                self.postings[term][user_id] = weight
+
+    def _remove(self, user_id):
+        for term in self.profiles.pop(user_id, ()):
+            postings = self.postings[term]
+            postings.pop(user_id, None)
+            if not postings:
+                del self.postings[term]
+
+    def _apply(self, rows):
+        for user_id, text, public, updated_at in rows:
+            if public == 'Y':
+                self._add(user_id, text)
+            else:
+                self._remove(user_id)
+            if self.synced_at is None or updated_at > self.synced_at:
+                self.synced_at = updated_at
+
+    def update(self, profile):
+        with self._lock:
+            self._apply([(profile.user_id, profile.research_interest, profile.allow_public_view, profile.updated_at)])
+
+    def remove(self, user_id):
+        with self._lock:
+            self._remove(user_id)
+
+    def sync(self):
+        """Load the index, or catch up with profiles changed in other processes."""
+        version = _get_cache().get(VERSION_KEY)
+        if self.built and version == self.version:
+            return
+        with self._lock:
+            rows = ProfileDetails.objects.values_list('user_id', 'research_interest', 'allow_public_view', 'updated_at')
+            if self.built and self.synced_at is not None:
+                rows = rows.filter(updated_at__gte=self.synced_at - timedelta(seconds=matching_setting('SYNC_OVERLAP')))
+            self._apply(rows.iterator())
+            self.version = version
+            self.built = True
+
+    def search(self, text, exclude=(), limit=10):
+        """Return up to ``limit`` ``(score, user_id, matched_terms)`` by cosine similarity."""
+        query = Counter(terms(text))
+        with self._lock:
+            total = len(self.profiles)
+            weights = {}
+            for term, count in query.items():
+                postings = self.postings.get(term)
+                if postings:
+                    weights[term] = _log_tf(count) * math.log(1 + total / len(postings))
+            norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+            scores = defaultdict(float)
+            matched = defaultdict(list)
+            for term, weight in weights.items():
+                for user_id, profile_weight in self.postings[term].items():
+                    if user_id not in exclude:
+                        scores[user_id] += weight * profile_weight / norm
+                        matched[user_id].append(term)
+        best = nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [(score, user_id, sorted(matched[user_id])) for user_id, score in best]
+
+
+index = ReviewerIndex()
+
+
+def _get_cache():
+    return caches[matching_setting('CACHE')]
+
+
+def _changed():
+    _get_cache().set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def profile_saved(profile):
+    def apply():
+        index.update(profile)
+        _changed()
+    transaction.on_commit(apply)
+
+
+def profile_deleted(user_id):
+    def apply():
+        index.remove(user_id)
+        _changed()
+    transaction.on_commit(apply)
+
+
+def reviewer_loads(user_ids):
+    since = timezone.now() - timedelta(days=matching_setting('LOAD_WINDOW_DAYS'))
+    loads = (
+        Review.objects.filter(user_profile__in=user_ids, created_at__gte=since)
+        .order_by().values('user_profile').annotate(n=Count('pk')).values_list('user_profile', 'n')
+    )
+    return dict(loads)
+
+
+class Suggestion(object):
+    def __init__(self, profile, score, similarity, load, matched_terms):
+        self.profile = profile
+        self.score = score
+        self.similarity = similarity
+        self.load = load
+        self.matched_terms = matched_terms
+
+
+def suggest_reviewers(post, first=10):
+    """Rank public profiles as reviewers of ``post``, best first."""
+    first = min(first, matching_setting('MAX_SUGGESTIONS'))
+    if first <= 0:
+        return []
+    index.sync()
+    exclude = set(Review.objects.filter(post_id=post).values_list('user_profile_id', flat=True))
+    exclude.add(post.user_profile_id)
+    # The load penalty can reorder candidates, so rank a few more than needed.
+    candidates = index.search(post_text(post), exclude, limit=first * 3)
+    if not candidates:
+        return []
+    user_ids = [user_id for _, user_id, _ in candidates]
+    loads = reviewer_loads(user_ids)
+    profiles = ProfileDetails.objects.filter(allow_public_view='Y').in_bulk(user_ids)
+    penalty = matching_setting('LOAD_PENALTY')
+    suggestions = [
+        Suggestion(profiles[user_id], similarity / (1 + penalty * loads.get(user_id, 0)), similarity,
+                   loads.get(user_id, 0), matched_terms)
+        for similarity, user_id, matched_terms in candidates if user_id in profiles
+    ]
+    suggestions.sort(key=lambda suggestion: suggestion.score, reverse=True)
+    return suggestions[:first]
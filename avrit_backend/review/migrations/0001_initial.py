@@ -0,0 +1,91 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:11
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Post',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=225)),
+                ('type_of_submission', models.CharField(choices=[('EL', 'Evidence of Learning'), ('CG', 'Curriculum Guide'), ('TK', 'Assignment Task'), ('WB', 'Workbook'), ('PC', 'Practical'), ('PJ', 'Project'), ('LM', 'Learning Material'), ('BS', 'Brainstorm'), ('OD', 'Others')], max_length=3)),
+                ('course_name', models.CharField(max_length=225)),
+                ('subject', models.CharField(max_length=225)),
+                ('description', models.TextField()),
+                ('backup_link', models.CharField(blank=True, max_length=225, null=True, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user_profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Review',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('description', models.TextField()),
+                ('backup_link', models.CharField(blank=True, max_length=225, null=True, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('post_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reviews', related_query_name='review', to='review.post')),
+                ('user_profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user_profile', 'post_id')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ReviewUpload',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('description', models.TextField()),
+                ('revision', models.BooleanField(default=False)),
+                ('file_upload', models.FileField(upload_to='review')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('review', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='review_upload', related_query_name='review_upload', to='review.review')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ReviewComment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('comment', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('review', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reviewcomments', related_query_name='reviewcomment', to='review.review')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PostUpload',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('description', models.TextField()),
+                ('revision', models.BooleanField(default=False)),
+                ('file_upload', models.FileField(upload_to='post')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='post_upload', related_query_name='post_upload', to='review.post')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PostComment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('comment', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='postcomments', related_query_name='postcomment', to='review.post')),
+            ],
+        ),
+    ]
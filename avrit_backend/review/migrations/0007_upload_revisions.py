@@ -0,0 +1,80 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('review', '0006_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postupload',
+            name='delta',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name='postupload',
+            name='latest',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='postupload',
+            name='parent',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.RESTRICT, related_name='next_revision', to='review.postupload'),
+        ),
+        migrations.AddField(
+            model_name='postupload',
+            name='sequence',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='reviewupload',
+            name='delta',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name='reviewupload',
+            name='latest',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='reviewupload',
+            name='parent',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.RESTRICT, related_name='next_revision', to='review.reviewupload'),
+        ),
+        migrations.AddField(
+            model_name='reviewupload',
+            name='sequence',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AlterField(
+            model_name='postupload',
+            name='file_upload',
+            field=models.FileField(blank=True, upload_to='post'),
+        ),
+        migrations.AlterField(
+            model_name='reviewupload',
+            name='file_upload',
+            field=models.FileField(blank=True, upload_to='review'),
+        ),
+        migrations.AddIndex(
+            model_name='postupload',
+            index=models.Index(fields=['post', '-created_at', '-id'], name='post_upload_history_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='postupload',
+            index=models.Index(condition=models.Q(('latest', True)), fields=['post'], name='post_upload_latest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reviewupload',
+            index=models.Index(fields=['review', '-created_at', '-id'], name='review_upload_history_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reviewupload',
+            index=models.Index(condition=models.Q(('latest', True)), fields=['review'], name='review_upload_latest_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('review', '0007_upload_revisions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='chunk_lease',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
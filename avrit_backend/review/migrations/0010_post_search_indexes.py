@@ -0,0 +1,26 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:31
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+from review.operations import PostgresAddIndex
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('review', '0009_importjob'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        PostgresAddIndex(
+            model_name='post',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='review_post_search_vector_idx'),
+        ),
+        PostgresAddIndex(
+            model_name='post',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['title'], name='review_post_title_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
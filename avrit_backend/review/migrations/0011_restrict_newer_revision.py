@@ -0,0 +1,24 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:34
+
+from django.db import migrations, models
+import review.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('review', '0010_post_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='postupload',
+            name='parent',
+            field=models.OneToOneField(blank=True, null=True, on_delete=review.models.restrict_newer_revision, related_name='next_revision', to='review.postupload'),
+        ),
+        migrations.AlterField(
+            model_name='reviewupload',
+            name='parent',
+            field=models.OneToOneField(blank=True, null=True, on_delete=review.models.restrict_newer_revision, related_name='next_revision', to='review.reviewupload'),
+        ),
+    ]
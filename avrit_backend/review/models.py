@@ -1,6 +1,23 @@
+import os
+import uuid
+
 from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from profiles_api.models import UserProfile
+from avrit_backend.uploads import temp_dir
+
+
 
+def restrict_newer_revision(collector, field, sub_objs, using):
+    """``RESTRICT`` for ``parent``: a revision can only go with its newer ones.
+
+    Django's ``RESTRICT`` also makes uploads depend on themselves, which
+    stops ``Collector`` ordering a delete, so a post would be deleted before
+    its reviews' comments and their delete signals would find it gone. The
+    revisions of one model are deleted in one statement anyway.
+    """
+    collector.add_restricted_objects(field, sub_objs)
 
 
 class Post(models.Model):
@@ -24,7 +41,22 @@ class Post(models.Model):
     description = models.TextField()
     backup_link = models.CharField(max_length=225,blank=True, null=True, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Maintained by review.counters; rebuild with `manage.py rebuild_post_counters`.
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    last_reviewed_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='post_created_at_id_idx'),
+            models.Index(fields=['-review_count', '-id'], name='post_review_count_id_idx'),
+            models.Index(fields=['-comment_count', '-id'], name='post_comment_count_id_idx'),
+            # Created on Postgres only, see review.operations.PostgresAddIndex.
+            GinIndex(fields=['search_vector'], name='review_post_search_vector_idx'),
+            GinIndex(fields=['title'], opclasses=['gin_trgm_ops'], name='review_post_title_trgm_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -39,9 +71,25 @@ class PostUpload(models.Model):
     )
     description = models.TextField()
     revision = models.BooleanField(default=False)
-    file_upload = models.FileField(upload_to="post")
+    file_upload = models.FileField(upload_to="post", blank=True)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    size = models.BigIntegerField(default=0)
+    # The revision this one replaces; see review.revisions.
+    parent = models.OneToOneField(
+        'self', null=True, blank=True, on_delete=restrict_newer_revision, related_name="next_revision",
+    )
+    sequence = models.PositiveIntegerField(default=1)
+    latest = models.BooleanField(default=True)
+    delta = models.BinaryField(null=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', '-created_at', '-id'], name='post_upload_history_idx'),
+            models.Index(fields=['post'], condition=models.Q(latest=True), name='post_upload_latest_idx'),
+        ]
+
     def __str__(self):
         """Return post title"""
         return self.post.title
@@ -56,7 +104,7 @@ class PostComment(models.Model):
     )
     comment = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     def __str__(self):
         """Return post title"""
         return self.post.title
@@ -73,7 +121,7 @@ class Review(models.Model):
     description = models.TextField()
     backup_link = models.CharField(max_length=225,blank=True, null=True, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         unique_together= ('user_profile', 'post_id')
@@ -93,9 +141,25 @@ class ReviewUpload(models.Model):
     )
     description = models.TextField()
     revision = models.BooleanField(default=False)
-    file_upload = models.FileField(upload_to="review")
+    file_upload = models.FileField(upload_to="review", blank=True)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    size = models.BigIntegerField(default=0)
+    # The revision this one replaces; see review.revisions.
+    parent = models.OneToOneField(
+        'self', null=True, blank=True, on_delete=restrict_newer_revision, related_name="next_revision",
+    )
+    sequence = models.PositiveIntegerField(default=1)
+    latest = models.BooleanField(default=True)
+    delta = models.BinaryField(null=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['review', '-created_at', '-id'], name='review_upload_history_idx'),
+            models.Index(fields=['review'], condition=models.Q(latest=True), name='review_upload_latest_idx'),
+        ]
+
     def __str__(self):
         """Return post title"""
         return self.review.post_id.title
@@ -111,7 +175,60 @@ class ReviewComment(models.Model):
     )
     comment = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     def __str__(self):
         """Return post title"""
         return self.review.post_id.title
+
+
+class UploadSession(models.Model):
+    """A resumable upload, received in chunks before it is attached to a post or review."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user_profile = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    block_hashes = models.TextField(blank=True, default='')
+    # Set while a chunk is being written, to when the writer's claim on the
+    # offset runs out.
+    chunk_lease = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def complete(self):
+        return self.offset == self.size
+
+    def temp_path(self):
+        return os.path.join(temp_dir(), '%s.part' % self.pk)
+
+    def __str__(self):
+        return self.filename
+
+
+IMPORT_STATUS = (
+    ('P', 'PENDING'),
+    ('R', 'RUNNING'),
+    ('D', 'DONE'),
+    ('F', 'FAILED'),
+)
+
+
+class ImportJob(models.Model):
+    """A bulk import started from the admin and run by the task queue, see review.imports."""
+    user_profile = models.ForeignKey(UserProfile, null=True, on_delete=models.SET_NULL)
+    kind = models.CharField(max_length=10)
+    format = models.CharField(max_length=10)
+    # Cleared once the import has run.
+    file = models.FileField(upload_to="imports", blank=True)
+    archive = models.FileField(upload_to="imports", blank=True)
+    status = models.CharField(max_length=1, choices=IMPORT_STATUS, default='P')
+    created = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    # ImportReport.as_dict() so far, or the reason the import failed.
+    report = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '%s import %s' % (self.kind, self.pk)
@@ -0,0 +1,19 @@
+"""Migration operations for schema that only exists on Postgres."""
+from django.db import migrations
+
+
+class PostgresAddIndex(migrations.AddIndex):
+    """``AddIndex`` that only changes Postgres databases.
+
+    The index is part of the model state everywhere, so Postgres index types
+    such as ``GinIndex`` can be declared on models that SQLite migrates too.
+    An index of the same name left by an earlier setup is replaced.
+    """
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.execute('DROP INDEX IF EXISTS %s' % schema_editor.quote_name(self.index.name))
+            super(PostgresAddIndex, self).database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super(PostgresAddIndex, self).database_backwards(app_label, schema_editor, from_state, to_state)
@@ -0,0 +1,202 @@
+"""Revision chains of post and review uploads.
+
+An upload created with a ``parent`` is the next revision of it: it gets the
+parent's ``sequence`` plus one, and the parent stops being ``latest``. A
+revision can only be replaced once, so every chain is a straight line.
+
+The latest revision is always stored as a file. Once a text file has been
+replaced, ``compact_revision`` stores it as ``delta``, the lines that differ
+from its next revision, and drops its file. Every ``KEYFRAME_INTERVAL``-th
+revision is kept in full, so rebuilding a revision never applies more than
+``KEYFRAME_INTERVAL - 1`` deltas. Files that are binary, larger than
+``DELTA_MAX_SIZE``, shared with other uploads or that do not shrink to
+``DELTA_MAX_RATIO`` of their size are kept as they are.
+"""
+import json
+import mimetypes
+import os
+import zlib
+from difflib import SequenceMatcher
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+
+from avrit_backend.tasks import enqueue
+from review.models import PostUpload, ReviewUpload
+from review.uploads import store_file
+
+DEFAULTS = {
+    'DELTA_MAX_SIZE': 1024 * 1024,
+    'DELTA_MAX_RATIO': 0.5,
+    'KEYFRAME_INTERVAL': 10,
+}
+KINDS = {'post': PostUpload, 'review': ReviewUpload}
+OWNERS = {PostUpload: 'post_id', ReviewUpload: 'review_id'}
+
+
+def revisions_setting(name):
+    return getattr(settings, 'REVISIONS', {}).get(name, DEFAULTS[name])
+
+
+def upload_kind(upload):
+    return 'post' if isinstance(upload, PostUpload) else 'review'
+
+
+def start_revision(upload, parent_id):
+    """Make the unsaved ``upload`` the next revision of ``parent_id``; run inside a transaction."""
+    model = type(upload)
+    owner = OWNERS[model]
+    parent = model.objects.select_for_update().filter(pk=parent_id, **{owner: getattr(upload, owner)}).first()
+    if parent is None:
+        raise Exception('Upload to revise not found.')
+    if not parent.latest:
+        raise Exception('This upload already has a newer revision.')
+    upload.parent = parent
+    upload.sequence = parent.sequence + 1
+    upload.revision = True
+    parent.latest = False
+    parent.save(update_fields=['latest', 'updated_at'])
+    enqueue('review.revisions.compact_revision', upload_kind(parent), parent.pk)
+
+
+def _lines(data):
+    return data.splitlines(keepends=True)
+
+
+def encode_delta(name, base, target):
+    """A delta that rebuilds ``target`` from ``base``, both UTF-8 text."""
+    base_lines, target_lines = _lines(base), _lines(target)
+    ops = []
+    matcher = SequenceMatcher(None, base_lines, target_lines)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append(b''.join(target_lines[j1:j2]).decode('utf-8'))
+    return zlib.compress(json.dumps({'name': name, 'ops': ops}, separators=(',', ':')).encode('utf-8'))
+
+
+def decode_delta(delta):
+    return json.loads(zlib.decompress(bytes(delta)).decode('utf-8'))
+
+
+def apply_delta(base, delta):
+    base_lines = _lines(base)
+    parts = []
+    for op in decode_delta(delta)['ops']:
+        if isinstance(op, list):
+            parts.extend(base_lines[op[0]:op[1]])
+        else:
+            parts.append(op.encode('utf-8'))
+    return b''.join(parts)
+
+
+def stored_name(upload):
+    """The name ``upload`` was stored under, also once it is a delta."""
+    if upload.delta is not None:
+        return decode_delta(upload.delta)['name']
+    return upload.file_upload.name
+
+
+def revision_content(upload):
+    """The bytes of ``upload``, rebuilt from its newer revisions if it is stored as a delta."""
+    model = type(upload)
+    deltas = []
+    while upload.delta is not None:
+        deltas.append(upload.delta)
+        upload = model.objects.only('pk', 'file_upload', 'delta').get(parent=upload.pk)
+    with upload.file_upload.storage.open(upload.file_upload.name, 'rb') as f:
+        data = f.read()
+    for delta in reversed(deltas):
+        data = apply_delta(data, delta)
+    return data
+
+
+def content_type(upload):
+    return mimetypes.guess_type(stored_name(upload))[0] or 'application/octet-stream'
+
+
+def _is_text(data):
+    if b'\0' in data:
+        return False
+    try:
+        data.decode('utf-8')
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def _shared(name):
+    return sum(model.objects.filter(file_upload=name).count() for model in KINDS.values()) > 1
+
+
+def compact_revision(kind, pk):
+    """Store a replaced revision as a delta against the next one; true if it was."""
+    model = KINDS[kind]
+    max_size = revisions_setting('DELTA_MAX_SIZE')
+    with transaction.atomic():
+        upload = (
+            model.objects.select_for_update()
+            .filter(pk=pk, latest=False, delta__isnull=True, size__lte=max_size)
+            .exclude(file_upload='')
+            .first()
+        )
+        if upload is None or upload.sequence % revisions_setting('KEYFRAME_INTERVAL') == 0:
+            return False
+        name = upload.file_upload.name
+        if _shared(name):
+            return False
+        newer = model.objects.filter(parent=upload.pk).first()
+        if newer is None or newer.size > max_size:
+            return False
+        try:
+            with upload.file_upload.storage.open(name, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return False
+        base = revision_content(newer)
+        if not (_is_text(data) and _is_text(base)):
+            return False
+        delta = encode_delta(name, base, data)
+        if len(delta) > revisions_setting('DELTA_MAX_RATIO') * len(data) or apply_delta(base, delta) != data:
+            return False
+        upload.delta = delta
+        upload.file_upload = ''
+        upload.save(update_fields=['delta', 'file_upload', 'updated_at'])
+    return True
+
+
+def expand_revision(upload, content=None):
+    """Store a delta revision as a file again."""
+    if content is None:
+        content = revision_content(upload)
+    name = stored_name(upload)
+    store_file(upload, ContentFile(content), os.path.basename(name), upload.content_hash, upload.size)
+    upload.delta = None
+    upload.save(update_fields=['delta', 'file_upload', 'updated_at'])
+
+
+def keep_parent_content(upload):
+    """Before the latest revision is deleted, rebuild its parent if that is a delta against it."""
+    if not upload.latest or upload.parent_id is None:
+        return
+    parent = type(upload).objects.only('pk', 'delta').filter(pk=upload.parent_id).first()
+    if parent is not None and parent.delta is not None:
+        upload._parent_content = revision_content(parent)
+
+
+def restore_parent(upload):
+    """Once the latest revision is deleted, make its parent the latest again.
+
+    A parent deleted along with it, as when its post is deleted, is left alone.
+    """
+    if not upload.latest or upload.parent_id is None:
+        return
+    parent = type(upload).objects.select_for_update().filter(pk=upload.parent_id).first()
+    if parent is None:
+        return
+    if parent.delta is not None:
+        expand_revision(parent, getattr(upload, '_parent_content', None))
+    parent.latest = True
+    parent.save(update_fields=['latest', 'updated_at'])
@@ -1,24 +1,388 @@
 from graphene import relay, ObjectType
 from graphene_django import DjangoObjectType
 from graphene_django.filter import DjangoFilterConnectionField
+from graphene_django.settings import graphene_settings
+import django_filters
 import graphene
 from graphene_permissions.mixins import AuthNode, AuthMutation
 from graphene_permissions.permissions import AllowStaff, AllowAny
-from review.models import Post
+from django.db import transaction
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+from django.urls import reverse
+from django.utils import timezone
+from graphql_jwt.decorators import login_required
+from graphql_relay.node.node import from_global_id
+from review.models import Post, PostUpload, PostComment, Review, ReviewUpload, ReviewComment, UploadSession
+from avrit_backend.loaders import get_loaders, load_related
+from avrit_backend.optimizer import optimize
+from avrit_backend.pagination import KeysetConnection, KeysetConnectionField
+from avrit_backend.bulk import BulkError
+from avrit_backend.uploads import Upload, uploads_setting
+from profiles_api.schema import ProfileDetailsNode
+from review import bulk, events
+from review.revisions import start_revision, upload_kind
+from review.matching import suggest_reviewers
+from review.search import search_posts
+from review.uploads import attach_file, create_session
 import graphql_jwt
 
-class PostNode(DjangoObjectType):
+NEVER = timezone.datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+class UploadContent(object):
+    content_url = graphene.String(description='Where to download this revision, also once it is stored as a delta.')
+
+    def resolve_content_url(self, info):
+        return reverse('upload_content', args=[upload_kind(self), self.pk])
+
+class PostUploadType(UploadContent, DjangoObjectType):
+    class Meta:
+        model = PostUpload
+        exclude_fields = ('delta',)
+
+class PostCommentType(DjangoObjectType):
+    class Meta:
+        model = PostComment
+
+class ReviewUploadType(UploadContent, DjangoObjectType):
+    class Meta:
+        model = ReviewUpload
+        exclude_fields = ('delta',)
+
+class PostUploadConnection(KeysetConnection):
+    class Meta:
+        node = PostUploadType
+
+class ReviewUploadConnection(KeysetConnection):
+    class Meta:
+        node = ReviewUploadType
+
+def _revisions(connection, queryset, args):
+    """Uploads newest first, read through the history index without their deltas."""
+    queryset = queryset.defer('delta').order_by('-created_at', '-pk')
+    return KeysetConnectionField.resolve_connection(
+        connection, args, queryset, graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+    )
+
+class ReviewCommentType(DjangoObjectType):
+    class Meta:
+        model = ReviewComment
+
+class ReviewType(DjangoObjectType):
+    review_upload = graphene.List(graphene.NonNull(ReviewUploadType), required=True)
+    latest_uploads = graphene.List(
+        graphene.NonNull(ReviewUploadType), required=True, description='The latest revision of each file.'
+    )
+    revisions = relay.ConnectionField(ReviewUploadConnection, description='Every revision, newest first.')
+    reviewcomments = graphene.List(graphene.NonNull(ReviewCommentType), required=True)
+    class Meta:
+        model = Review
+        interfaces = (relay.Node,)
+
+    def resolve_user_profile(self, info):
+        return load_related(info.context, self, 'user_profile', 'user', self.user_profile_id)
+
+    def resolve_review_upload(self, info):
+        return load_related(info.context, self, 'review_upload', 'review_uploads', self.pk)
+
+    def resolve_latest_uploads(self, info):
+        return get_loaders(info.context).latest_review_uploads.load(self.pk)
+
+    def resolve_revisions(self, info, **args):
+        return _revisions(ReviewUploadConnection, ReviewUpload.objects.filter(review=self.pk), args)
+
+    def resolve_reviewcomments(self, info):
+        return load_related(info.context, self, 'reviewcomments', 'review_comments', self.pk)
+
+class PostOrderingFilter(django_filters.OrderingFilter):
+    """Orders posts by a comma separated list such as `-reviewCount,-createdAt`.
+
+    Posts that were never reviewed sort as the oldest by `lastReviewedAt`,
+    since keyset cursors can't seek past NULLs.
+    """
+    def filter(self, queryset, value):
+        if value and any(name.lstrip('-') == 'last_reviewed_at' for name in value):
+            queryset = queryset.annotate(last_reviewed_sort=Coalesce('last_reviewed_at', Value(NEVER)))
+        return super(PostOrderingFilter, self).filter(queryset, value)
+
+class PostFilter(django_filters.FilterSet):
+    search = django_filters.CharFilter(method='filter_search')
+    # graphene-django passes orderBy through to_snake_case.
+    order_by = PostOrderingFilter(fields=(
+        ('created_at', 'created_at'),
+        ('review_count', 'review_count'),
+        ('comment_count', 'comment_count'),
+        ('last_reviewed_sort', 'last_reviewed_at'),
+    ))
     class Meta:
         model = Post
-        filter_fields = {
+        fields = {
             'title': ['exact', 'icontains'],
             'type_of_submission': ['exact', 'icontains'],
             'course_name': ['exact', 'icontains'],
             'subject': ['exact', 'icontains'],
             'description': ['exact', 'icontains'],
+            'review_count': ['exact', 'gte', 'lte'],
+            'comment_count': ['exact', 'gte', 'lte'],
+            'last_reviewed_at': ['gte', 'lte', 'isnull'],
         }
+    def filter_search(self, queryset, name, value):
+        return search_posts(queryset, value)
+
+class PostNode(DjangoObjectType):
+    reviews = graphene.List(graphene.NonNull(ReviewType), required=True)
+    post_upload = graphene.List(graphene.NonNull(PostUploadType), required=True)
+    latest_uploads = graphene.List(
+        graphene.NonNull(PostUploadType), required=True, description='The latest revision of each file.'
+    )
+    revisions = relay.ConnectionField(PostUploadConnection, description='Every revision, newest first.')
+    postcomments = graphene.List(graphene.NonNull(PostCommentType), required=True)
+    class Meta:
+        model = Post
+        filterset_class = PostFilter
+        exclude_fields = ('search_vector',)
         interfaces = (relay.Node,)
+        connection_class = KeysetConnection
+
+    @classmethod
+    def get_queryset(cls, queryset, info):
+        return optimize(queryset, info)
+
+    def resolve_user_profile(self, info):
+        return load_related(info.context, self, 'user_profile', 'user', self.user_profile_id)
+
+    def resolve_reviews(self, info):
+        return load_related(info.context, self, 'reviews', 'post_reviews', self.pk)
+
+    def resolve_post_upload(self, info):
+        return load_related(info.context, self, 'post_upload', 'post_uploads', self.pk)
+
+    def resolve_latest_uploads(self, info):
+        return get_loaders(info.context).latest_post_uploads.load(self.pk)
+
+    def resolve_revisions(self, info, **args):
+        return _revisions(PostUploadConnection, PostUpload.objects.filter(post=self.pk), args)
+
+    def resolve_postcomments(self, info):
+        return load_related(info.context, self, 'postcomments', 'post_comments', self.pk)
+
+def _node_pk(node_id, node_type):
+    try:
+        type_name, pk = from_global_id(node_id)
+    except Exception:
+        type_name, pk = None, ''
+    if type_name != node_type or not pk.isdigit():
+        raise Exception('Invalid %s ID.' % node_type)
+    return int(pk)
+
+def _post_pk(post_id):
+    return _node_pk(post_id, 'PostNode')
+
+class SuggestedReviewer(ObjectType):
+    """A reviewer whose research interests match a post."""
+    profile = graphene.Field(ProfileDetailsNode, required=True)
+    score = graphene.Float(required=True, description='Similarity discounted by the reviewer\'s recent load.')
+    similarity = graphene.Float(required=True)
+    load = graphene.Int(required=True, description='Reviews written recently.')
+    matched_terms = graphene.List(graphene.NonNull(graphene.String), required=True)
 
 class QueryPost(ObjectType):
     post = relay.Node.Field(PostNode)
-    all_post = DjangoFilterConnectionField(PostNode)
+    all_post = KeysetConnectionField(PostNode)
+    suggested_reviewers = graphene.List(
+        graphene.NonNull(SuggestedReviewer),
+        post_id=graphene.ID(required=True),
+        first=graphene.Int(default_value=10),
+        required=True,
+    )
+
+    @login_required
+    def resolve_suggested_reviewers(self, info, post_id, first):
+        post = Post.objects.only('pk', 'user_profile', 'title', 'subject', 'course_name').get(pk=_post_pk(post_id))
+        return suggest_reviewers(post, first)
+
+
+class Comment(graphene.Union):
+    class Meta:
+        types = (PostCommentType, ReviewCommentType)
+
+class SubscriptionPost(ObjectType):
+    """Served over websockets by the ASGI application, see avrit_backend.subscriptions."""
+    review_added = graphene.Field(ReviewType, post_id=graphene.ID(required=True))
+    comment_added = graphene.Field(Comment, post_id=graphene.ID(required=True))
+
+    def resolve_review_added(self, info, post_id):
+        channel = events.review_channel(_post_pk(post_id))
+        return info.context.listen(channel).map(events.load_review).filter(lambda review: review is not None)
+
+    def resolve_comment_added(self, info, post_id):
+        channel = events.comment_channel(_post_pk(post_id))
+        return info.context.listen(channel).map(events.load_comment).filter(lambda comment: comment is not None)
+
+
+class UploadSessionType(DjangoObjectType):
+    chunk_size = graphene.Int()
+    upload_url = graphene.String()
+    complete = graphene.Boolean()
+    class Meta:
+        model = UploadSession
+        exclude_fields = ('user_profile', 'block_hashes')
+
+    def resolve_chunk_size(self, info):
+        return uploads_setting('CHUNK_SIZE')
+
+    def resolve_upload_url(self, info):
+        return reverse('upload_chunk', args=[self.pk])
+
+class CreateUploadSession(relay.ClientIDMutation):
+    upload_session = graphene.Field(UploadSessionType)
+    class Input:
+        filename = graphene.String(required=True)
+        size = graphene.Int(required=True)
+    @classmethod
+    @login_required
+    def mutate_and_get_payload(cls, root, info, **input):
+        session = create_session(info.context.user, input.get('filename'), input.get('size'))
+        return CreateUploadSession(upload_session=session)
+
+class CreatePostUpload(relay.ClientIDMutation):
+    """Attach a file to a post, sent either as `file` or as a finished upload session.
+
+    With `parentId` the file is the next revision of that upload.
+    """
+    post_upload = graphene.Field(PostUploadType)
+    class Input:
+        post_id = graphene.ID(required=True)
+        description = graphene.String(required=True)
+        revision = graphene.Boolean()
+        parent_id = graphene.ID(description='The upload this file is the next revision of.')
+        file = Upload()
+        upload_id = graphene.ID()
+    @classmethod
+    @login_required
+    def mutate_and_get_payload(cls, root, info, **input):
+        user = info.context.user
+        post = Post.objects.get(pk=_post_pk(input.get('post_id')))
+        if post.user_profile_id != user.pk:
+            raise Exception('Not permitted to upload to this post.')
+        post_upload = PostUpload(post=post, description=input.get('description'), revision=bool(input.get('revision')))
+        with transaction.atomic():
+            if input.get('parent_id'):
+                start_revision(post_upload, input.get('parent_id'))
+            attach_file(post_upload, user, file=input.get('file'), upload_id=input.get('upload_id'))
+        return CreatePostUpload(post_upload=post_upload)
+
+class CreateReviewUpload(relay.ClientIDMutation):
+    """Attach a file to a review, sent either as `file` or as a finished upload session.
+
+    With `parentId` the file is the next revision of that upload.
+    """
+    review_upload = graphene.Field(ReviewUploadType)
+    class Input:
+        review_id = graphene.ID(required=True)
+        description = graphene.String(required=True)
+        revision = graphene.Boolean()
+        parent_id = graphene.ID(description='The upload this file is the next revision of.')
+        file = Upload()
+        upload_id = graphene.ID()
+    @classmethod
+    @login_required
+    def mutate_and_get_payload(cls, root, info, **input):
+        user = info.context.user
+        review = Review.objects.get(pk=_node_pk(input.get('review_id'), 'ReviewType'))
+        if review.user_profile_id != user.pk:
+            raise Exception('Not permitted to upload to this review.')
+        review_upload = ReviewUpload(review=review, description=input.get('description'), revision=bool(input.get('revision')))
+        with transaction.atomic():
+            if input.get('parent_id'):
+                start_revision(review_upload, input.get('parent_id'))
+            attach_file(review_upload, user, file=input.get('file'), upload_id=input.get('upload_id'))
+        return CreateReviewUpload(review_upload=review_upload)
+
+class PostInput(graphene.InputObjectType):
+    title = graphene.String(required=True)
+    type_of_submission = graphene.String(required=True)
+    course_name = graphene.String(required=True)
+    subject = graphene.String(required=True)
+    description = graphene.String(required=True)
+    backup_link = graphene.String()
+
+class PostUpdateInput(graphene.InputObjectType):
+    id = graphene.ID(required=True)
+    title = graphene.String()
+    type_of_submission = graphene.String()
+    course_name = graphene.String()
+    subject = graphene.String()
+    description = graphene.String()
+    backup_link = graphene.String()
+
+class ReviewInput(graphene.InputObjectType):
+    post_id = graphene.ID(required=True)
+    description = graphene.String(required=True)
+    backup_link = graphene.String()
+
+class CommentInput(graphene.InputObjectType):
+    post_id = graphene.ID()
+    review_id = graphene.ID()
+    comment = graphene.String(required=True)
+
+class CreatePosts(relay.ClientIDMutation):
+    """Create many posts at once. `posts` follows the input order, with null for items listed in `errors`."""
+    posts = graphene.List(PostNode, required=True)
+    errors = graphene.List(graphene.NonNull(BulkError), required=True)
+    class Input:
+        posts = graphene.List(graphene.NonNull(PostInput), required=True)
+        all_or_nothing = graphene.Boolean()
+    @classmethod
+    @login_required
+    def mutate_and_get_payload(cls, root, info, **input):
+        posts, errors = bulk.create_posts(info.context.user, input.get('posts'), bool(input.get('all_or_nothing')))
+        return CreatePosts(posts=posts, errors=errors)
+
+class UpdatePosts(relay.ClientIDMutation):
+    """Update many of your posts at once; only the fields given are changed."""
+    posts = graphene.List(PostNode, required=True)
+    errors = graphene.List(graphene.NonNull(BulkError), required=True)
+    class Input:
+        posts = graphene.List(graphene.NonNull(PostUpdateInput), required=True)
+        all_or_nothing = graphene.Boolean()
+    @classmethod
+    @login_required
+    def mutate_and_get_payload(cls, root, info, **input):
+        posts, errors = bulk.update_posts(info.context.user, input.get('posts'), bool(input.get('all_or_nothing')))
+        return UpdatePosts(posts=posts, errors=errors)
+
+class CreateReviews(relay.ClientIDMutation):
+    reviews = graphene.List(ReviewType, required=True)
+    errors = graphene.List(graphene.NonNull(BulkError), required=True)
+    class Input:
+        reviews = graphene.List(graphene.NonNull(ReviewInput), required=True)
+        all_or_nothing = graphene.Boolean()
+    @classmethod
+    @login_required
+    def mutate_and_get_payload(cls, root, info, **input):
+        reviews, errors = bulk.create_reviews(info.context.user, input.get('reviews'), bool(input.get('all_or_nothing')))
+        return CreateReviews(reviews=reviews, errors=errors)
+
+class AddComments(relay.ClientIDMutation):
+    """Comment on many posts and reviews; both lists follow the input order."""
+    post_comments = graphene.List(PostCommentType, required=True)
+    review_comments = graphene.List(ReviewCommentType, required=True)
+    errors = graphene.List(graphene.NonNull(BulkError), required=True)
+    class Input:
+        comments = graphene.List(graphene.NonNull(CommentInput), required=True)
+        all_or_nothing = graphene.Boolean()
+    @classmethod
+    @login_required
+    def mutate_and_get_payload(cls, root, info, **input):
+        post_comments, review_comments, errors = bulk.add_comments(input.get('comments'), bool(input.get('all_or_nothing')))
+        return AddComments(post_comments=post_comments, review_comments=review_comments, errors=errors)
+
+class MutationPost(graphene.ObjectType):
+    create_posts = CreatePosts.Field()
+    update_posts = UpdatePosts.Field()
+    create_reviews = CreateReviews.Field()
+    add_comments = AddComments.Field()
+    create_upload_session = CreateUploadSession.Field()
+    create_post_upload = CreatePostUpload.Field()
+    create_review_upload = CreateReviewUpload.Field()
@@ -0,0 +1,150 @@
+"""Full-text search over posts.
+
+Postgres keeps a weighted ``Post.search_vector`` behind a GIN index and falls
+back to trigram similarity on the title when nothing matches; both indexes
+are created by the review migrations. SQLite, used for local development,
+keeps an FTS5 table ranked with bm25. Both backends are kept up to date from
+the ``Post`` save and delete signals.
+"""
+from django.db import connections, router
+from django.db.models import F, Q
+from django.db.models.expressions import RawSQL
+
+from review.models import Post
+
+SEARCH_FIELDS = ('title', 'subject', 'course_name', 'description')
+
+
+class PostgresSearchBackend(object):
+    trigram_threshold = 0.3
+
+    def install(self, using):
+        # The GIN indexes are declared on Post and created by migrations.
+        pass
+
+    def vector(self):
+        from django.contrib.postgres.search import SearchVector
+        return (
+            SearchVector('title', weight='A')
+            + SearchVector('subject', 'course_name', weight='B')
+            + SearchVector('description', weight='C')
+        )
+
+    def update(self, pks, using):
+        Post.objects.using(using).filter(pk__in=pks).update(search_vector=self.vector())
+
+    def remove(self, pks, using):
+        pass
+
+    def rebuild(self, using):
+        Post.objects.using(using).update(search_vector=self.vector())
+
+    def search(self, queryset, text):
+        from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+        query = SearchQuery(text)
+        matches = queryset.filter(search_vector=query)
+        if matches.exists():
+            return matches.annotate(search_rank=SearchRank(F('search_vector'), query)).order_by('-search_rank')
+        return (
+            queryset.annotate(search_rank=TrigramSimilarity('title', text))
+            .filter(search_rank__gte=self.trigram_threshold)
+            .order_by('-search_rank')
+        )
+
+
+class SQLiteSearchBackend(object):
+    table = 'review_post_fts'
+
+    def install(self, using):
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                'CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(%s, tokenize=\'porter unicode61\')'
+                % (self.table, ', '.join(SEARCH_FIELDS))
+            )
+
+    def update(self, pks, using):
+        self.remove(pks, using)
+        placeholders = ', '.join(['%s'] * len(pks))
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO %s (rowid, %s) SELECT id, %s FROM review_post WHERE id IN (%s)'
+                % (self.table, ', '.join(SEARCH_FIELDS), ', '.join(SEARCH_FIELDS), placeholders),
+                list(pks),
+            )
+
+    def remove(self, pks, using):
+        placeholders = ', '.join(['%s'] * len(pks))
+        with connections[using].cursor() as cursor:
+            cursor.execute('DELETE FROM %s WHERE rowid IN (%s)' % (self.table, placeholders), list(pks))
+
+    def rebuild(self, using):
+        with connections[using].cursor() as cursor:
+            cursor.execute('DELETE FROM %s' % self.table)
+            cursor.execute(
+                'INSERT INTO %s (rowid, %s) SELECT id, %s FROM review_post'
+                % (self.table, ', '.join(SEARCH_FIELDS), ', '.join(SEARCH_FIELDS))
+            )
+
+    def match_expression(self, text):
+        # Quote every term so user input can't use FTS5 query syntax.
+        return ' '.join('"%s"' % term.replace('"', '""') for term in text.split())
+
+    def search(self, queryset, text):
+        match = self.match_expression(text)
+        if not match:
+            return queryset.none()
+        rank = RawSQL(
+            'SELECT -bm25(%s, 10.0, 4.0, 4.0, 1.0) FROM %s WHERE %s MATCH %%s AND rowid = review_post.id'
+            % (self.table, self.table, self.table),
+            (match,),
+        )
+        matched = RawSQL('SELECT rowid FROM %s WHERE %s MATCH %%s' % (self.table, self.table), (match,))
+        return queryset.filter(pk__in=matched).annotate(search_rank=rank).order_by('-search_rank')
+
+
+class FallbackSearchBackend(object):
+    """Unindexed search for databases without a dedicated backend."""
+    def install(self, using):
+        pass
+
+    def update(self, pks, using):
+        pass
+
+    def remove(self, pks, using):
+        pass
+
+    def rebuild(self, using):
+        pass
+
+    def search(self, queryset, text):
+        condition = Q()
+        for field in SEARCH_FIELDS:
+            condition |= Q(**{field + '__icontains': text})
+        return queryset.filter(condition)
+
+
+BACKENDS = {
+    'postgresql': PostgresSearchBackend(),
+    'sqlite': SQLiteSearchBackend(),
+}
+
+
+def get_backend(using):
+    return BACKENDS.get(connections[using].vendor, FallbackSearchBackend())
+
+
+def search_posts(queryset, text):
+    """Filter ``queryset`` to posts matching ``text``, best matches first."""
+    return get_backend(queryset.db).search(queryset, text)
+
+
+def index_posts(pks, using=None):
+    if pks:
+        using = using or router.db_for_write(Post)
+        get_backend(using).update(list(pks), using)
+
+
+def unindex_posts(pks, using=None):
+    if pks:
+        using = using or router.db_for_write(Post)
+        get_backend(using).remove(list(pks), using)
@@ -0,0 +1,276 @@
+from django.db.models.signals import post_init, post_save, post_delete, post_migrate, pre_delete
+from django.dispatch import receiver
+
+from avrit_backend import response_cache
+from avrit_backend.bulk import bulk_saved
+from profiles_api.models import ProfileDetails
+from review import counters, events, matching, revisions, search
+from review.models import Post, PostUpload, PostComment, Review, ReviewUpload, ReviewComment
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, raw=False, using=None, **kwargs):
+    if not raw:
+        search.index_posts([instance.pk], using)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, using=None, **kwargs):
+    search.unindex_posts([instance.pk], using)
+
+
+@receiver(post_migrate)
+def install_search_index(sender, using=None, **kwargs):
+    if sender.name == 'review':
+        search.get_backend(using).install(using)
+
+
+@receiver(post_save, sender=Review)
+def count_review(sender, instance, created=False, raw=False, using=None, **kwargs):
+    if created and not raw:
+        counters.review_added(instance, using)
+
+
+@receiver(post_delete, sender=Review)
+def uncount_review(sender, instance, using=None, **kwargs):
+    counters.review_removed(instance, using)
+
+
+@receiver(post_save, sender=PostComment)
+@receiver(post_save, sender=ReviewComment)
+def count_comment(sender, instance, created=False, raw=False, using=None, **kwargs):
+    if created and not raw:
+        counters.comment_added(_comment_post_pk(instance), using)
+
+
+@receiver(post_delete, sender=PostComment)
+@receiver(post_delete, sender=ReviewComment)
+def uncount_comment(sender, instance, using=None, **kwargs):
+    counters.comment_removed(_comment_post_pk(instance), using)
+
+
+# Post of each review being deleted. Its comments are deleted first, and
+# find their post here instead of loading the review once per comment.
+_deleted_review_posts = {}
+
+
+@receiver(pre_delete, sender=Review)
+def remember_deleted_review_post(sender, instance, using=None, **kwargs):
+    _deleted_review_posts[(using, instance.pk)] = instance.post_id_id
+
+
+@receiver(post_delete, sender=Review)
+def forget_deleted_review_post(sender, instance, using=None, **kwargs):
+    _deleted_review_posts.pop((using, instance.pk), None)
+
+
+def _comment_post_pk(comment):
+    if isinstance(comment, PostComment):
+        return comment.post_id
+    _comment_post_pks([comment])
+    return comment._post_pk[1]
+
+
+def _comment_post_pks(comments, using=None):
+    """Note the post of each review comment on it, with at most one query for all of them."""
+    missing = []
+    for comment in comments:
+        if getattr(comment, '_post_pk', (None,))[0] == comment.review_id:
+            continue
+        key = (using or comment._state.db, comment.review_id)
+        if ReviewComment.review.is_cached(comment) and 'post_id_id' in comment.review.__dict__:
+            comment._post_pk = (comment.review_id, comment.review.post_id_id)
+        elif key in _deleted_review_posts:
+            comment._post_pk = (comment.review_id, _deleted_review_posts[key])
+        else:
+            missing.append(comment)
+    if missing:
+        posts = dict(
+            Review.objects.using(using or missing[0]._state.db)
+            .filter(pk__in={comment.review_id for comment in missing})
+            .values_list('pk', 'post_id')
+        )
+        for comment in missing:
+            comment._post_pk = (comment.review_id, posts[comment.review_id])
+
+
+@receiver(post_save, sender=Review)
+def publish_review(sender, instance, created=False, raw=False, using=None, **kwargs):
+    if created and not raw:
+        events.review_added(instance, using)
+
+
+@receiver(post_save, sender=PostComment)
+@receiver(post_save, sender=ReviewComment)
+def publish_comment(sender, instance, created=False, raw=False, using=None, **kwargs):
+    if created and not raw:
+        events.comment_added(instance, _comment_post_pk(instance), using)
+
+
+@receiver(post_save, sender=ProfileDetails)
+def index_reviewer(sender, instance, **kwargs):
+    matching.profile_saved(instance)
+
+
+@receiver(bulk_saved, sender=ProfileDetails)
+def bulk_index_reviewers(sender, instances, **kwargs):
+    for instance in instances:
+        matching.profile_saved(instance)
+
+
+@receiver(post_delete, sender=ProfileDetails)
+def unindex_reviewer(sender, instance, **kwargs):
+    matching.profile_deleted(instance.user_id)
+
+
+# The fields allPost filters, searches or orders by; editing any other field
+# of a post leaves every list it appears in as it was.
+POST_LIST_FIELDS = frozenset((
+    'title', 'type_of_submission', 'course_name', 'subject', 'description', 'created_at',
+    'review_count', 'comment_count', 'last_reviewed_at',
+))
+
+
+def _post_list_values(post):
+    # Deferred fields are left out rather than loaded.
+    return {name: post.__dict__[name] for name in POST_LIST_FIELDS if name in post.__dict__}
+
+
+@receiver(post_init, sender=Post)
+def remember_post_list_values(sender, instance, **kwargs):
+    instance._list_values = _post_list_values(instance)
+
+
+@receiver(post_save, sender=Post)
+def invalidate_post(sender, instance, created=False, update_fields=None, **kwargs):
+    values = _post_list_values(instance)
+    if update_fields is not None:
+        changed_list = bool(POST_LIST_FIELDS.intersection(update_fields))
+    else:
+        changed_list = values != instance._list_values
+    instance._list_values = values
+    response_cache.invalidate_instance(instance, changed_list=created or changed_list)
+
+
+@receiver(post_delete, sender=Post)
+def invalidate_deleted_post(sender, instance, **kwargs):
+    response_cache.invalidate_instance(instance, changed_list=True)
+
+
+# Adding or removing reviews and comments changes the counters posts are listed by.
+@receiver(post_save, sender=Review)
+def invalidate_review(sender, instance, created=False, **kwargs):
+    response_cache.invalidate_instance(
+        instance, changed_list=created, related=[(Post, instance.post_id_id)], lists=[Post] if created else (),
+    )
+
+
+@receiver(post_delete, sender=Review)
+def invalidate_deleted_review(sender, instance, **kwargs):
+    response_cache.invalidate_instance(instance, changed_list=True, related=[(Post, instance.post_id_id)], lists=[Post])
+
+
+@receiver(post_save, sender=PostUpload)
+@receiver(post_delete, sender=PostUpload)
+def invalidate_post_upload(sender, instance, **kwargs):
+    response_cache.invalidate_instance(instance, related=[(Post, instance.post_id)])
+
+
+@receiver(post_save, sender=PostComment)
+@receiver(post_delete, sender=PostComment)
+def invalidate_post_comment(sender, instance, created=True, **kwargs):
+    # post_delete sends no ``created``; removing a comment changes the count as well.
+    response_cache.invalidate_instance(instance, related=[(Post, instance.post_id)], lists=[Post] if created else ())
+
+
+@receiver(pre_delete, sender=PostUpload)
+@receiver(pre_delete, sender=ReviewUpload)
+def keep_previous_revision(sender, instance, **kwargs):
+    revisions.keep_parent_content(instance)
+
+
+@receiver(post_delete, sender=PostUpload)
+@receiver(post_delete, sender=ReviewUpload)
+def restore_previous_revision(sender, instance, **kwargs):
+    revisions.restore_parent(instance)
+
+
+@receiver(post_save, sender=ReviewUpload)
+@receiver(post_delete, sender=ReviewUpload)
+def invalidate_review_child(sender, instance, **kwargs):
+    response_cache.invalidate_instance(instance, related=[(Review, instance.review_id)])
+
+
+@receiver(post_save, sender=ReviewComment)
+@receiver(post_delete, sender=ReviewComment)
+def invalidate_review_comment(sender, instance, created=True, **kwargs):
+    # The post's comment_count changed too.
+    response_cache.invalidate_instance(
+        instance, related=[(Review, instance.review_id), (Post, _comment_post_pk(instance))],
+        lists=[Post] if created else (),
+    )
+
+
+@receiver(bulk_saved, sender=Post)
+def bulk_saved_posts(sender, instances, created=False, update_fields=None, using=None, **kwargs):
+    pks = [instance.pk for instance in instances]
+    search.index_posts(pks, using)
+    changed_list = created or update_fields is None or bool(POST_LIST_FIELDS.intersection(update_fields))
+    response_cache.invalidate_instances(Post, pks, changed_list=changed_list, using=using)
+
+
+@receiver(bulk_saved, sender=Review)
+@receiver(bulk_saved, sender=PostComment)
+@receiver(bulk_saved, sender=ReviewComment)
+def bulk_count(sender, instances, created=False, using=None, **kwargs):
+    if created:
+        if sender is ReviewComment:
+            _comment_post_pks(instances, using)
+        if sender is Review:
+            pks = {instance.post_id_id for instance in instances}
+        else:
+            pks = {_comment_post_pk(instance) for instance in instances}
+        counters.refresh(pks, using)
+        for instance in instances:
+            if sender is Review:
+                events.review_added(instance, using)
+            else:
+                events.comment_added(instance, _comment_post_pk(instance), using)
+
+
+@receiver(bulk_saved, sender=Review)
+def bulk_saved_reviews(sender, instances, created=False, using=None, **kwargs):
+    response_cache.invalidate_instances(
+        Review,
+        [instance.pk for instance in instances],
+        changed_list=created,
+        related={(Post, instance.post_id_id) for instance in instances},
+        lists=[Post] if created else (),
+        using=using,
+    )
+
+
+@receiver(bulk_saved, sender=PostUpload)
+@receiver(bulk_saved, sender=PostComment)
+def bulk_saved_post_children(sender, instances, created=False, using=None, **kwargs):
+    response_cache.invalidate_instances(
+        sender,
+        [instance.pk for instance in instances],
+        related={(Post, instance.post_id) for instance in instances},
+        lists=[Post] if created and sender is PostComment else (),
+        using=using,
+    )
+
+
+@receiver(bulk_saved, sender=ReviewUpload)
+@receiver(bulk_saved, sender=ReviewComment)
+def bulk_saved_review_children(sender, instances, created=False, using=None, **kwargs):
+    related = {(Review, instance.review_id) for instance in instances}
+    lists = ()
+    if sender is ReviewComment:
+        _comment_post_pks(instances, using)
+        related.update((Post, _comment_post_pk(instance)) for instance in instances)
+        lists = [Post] if created else ()
+    response_cache.invalidate_instances(
+        sender, [instance.pk for instance in instances], related=related, lists=lists, using=using,
+    )
@@ -1,3 +1,792 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import RestrictedError
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from graphql_jwt.shortcuts import get_token
+from graphql_relay import to_global_id
+
+from avrit_backend import profiling, pubsub, response_cache, startup, tasks
+from avrit_backend.bulk import bulk_insert
+from avrit_backend.db import ReplicaRoutingMiddleware
+from avrit_backend.subscriptions import GraphQLWebSocketApplication
+from blobs.models import Blob
+from broker.models import Event
+from profiles_api.models import ProfileDetails, UserProfile
+from review import export, revisions
+from review.access import can_view_upload
+from review.imports import import_file
+from review.models import (
+    ImportJob, Post, PostComment, PostUpload, Review, ReviewComment, ReviewUpload, UploadSession,
+)
+from review.uploads import attach_file, create_session, write_chunk
+
+ALL_POST = '''{
+  allPost(first: 100) {
+    edges {
+      node {
+        title
+        userProfile { name }
+        reviews {
+          description
+          reviewUpload { description }
+          reviewcomments { comment }
+        }
+        postUpload { description }
+        postcomments { comment }
+      }
+    }
+  }
+}'''
+POST_TITLES = '{ allPost(first: 10) { edges { node { title } } } }'
+POST_PAGE = '''query ($first: Int, $last: Int, $after: String, $before: String) {
+  allPost(first: $first, last: $last, after: $after, before: $before) {
+    edges { cursor node { title } }
+    pageInfo { hasPreviousPage hasNextPage }
+  }
+}'''
+ADD_COMMENT = '''mutation ($post: ID!) {
+  addComments(input: {comments: [{postId: $post, comment: "New"}]}) {
+    postComments { comment }
+    errors { messages }
+  }
+}'''
+ADD_REVIEW_COMMENT = '''mutation ($review: ID!) {
+  addComments(input: {comments: [{reviewId: $review, comment: "New"}]}) {
+    reviewComments { comment }
+    errors { field messages }
+  }
+}'''
+CREATE_REVIEW_UPLOAD = '''mutation ($review: ID!, $upload: ID!) {
+  createReviewUpload(input: {reviewId: $review, description: "notes", uploadId: $upload}) {
+    reviewUpload { size }
+  }
+}'''
+REVIEW_ADDED = '''subscription ($post: ID!) {
+  reviewAdded(postId: $post) { description }
+}'''
+
+
+def create_posts(count, start=0):
+    """``count`` posts, each with two reviews, uploads and comments."""
+    for i in range(start, start + count):
+        author = UserProfile.objects.create_user('author%d@example.com' % i, 'Author %d' % i)
+        ProfileDetails.objects.create(user=author, address='a', research_interest='physics', allow_public_view='Y')
+        post = Post.objects.create(
+            user_profile=author, title='Post %d' % i, type_of_submission='EL', course_name='c', subject='physics',
+            description='d',
+        )
+        PostUpload.objects.create(post=post, description='file', file_upload='post/%d.txt' % i)
+        PostComment.objects.create(post=post, comment='comment')
+        for j in range(2):
+            reviewer = UserProfile.objects.create_user('reviewer%d-%d@example.com' % (i, j), 'Reviewer')
+            review = Review.objects.create(user_profile=reviewer, post_id=post, description='review')
+            ReviewUpload.objects.create(review=review, description='file', file_upload='review/%d-%d.txt' % (i, j))
+            ReviewComment.objects.create(review=review, comment='comment')
+
+
+def replicate(*models):
+    """Copy the rows of ``models`` to the test replica, as replication would."""
+    for model in models:
+        model.objects.using('replica').bulk_create(model.objects.using('default').all())
+
+
+class GraphQLClientMixin(object):
+    def setUp(self):
+        # Anonymous responses and authenticated users are cached.
+        cache.clear()
+
+    def query(self, query, variables=None, **headers):
+        body = {'query': query, 'variables': variables}
+        response = self.client.post('/graphql', json.dumps(body), content_type='application/json', **headers)
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()
+        self.assertNotIn('errors', data)
+        return data['data']
+
+
+class GraphQLTestCase(GraphQLClientMixin, TestCase):
+    pass
+
+
+# The test replica only holds what a test copies to it.
+@override_settings(DATABASE_ROUTING={'REPLICAS': []})
+class AllPostQueryCountTests(GraphQLTestCase):
+    def assert_all_post_queries(self, posts):
+        with self.assertNumQueries(6):
+            data = self.query(ALL_POST)
+        self.assertEqual(len(data['allPost']['edges']), posts)
+        for edge in data['allPost']['edges']:
+            self.assertEqual(len(edge['node']['reviews']), 2)
+            self.assertEqual(len(edge['node']['reviews'][0]['reviewUpload']), 1)
+
+    def test_nested_all_post_at_two_sizes(self):
+        create_posts(5)
+        self.assert_all_post_queries(5)
+        create_posts(25, start=5)
+        cache.clear()
+        self.assert_all_post_queries(30)
+
+
+class ReplicaRoutingTests(GraphQLClientMixin, TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def query_by_database(self, query, variables=None, **headers):
+        """Run ``query``; returns how many queries went to each database."""
+        with CaptureQueriesContext(connections['default']) as default:
+            with CaptureQueriesContext(connections['replica']) as replica:
+                self.query(query, variables, **headers)
+        return {'default': len(default), 'replica': len(replica)}
+
+    def titles(self):
+        cache.clear()
+        return [edge['node']['title'] for edge in self.query(POST_TITLES)['allPost']['edges']]
+
+    def test_query_reads_from_replica(self):
+        create_posts(1)
+        counts = self.query_by_database(POST_TITLES)
+        self.assertEqual(counts['default'], 0)
+        self.assertGreater(counts['replica'], 0)
+        # The replica has yet to receive the post.
+        self.assertEqual(self.titles(), [])
+        replicate(UserProfile, Post)
+        self.assertEqual(self.titles(), ['Post 0'])
+
+    def test_mutation_reads_and_writes_on_default(self):
+        create_posts(1)
+        author = UserProfile.objects.get(email='author0@example.com')
+        post = to_global_id('PostNode', Post.objects.get().pk)
+        # The comments' posts are read before anything is written, from
+        # the primary, as the replica has not received them.
+        counts = self.query_by_database(
+            ADD_COMMENT, variables={'post': post}, HTTP_AUTHORIZATION='JWT ' + get_token(author),
+        )
+        self.assertGreater(counts['default'], 0)
+        self.assertEqual(counts['replica'], 0)
+        self.assertEqual(PostComment.objects.filter(comment='New').count(), 1)
+        self.assertIn('db_pin', self.client.cookies)
+        # The cookie keeps the client's next reads on the primary.
+        self.assertEqual(self.titles(), ['Post 0'])
+
+    def test_pin_cookie_reads_from_default(self):
+        create_posts(1)
+        self.client.cookies['db_pin'] = '%d' % (time.time() + 60)
+        counts = self.query_by_database(POST_TITLES)
+        self.assertGreater(counts['default'], 0)
+        self.assertEqual(counts['replica'], 0)
+        self.assertEqual(self.titles(), ['Post 0'])
+
+    def test_reads_after_a_write_or_in_a_transaction_use_default(self):
+        request = RequestFactory().get('/graphql')
+        middleware = ReplicaRoutingMiddleware(lambda request: HttpResponse())
+        middleware.process_request(request)
+        try:
+            self.assertEqual(router.db_for_read(Post), 'replica')
+            with transaction.atomic():
+                self.assertEqual(router.db_for_read(Post), 'default')
+            self.assertEqual(router.db_for_read(Post), 'replica')
+            router.db_for_write(Post)
+            self.assertEqual(router.db_for_read(Post), 'default')
+        finally:
+            middleware.process_response(request, HttpResponse())
+
+
+@override_settings(DATABASE_ROUTING={'REPLICAS': []})
+class PaginationTests(GraphQLTestCase):
+    def setUp(self):
+        super(PaginationTests, self).setUp()
+        create_posts(5)
+        self.cursors = {
+            edge['node']['title']: edge['cursor'] for edge in self.query(POST_PAGE, {'first': 5})['allPost']['edges']
+        }
+
+    def page(self, **variables):
+        cache.clear()
+        page = self.query(POST_PAGE, variables)['allPost']
+        info = page['pageInfo']
+        return [edge['node']['title'] for edge in page['edges']], info['hasPreviousPage'], info['hasNextPage']
+
+    def test_first_after(self):
+        self.assertEqual(self.page(first=2), (['Post 4', 'Post 3'], False, True))
+        self.assertEqual(self.page(first=2, after=self.cursors['Post 3']), (['Post 2', 'Post 1'], True, True))
+        Post.objects.filter(title='Post 4').delete()
+        # Nothing is left before a cursor whose row has been deleted.
+        self.assertEqual(self.page(first=2, after=self.cursors['Post 4']), (['Post 3', 'Post 2'], False, True))
+
+    def test_last_before(self):
+        self.assertEqual(self.page(last=2), (['Post 1', 'Post 0'], True, False))
+        self.assertEqual(self.page(last=2, before=self.cursors['Post 1']), (['Post 3', 'Post 2'], True, True))
+        Post.objects.filter(title='Post 0').delete()
+        self.assertEqual(self.page(last=2, before=self.cursors['Post 0']), (['Post 2', 'Post 1'], True, False))
+
+    def test_first_and_last(self):
+        self.assertEqual(self.page(first=3, last=2), (['Post 3', 'Post 2'], True, True))
+        self.assertEqual(self.page(first=2, last=3), (['Post 4', 'Post 3'], False, True))
+
+
+@override_settings(DATABASE_ROUTING={'REPLICAS': []})
+class BulkInsertTests(GraphQLTestCase):
+    def test_keys_are_read_back_in_insert_order(self):
+        create_posts(1)
+        post = Post.objects.get()
+        comments = [PostComment(post=post, comment=text) for text in ('same', 'other', 'same')]
+        with CaptureQueriesContext(connections['default']) as queries:
+            bulk_insert(PostComment, comments, key=('post', 'comment'))
+        self.assertEqual(sum(query['sql'].startswith('INSERT') for query in queries), 1)
+        self.assertEqual(comments[0].pk + 2, comments[2].pk)
+        for comment in comments:
+            self.assertEqual(PostComment.objects.get(pk=comment.pk).comment, comment.comment)
+
+    def test_add_comments_takes_global_review_ids(self):
+        create_posts(1)
+        review = Review.objects.first()
+        headers = {'HTTP_AUTHORIZATION': 'JWT ' + get_token(review.user_profile)}
+        data = self.query(ADD_REVIEW_COMMENT, {'review': to_global_id('ReviewType', review.pk)}, **headers)
+        self.assertEqual(data['addComments']['reviewComments'], [{'comment': 'New'}])
+        data = self.query(ADD_REVIEW_COMMENT, {'review': str(review.pk)}, **headers)
+        self.assertEqual(data['addComments']['errors'], [{'field': 'reviewId', 'messages': ['Invalid ReviewType ID.']}])
+
+
+@override_settings(DATABASE_ROUTING={'REPLICAS': []})
+class CommentCounterTests(TestCase):
+    def test_deleting_a_review_reads_no_review_per_comment(self):
+        create_posts(1)
+        review = Review.objects.first()
+        for _ in range(4):
+            ReviewComment.objects.create(review=review, comment='more')
+        with CaptureQueriesContext(connections['default']) as queries:
+            review.delete()
+        reads = [query['sql'] for query in queries if query['sql'].startswith('SELECT "review_review"')]
+        self.assertEqual(reads, [])
+        self.assertEqual(Post.objects.get().comment_count, 2)
+
+    def test_bulk_added_review_comments_are_counted(self):
+        create_posts(1)
+        reviews = list(Review.objects.only('pk'))
+        comments = [ReviewComment(review=review, comment='bulk') for review in reviews]
+        bulk_insert(ReviewComment, comments, key=('review', 'comment'))
+        self.assertEqual(Post.objects.get().comment_count, 5)
+
+
+@override_settings(DATABASE_ROUTING={'REPLICAS': []})
+class ResponseCacheTests(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        create_posts(2)
+        self.newest, self.oldest = Post.objects.order_by('-created_at', '-pk')
+
+    def assert_cached(self, query, cached):
+        with CaptureQueriesContext(connections['default']) as queries:
+            self.query(query)
+        self.assertEqual(len(queries) == 0, cached)
+
+    def test_edit_evicts_lists_only_when_a_listed_field_changes(self):
+        first = '{ allPost(first: 1) { edges { node { title } } } }'
+        self.query(first)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.oldest.backup_link = 'https://example.com/backup'
+            self.oldest.save()
+        self.assert_cached(first, True)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.oldest.title = 'Renamed'
+            self.oldest.save()
+        self.assert_cached(first, False)
+
+    def test_invalidation_waits_for_commit(self):
+        self.query(POST_TITLES)
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.filter(pk=self.newest.pk).update(title='Renamed')
+            PostComment.objects.create(post=self.newest, comment='New')
+            self.assert_cached(POST_TITLES, True)
+        self.assert_cached(POST_TITLES, False)
+
+    def test_invalidation_while_the_query_runs_is_not_cached_over(self):
+        tag = response_cache.instance_tag(Post, self.newest.pk)
+        cache_plan = response_cache.CachePlan('graphql-response:test', 60)
+        self.assertIsNone(response_cache.lookup(cache_plan))
+        # Committed after the query read the row, before its result is stored.
+        with self.captureOnCommitCallbacks(execute=True):
+            response_cache.invalidate(tag)
+        response_cache.store(cache_plan, {'stale': True}, {tag})
+        self.assertIsNone(response_cache.lookup(cache_plan))
+        # The next run stores what it read after the invalidation.
+        response_cache.store(cache_plan, {'fresh': True}, {tag})
+        self.assertEqual(response_cache.lookup(cache_plan), {'fresh': True})
+
+
+@override_settings(DATABASE_ROUTING={'REPLICAS': []})
+class MediaAccessTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings = self.settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        for name in ('post/shared.txt', 'post/orphan.txt', 'review/notes.txt'):
+            os.makedirs(os.path.join(self.media_root, os.path.dirname(name)), exist_ok=True)
+            with open(os.path.join(self.media_root, name), 'w') as f:
+                f.write(name)
+        create_posts(1)
+        self.post = Post.objects.get()
+        self.author = self.post.user_profile
+        self.review = Review.objects.filter(post_id=self.post).first()
+        self.reviewer = self.review.user_profile
+        PostUpload.objects.filter(post=self.post).update(file_upload='post/shared.txt')
+        ReviewUpload.objects.filter(review=self.review).update(file_upload='review/notes.txt')
+        self.other = UserProfile.objects.create_user('other@example.com', 'Other')
+        self.staff = UserProfile.objects.create_user('staff@example.com', 'Staff')
+        self.staff.is_staff = True
+        self.staff.save()
+
+    def get(self, path, user=None):
+        headers = {} if user is None else {'HTTP_AUTHORIZATION': 'JWT ' + get_token(user)}
+        return self.client.get('/media/' + path, **headers).status_code
+
+    def test_post_files_are_public(self):
+        self.assertEqual(self.get('post/shared.txt'), 200)
+        self.assertEqual(self.get('post/shared.txt', self.other), 200)
+
+    def test_files_no_upload_refers_to_are_for_staff(self):
+        self.assertEqual(self.get('post/orphan.txt'), 403)
+        self.assertEqual(self.get('post/orphan.txt', self.author), 403)
+        self.assertEqual(self.get('post/orphan.txt', self.staff), 200)
+
+    def test_review_files_are_for_the_reviewer_the_post_author_and_staff(self):
+        self.assertEqual(self.get('review/notes.txt', self.reviewer), 200)
+        self.assertEqual(self.get('review/notes.txt', self.author), 200)
+        self.assertEqual(self.get('review/notes.txt', self.staff), 200)
+        self.assertEqual(self.get('review/notes.txt', self.other), 403)
+        self.assertEqual(self.get('review/notes.txt'), 403)
+
+    def test_upload_rows(self):
+        upload = ReviewUpload.objects.get(review=self.review)
+        self.assertTrue(can_view_upload(self.reviewer, upload))
+        self.assertFalse(can_view_upload(self.other, upload))
+        self.assertFalse(can_view_upload(None, upload))
+        self.assertTrue(can_view_upload(None, PostUpload.objects.get(post=self.post)))
+
+
+@override_settings(DATABASE_ROUTING={'REPLICAS': []}, EXPORT={'OVERLAP': 0, 'TOKEN': 'secret'})
+class ExportTests(TestCase):
+    def setUp(self):
+        create_posts(2)
+        self.staff = UserProfile.objects.create_user('staff@example.com', 'Staff')
+        self.staff.is_staff = True
+        self.staff.save()
+
+    def get(self, path, user=None, data=None, **headers):
+        if user is not None:
+            headers['HTTP_AUTHORIZATION'] = 'JWT ' + get_token(user)
+        return self.client.get('/export/' + path, data, **headers)
+
+    def body(self, response):
+        self.assertEqual(response.status_code, 200)
+        data = b''.join(response.streaming_content)
+        if response.get('Content-Encoding') == 'gzip':
+            data = gzip.decompress(data)
+        return data.decode()
+
+    def titles(self, response):
+        return sorted(json.loads(line)['title'] for line in self.body(response).splitlines())
+
+    def test_export_is_for_staff_and_the_token(self):
+        self.assertEqual(self.get('posts.ndjson').status_code, 403)
+        self.assertEqual(self.get('posts.ndjson', Post.objects.first().user_profile).status_code, 403)
+        self.assertEqual(self.get('posts.ndjson', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.titles(self.get('posts.ndjson', HTTP_AUTHORIZATION='Bearer secret')), ['Post 0', 'Post 1'])
+        self.assertEqual(self.titles(self.get('posts.ndjson', self.staff)), ['Post 0', 'Post 1'])
+
+    def test_watermark_selects_what_changed_since(self):
+        response = self.get('posts.ndjson', self.staff)
+        self.assertEqual(len(self.titles(response)), 2)
+        watermark = response['X-Export-Watermark']
+        post = Post.objects.get(title='Post 1')
+        post.description = 'changed'
+        post.save()
+        self.assertEqual(self.titles(self.get('posts.ndjson', self.staff, {'since': watermark})), ['Post 1'])
+        self.assertEqual(self.get('posts.ndjson', self.staff, {'since': 'yesterday'}).status_code, 400)
+
+    def test_overlap_sends_recent_rows_again(self):
+        watermark = self.get('posts.ndjson', self.staff)['X-Export-Watermark']
+        with self.settings(EXPORT={'OVERLAP': 60}):
+            self.assertEqual(self.titles(self.get('posts.ndjson', self.staff, {'since': watermark})), ['Post 0', 'Post 1'])
+
+    def test_gzip_when_accepted(self):
+        # Small writes make the compressed stream span several chunks.
+        with mock.patch.object(export, 'WRITE_SIZE', 16):
+            response = self.get('review_comments.csv', self.staff, HTTP_ACCEPT_ENCODING='gzip, deflate')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            rows = self.body(response).splitlines()
+        self.assertEqual(rows[0], 'id,review_id,comment,created_at,updated_at')
+        self.assertEqual(len(rows), 5)
+        response = self.get('review_comments.csv', self.staff)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(self.body(response).splitlines(), rows)
+
+
+@override_settings(DATABASE_ROUTING={'REPLICAS': []})
+class SubscriptionTests(TransactionTestCase):
+    def setUp(self):
+        # One backend listens as the ASGI process would, another publishes
+        # as a separate WSGI process.
+        self.listener = pubsub.DatabasePubSub(interval=0.05)
+        self.addCleanup(self.listener.stop)
+        for patcher in (
+            mock.patch('avrit_backend.subscriptions.get_pubsub', return_value=self.listener),
+            mock.patch.object(pubsub, '_backend', pubsub.DatabasePubSub(interval=None)),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        create_posts(1)
+        self.post = Post.objects.get()
+
+    async def subscribe(self, receive, send):
+        """Open a websocket and subscribe to reviews of the post; returns the connection's task."""
+        scope = {'type': 'websocket', 'path': '/graphql', 'subprotocols': ['graphql-transport-ws']}
+        task = asyncio.ensure_future(GraphQLWebSocketApplication()(scope, receive.get, send.put))
+        await receive.put({'type': 'websocket.connect'})
+        self.assertEqual((await send.get())['type'], 'websocket.accept')
+        for message in (
+            {'type': 'connection_init', 'payload': {}},
+            {'type': 'subscribe', 'id': '1', 'payload': {
+                'query': REVIEW_ADDED, 'variables': {'post': to_global_id('PostNode', self.post.pk)},
+            }},
+        ):
+            await receive.put({'type': 'websocket.receive', 'text': json.dumps(message)})
+        self.assertEqual(json.loads((await send.get())['text'])['type'], 'connection_ack')
+        while not self.listener._subscribers:
+            await asyncio.sleep(0.01)
+        return task
+
+    def test_review_reaches_a_subscriber_in_another_process(self):
+        reviewer = UserProfile.objects.create_user('late@example.com', 'Late')
+
+        async def run():
+            receive, send = asyncio.Queue(), asyncio.Queue()
+            task = await self.subscribe(receive, send)
+            await sync_to_async(Review.objects.create)(user_profile=reviewer, post_id=self.post, description='late')
+            message = json.loads((await asyncio.wait_for(send.get(), 5))['text'])
+            await receive.put({'type': 'websocket.disconnect'})
+            await task
+            return message
+
+        message = async_to_sync(run)()
+        self.assertEqual(message, {'type': 'next', 'id': '1', 'payload': {'data': {'reviewAdded': {'description': 'late'}}}})
+        self.assertEqual(self.listener._subscribers, {})
+
+    def test_rows_committed_out_of_order_are_delivered(self):
+        backend = pubsub.DatabasePubSub(interval=None)
+        received = []
+        backend.subscribe('channel', received.append)
+        first = backend.last + 1
+        Event.objects.create(pk=first + 1, data=json.dumps({'channel': 'channel', 'message': 2}))
+        self.assertEqual(backend.poll(), 1)
+        Event.objects.create(pk=first, data=json.dumps({'channel': 'channel', 'message': 1}))
+        self.assertEqual(backend.poll(), 1)
+        self.assertEqual(backend.poll(), 0)
+        self.assertEqual(received, [2, 1])
+        self.assertEqual(backend.missing, {})
+
+
+class RecordingStream(io.BytesIO):
+    """A request body that notes whether each read happens inside a transaction."""
+    def __init__(self, data):
+        super().__init__(data)
+        self.in_transaction = []
+
+    def read(self, size=-1):
+        self.in_transaction.append(connections['default'].in_atomic_block)
+        return super().read(size)
+
+
+@override_settings(DATABASE_ROUTING={'REPLICAS': []})
+class ChunkedUploadTests(GraphQLClientMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings = self.settings(
+            MEDIA_ROOT=self.media_root,
+            UPLOADS={'CHUNK_SIZE': 4, 'TEMP_DIR': os.path.join(self.media_root, 'partial')},
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        create_posts(1)
+        self.review = Review.objects.first()
+        self.user = self.review.user_profile
+        self.session = create_session(self.user, 'notes.txt', 8)
+
+    def put(self, data, content_range):
+        return self.client.put(
+            '/uploads/%s' % self.session.pk, data, content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=content_range, HTTP_AUTHORIZATION='JWT ' + get_token(self.user),
+        )
+
+    def test_chunks_are_streamed_outside_the_session_lock(self):
+        stream = RecordingStream(b'abcd')
+        session = write_chunk(self.session.pk, self.user, stream, 'bytes 0-3/8', 4)
+        self.assertEqual(session.offset, 4)
+        self.assertIsNone(session.chunk_lease)
+        self.assertTrue(stream.in_transaction)
+        self.assertFalse(any(stream.in_transaction))
+
+    def test_a_chunk_waits_for_the_one_being_written(self):
+        UploadSession.objects.update(chunk_lease=timezone.now() + timedelta(seconds=60))
+        response = self.put(b'abcd', 'bytes 0-3/8')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], 0)
+        # A writer that outlived its lease no longer holds the session.
+        UploadSession.objects.update(chunk_lease=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.put(b'abcd', 'bytes 0-3/8').json()['offset'], 4)
+
+    def test_review_uploads_take_a_global_review_id(self):
+        self.put(b'abcd', 'bytes 0-3/8')
+        self.put(b'efgh', 'bytes 4-7/8')
+        headers = {'HTTP_AUTHORIZATION': 'JWT ' + get_token(self.user)}
+        body = json.dumps({'query': CREATE_REVIEW_UPLOAD, 'variables': {'review': str(self.review.pk), 'upload': str(self.session.pk)}})
+        with self.assertLogs('graphql.execution.utils', 'ERROR'):
+            errors = self.client.post('/graphql', body, content_type='application/json', **headers).json()['errors']
+        self.assertEqual(errors[0]['message'], 'Invalid ReviewType ID.')
+        variables = {'review': to_global_id('ReviewType', self.review.pk), 'upload': str(self.session.pk)}
+        data = self.query(CREATE_REVIEW_UPLOAD, variables, **headers)
+        self.assertEqual(data['createReviewUpload']['reviewUpload'], {'size': 8})
+
+
+def import_csv(kind, text, **kwargs):
+    return import_file(kind, io.BytesIO(text.encode()), 'csv', **kwargs)
+
+
+@override_settings(DATABASE_ROUTING={'REPLICAS': []})
+class RevisionTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings = self.settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        create_posts(1)
+        self.post = Post.objects.get()
+        self.author = self.post.user_profile
+
+    def revise(self, content, parent=None):
+        """Store ``content`` as a new upload, or as the next revision of ``parent``, like createPostUpload."""
+        upload = PostUpload(post=self.post, description='notes')
+        with transaction.atomic():
+            if parent is not None:
+                revisions.start_revision(upload, parent.pk)
+            attach_file(upload, self.author, file=SimpleUploadedFile('notes.txt', content))
+        return upload
+
+    def text(self, version):
+        return ''.join('line %d of version %d\n' % (i, version if i == 7 else 0) for i in range(50)).encode()
+
+    def compact(self, upload):
+        compacted = revisions.compact_revision('post', upload.pk)
+        upload.refresh_from_db()
+        return compacted
+
+    def test_a_revision_is_replaced_once(self):
+        first = self.revise(self.text(1))
+        second = self.revise(self.text(2), first)
+        with self.assertRaisesMessage(Exception, 'This upload already has a newer revision.'):
+            self.revise(self.text(3), first)
+        first.refresh_from_db()
+        self.assertEqual((first.sequence, first.latest, second.sequence, second.latest), (1, False, 2, True))
+        # A writer that read ``first`` before ``second`` committed is stopped by the unique parent.
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            PostUpload.objects.create(post=self.post, description='notes', parent=first, sequence=2)
+        self.assertEqual(list(PostUpload.objects.filter(parent=first)), [second])
+
+    def test_delta_round_trip(self):
+        chain = [self.revise(self.text(1))]
+        for version in (2, 3):
+            chain.append(self.revise(self.text(version), chain[-1]))
+        name = chain[0].file_upload.name
+        self.assertTrue(self.compact(chain[1]))
+        self.assertTrue(self.compact(chain[0]))
+        self.assertEqual(chain[0].file_upload.name, '')
+        self.assertLess(len(chain[0].delta), len(self.text(1)) / 2)
+        self.assertEqual(revisions.stored_name(chain[0]), name)
+        self.assertEqual(revisions.revision_content(chain[0]), self.text(1))
+        self.assertEqual(revisions.revision_content(chain[1]), self.text(2))
+        response = self.client.get('/uploads/post/%d/content' % chain[0].pk)
+        self.assertEqual(response.content, self.text(1))
+        # The latest revision and binary files stay files.
+        self.assertFalse(self.compact(chain[2]))
+        binary = self.revise(b'\0' * 200)
+        self.revise(b'\0' * 199, binary)
+        self.assertFalse(self.compact(binary))
+
+    def test_deleting_the_latest_revision_restores_its_parent(self):
+        first = self.revise(self.text(1))
+        second = self.revise(self.text(2), first)
+        self.compact(first)
+        with self.assertRaises(RestrictedError):
+            first.delete()
+        second.delete()
+        first.refresh_from_db()
+        self.assertTrue(first.latest)
+        self.assertIsNone(first.delta)
+        with first.file_upload.open('rb') as f:
+            self.assertEqual(f.read(), self.text(1))
+
+    def test_deleting_a_post_deletes_its_delta_chain(self):
+        chain = [self.revise(self.text(1))]
+        for version in (2, 3, 4):
+            chain.append(self.revise(self.text(version), chain[-1]))
+        for upload in chain[-2::-1]:
+            self.assertTrue(self.compact(upload))
+        self.post.delete()
+        self.assertFalse(PostUpload.objects.exists())
+        self.assertEqual(set(Blob.objects.values_list('refcount', flat=True)), {0})
+
+
+class ImportTests(TestCase):
+    def problems(self, report):
+        return [(line, field) for line, field, messages in report.errors]
+
+    def test_rows_are_validated(self):
+        report = import_csv('users', (
+            'email,name,address,research_interest\n'
+            'good@example.com,Good,,\n'
+            'not an email,Bad,,\n'
+            'partial@example.com,Partial,Somewhere,\n'
+        ))
+        self.assertEqual((report.created, report.failed), (1, 2))
+        self.assertEqual(self.problems(report), [(3, 'email'), (4, 'research_interest')])
+        self.assertEqual(list(UserProfile.objects.values_list('email', flat=True)), ['good@example.com'])
+
+    def test_duplicates_in_the_file_and_in_the_database(self):
+        UserProfile.objects.create_user('taken@example.com', 'Taken')
+        report = import_csv('users', (
+            'email,name\n'
+            'new@example.com,New\n'
+            'taken@example.com,Taken again\n'
+            'new@example.com,New again\n'
+        ), chunk_size=2)
+        self.assertEqual((report.created, report.failed), (1, 2))
+        self.assertEqual(self.problems(report), [(3, 'email'), (4, 'email')])
+        self.assertIn('Duplicate', report.errors[1][2][0])
+
+    def test_a_chunk_that_fails_to_write_is_rolled_back(self):
+        calls = []
+
+        def failing_second_profiles(model, objects, *args, **kwargs):
+            calls.append(model)
+            if calls.count(ProfileDetails) == 2:
+                raise IntegrityError('boom')
+            return bulk_insert(model, objects, *args, **kwargs)
+
+        rows = ''.join('user%d@example.com,User,Here,physics\n' % i for i in range(4))
+        with mock.patch('review.imports.bulk_insert', failing_second_profiles):
+            report = import_csv('users', 'email,name,address,research_interest\n' + rows, chunk_size=2)
+        self.assertEqual((report.created, report.failed), (2, 2))
+        self.assertEqual(self.problems(report), [(4, None), (5, None)])
+        self.assertEqual(
+            sorted(UserProfile.objects.values_list('email', flat=True)), ['user0@example.com', 'user1@example.com'],
+        )
+        self.assertEqual(ProfileDetails.objects.count(), 2)
+
+    def test_post_files_come_from_the_archive(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zipped:
+            zipped.writestr('slides/intro.txt', 'hello')
+        archive.seek(0)
+        UserProfile.objects.create_user('author@example.com', 'Author')
+        with self.settings(MEDIA_ROOT=media_root):
+            report = import_csv('posts', (
+                'author,title,type_of_submission,course_name,subject,description,file,file_description\n'
+                'author@example.com,Intro,EL,c,physics,d,slides/intro.txt,Slides\n'
+                'author@example.com,Missing,EL,c,physics,d,slides/missing.txt,Slides\n'
+            ), archive=archive)
+            self.assertEqual((report.created, report.failed), (1, 1))
+            self.assertEqual(self.problems(report), [(3, 'file')])
+            upload = PostUpload.objects.get()
+            self.assertEqual(upload.post.title, 'Intro')
+            with upload.file_upload.open('rb') as f:
+                self.assertEqual(f.read(), b'hello')
+
+
+@override_settings(DATABASE_ROUTING={'REPLICAS': []})
+class AdminImportTests(TransactionTestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings = self.settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.backend = tasks.DatabaseBackend()
+        patcher = mock.patch.object(tasks, '_backend', self.backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client.force_login(UserProfile.objects.create_superuser('admin@example.com', 'Admin', 'secret'))
+
+    def test_import_runs_on_the_task_queue(self):
+        upload = SimpleUploadedFile('users.csv', b'email,name\nnew@example.com,New\nbad,Bad\n')
+        response = self.client.post('/admin/review/post/import/', {'kind': 'users', 'file': upload})
+        job = ImportJob.objects.get()
+        self.assertRedirects(response, '/admin/review/post/import/%d/' % job.pk)
+        self.assertEqual(job.status, 'P')
+        self.assertFalse(UserProfile.objects.filter(email='new@example.com').exists())
+        self.assertContains(self.client.get(response.url), 'http-equiv="refresh"')
+
+        self.assertTrue(self.backend.run_next())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.created, job.failed, job.file.name), ('D', 1, 1, ''))
+        response = self.client.get('/admin/review/post/import/%d/' % job.pk)
+        self.assertContains(response, '1 rows imported, 1 rows failed.')
+        self.assertNotContains(response, 'http-equiv="refresh"')
+
+
+class StartupTests(SimpleTestCase):
+    def test_setup_keeps_heavy_modules_lazy(self):
+        modules = startup.profile_imports('setup', runs=1)['modules']
+        self.assertIn('django', modules)
+        self.assertEqual(startup.eager_imports(modules), [])
+
+
+class MetricsTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        override = self.settings(GRAPHQL_PROFILING={'METRICS_DIR': directory})
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_render_sums_the_counters_of_all_workers(self):
+        first, second = profiling.Metrics(), profiling.Metrics()
+        first.observe(0.02, False)
+        second.observe(0.2, True)
+        second.observe(0.2, False)
+        text = second.render()
+        self.assertIn('graphql_requests_total{status="error"} 1\n', text)
+        self.assertIn('graphql_requests_total{status="ok"} 2\n', text)
+        self.assertIn('graphql_request_duration_seconds_bucket{le="0.025"} 1\n', text)
+        self.assertIn('graphql_request_duration_seconds_count 3\n', text)
+
+    def test_render_writes_the_counters_observed_since_the_last_write(self):
+        worker, other = profiling.Metrics(), profiling.Metrics()
+        worker.observe(0.02, False)
+        # Within FLUSH_INTERVAL of the first write, so only kept in memory.
+        worker.observe(0.02, False)
+        self.assertIn('graphql_requests_total{status="ok"} 1\n', other.render())
+        self.assertIn('graphql_requests_total{status="ok"} 2\n', worker.render())
+        self.assertIn('graphql_requests_total{status="ok"} 2\n', other.render())
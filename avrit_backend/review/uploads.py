@@ -0,0 +1,233 @@
+"""Upload sessions, quotas and deduplicated storage for post and review files.
+
+A client opens an ``UploadSession`` for a file of known size, PUTs it to
+``/uploads/<id>`` in ``CHUNK_SIZE`` chunks (resuming from the session offset
+after a failure), then attaches the finished session to a ``PostUpload`` or
+``ReviewUpload``. Small files may instead be sent in one GraphQL multipart
+request. Identical content is stored once and shared by hash.
+"""
+import os
+import re
+import uuid
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from avrit_backend.uploads import ContentHasher, TemporaryFile, combine, uploads_setting
+from profiles_api.models import UserProfile
+from review.models import PostUpload, ReviewUpload, UploadSession
+
+READ_SIZE = 64 * 1024
+CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super(UploadError, self).__init__(message)
+        self.status = status
+
+
+def live_sessions(user):
+    """Sessions of ``user`` that still hold part of their quota."""
+    since = timezone.now() - timedelta(seconds=uploads_setting('SESSION_TIMEOUT'))
+    return UploadSession.objects.filter(user_profile=user, updated_at__gte=since)
+
+
+def used_bytes(user):
+    total = 0
+    for queryset in (
+        PostUpload.objects.filter(post__user_profile=user),
+        ReviewUpload.objects.filter(review__user_profile=user),
+        live_sessions(user),
+    ):
+        total += queryset.aggregate(total=Sum('size'))['total'] or 0
+    return total
+
+
+def check_quota(user, size):
+    """Check that ``user`` has room for ``size`` more bytes.
+
+    Call it in the transaction that stores the bytes: it locks the user's
+    row, so concurrent uploads of one user are checked one after another.
+    """
+    if size > uploads_setting('MAX_FILE_SIZE'):
+        raise UploadError('File is larger than the maximum upload size.', 413)
+    list(UserProfile.objects.select_for_update().filter(pk=user.pk).values_list('pk'))
+    if used_bytes(user) + size > uploads_setting('USER_QUOTA'):
+        raise UploadError('Upload quota exceeded.', 413)
+
+
+def create_session(user, filename, size):
+    if size < 0:
+        raise UploadError('Size must not be negative.')
+    with transaction.atomic():
+        check_quota(user, size)
+        return UploadSession.objects.create(user_profile=user, filename=os.path.basename(filename), size=size)
+
+
+def get_session(session_id, user, for_update=False):
+    try:
+        session_id = uuid.UUID(str(session_id))
+    except ValueError:
+        raise UploadError('Upload session not found.', 404)
+    queryset = live_sessions(user)
+    if for_update:
+        queryset = queryset.select_for_update()
+    session = queryset.filter(pk=session_id).first()
+    if session is None:
+        raise UploadError('Upload session not found.', 404)
+    return session
+
+
+def parse_content_range(header):
+    match = CONTENT_RANGE.match(header or '')
+    if match is None:
+        raise UploadError('A Content-Range header of the form "bytes start-end/size" is required.')
+    start, end, total = (int(value) for value in match.groups())
+    if end < start:
+        raise UploadError('Invalid Content-Range.')
+    return start, end, total
+
+
+def write_chunk(session_id, user, stream, content_range, content_length):
+    """Stream one chunk from ``stream`` into the session's file and hash it.
+
+    The session row is only locked to claim the chunk's offset and, once
+    the chunk is on disk, to move the offset past it; the claim keeps other
+    writers off the session for ``CHUNK_TIMEOUT`` seconds in between.
+    """
+    start, end, total = parse_content_range(content_range)
+    length = end - start + 1
+    chunk_size = uploads_setting('CHUNK_SIZE')
+    with transaction.atomic():
+        session = get_session(session_id, user, for_update=True)
+        if total != session.size or end >= session.size:
+            raise UploadError('Content-Range does not match the upload size.')
+        if start != session.offset:
+            raise UploadError('Chunk does not start at the upload offset.', 409)
+        if content_length != length:
+            raise UploadError('Content-Length does not match Content-Range.')
+        if end + 1 != session.size and length % chunk_size:
+            raise UploadError('Chunks must be a multiple of %d bytes.' % chunk_size)
+        now = timezone.now()
+        if session.chunk_lease is not None and session.chunk_lease > now:
+            raise UploadError('Another chunk of this upload is being written.', 409)
+        lease = now + timedelta(seconds=uploads_setting('CHUNK_TIMEOUT'))
+        session.chunk_lease = lease
+        session.save(update_fields=['chunk_lease'])
+
+    hasher = ContentHasher(chunk_size)
+    path = session.temp_path()
+    try:
+        with open(path, 'r+b' if os.path.exists(path) else 'w+b') as partial:
+            partial.seek(start)
+            partial.truncate()
+            remaining = length
+            while remaining:
+                data = stream.read(min(READ_SIZE, remaining))
+                if not data:
+                    break
+                partial.write(data)
+                hasher.update(data)
+                remaining -= len(data)
+            if remaining:
+                partial.truncate(start)
+                raise UploadError('Chunk ended before Content-Length bytes were received.')
+    except BaseException:
+        UploadSession.objects.filter(pk=session.pk, chunk_lease=lease).update(chunk_lease=None)
+        raise
+
+    with transaction.atomic():
+        session = get_session(session_id, user, for_update=True)
+        if session.chunk_lease != lease:
+            raise UploadError('The chunk took longer than %d seconds; send it again.' % uploads_setting('CHUNK_TIMEOUT'), 409)
+        session.offset = end + 1
+        session.block_hashes += hasher.finish()
+        session.chunk_lease = None
+        session.save(update_fields=['offset', 'block_hashes', 'chunk_lease', 'updated_at'])
+    return session
+
+
+def hash_file(file):
+    hasher = ContentHasher()
+    for data in file.chunks():
+        hasher.update(data)
+    return hasher.hexdigest()
+
+
+def find_stored(content_hash):
+    """The storage name of a file already uploaded with ``content_hash``, if any."""
+    for model in (PostUpload, ReviewUpload):
+        name = (
+            model.objects.filter(content_hash=content_hash)
+            .exclude(file_upload='')
+            .values_list('file_upload', flat=True)
+            .first()
+        )
+        if name:
+            return name
+    return None
+
+
+def store_file(upload, content, name, content_hash, size):
+    """Point ``upload`` at the stored copy of ``content_hash``, or store ``content`` under ``name``."""
+    upload.content_hash = content_hash
+    upload.size = size
+    existing = find_stored(content_hash)
+    if existing:
+        upload.file_upload.name = existing
+    else:
+        content.content_hash = content_hash
+        upload.file_upload.save(os.path.basename(name), content, save=False)
+
+
+def attach_file(upload, user, file=None, upload_id=None):
+    """Store the file of an unsaved ``PostUpload`` or ``ReviewUpload`` and save it.
+
+    The file is either an uploaded ``file`` or a finished upload session.
+    """
+    if file is not None and upload_id is not None:
+        raise UploadError('Provide either a file or an uploadId, not both.')
+    if file is None and upload_id is None:
+        raise UploadError('No file was received; it may exceed the maximum upload size.')
+    if file is not None:
+        content_hash = getattr(file, 'content_hash', None) or hash_file(file)
+        with transaction.atomic():
+            check_quota(user, file.size)
+            store_file(upload, file, file.name, content_hash, file.size)
+            upload.save()
+        return upload
+
+    with transaction.atomic():
+        session = get_session(upload_id, user, for_update=True)
+        if not session.complete:
+            raise UploadError('Upload is not complete.', 409)
+        path = session.temp_path()
+        if not os.path.exists(path):
+            open(path, 'wb').close()
+        content = TemporaryFile(path, session.filename)
+        try:
+            store_file(upload, content, session.filename, combine(session.block_hashes), session.size)
+            upload.save()
+        finally:
+            content.close()
+        session.delete()
+    if os.path.exists(path):
+        os.remove(path)
+    return upload
+
+
+def clear_expired_sessions():
+    """Delete abandoned upload sessions and their partial files."""
+    since = timezone.now() - timedelta(seconds=uploads_setting('SESSION_TIMEOUT'))
+    expired = UploadSession.objects.filter(updated_at__lt=since)
+    count = 0
+    for session in expired.iterator():
+        path = session.temp_path()
+        if os.path.exists(path):
+            os.remove(path)
+        session.delete()
+        count += 1
+    return count
@@ -1,3 +1,130 @@
-from django.shortcuts import render
+from django.http import (
+    Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotModified, HttpResponseRedirect,
+    JsonResponse, StreamingHttpResponse,
+)
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.crypto import constant_time_compare
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods, require_safe
 
-# Create your views here.
+from avrit_backend.auth import get_request_user
+from avrit_backend.media import not_modified
+from review.access import can_view_upload
+from review.export import FORMATS, RESOURCES, export_chunks, export_setting, parse_watermark
+from review.revisions import KINDS, content_type, revision_content
+from review.uploads import UploadError, get_session, write_chunk
+
+
+def _session_status(session):
+    return {
+        'id': str(session.pk),
+        'size': session.size,
+        'offset': session.offset,
+        'complete': session.complete,
+    }
+
+
+@csrf_exempt
+@require_http_methods(['GET', 'HEAD', 'PUT'])
+def upload_chunk(request, session_id):
+    """Receive one chunk of an upload session, or report how much has arrived.
+
+    Chunks are sent with ``PUT`` and a ``Content-Range: bytes start-end/size``
+    header, in order, each a multiple of the session's chunk size except the
+    last. After a failure, ``GET`` returns the offset to resume from.
+    """
+    user = get_request_user(request)
+    if user is None:
+        return JsonResponse({'error': 'Not logged in!'}, status=401)
+
+    try:
+        if request.method == 'PUT':
+            session = write_chunk(
+                session_id,
+                user,
+                request,
+                request.META.get('HTTP_CONTENT_RANGE'),
+                int(request.META.get('CONTENT_LENGTH') or 0),
+            )
+        else:
+            session = get_session(session_id, user)
+    except UploadError as e:
+        body = {'error': str(e)}
+        if e.status == 409:
+            body.update(_session_status(get_session(session_id, user)))
+        return JsonResponse(body, status=e.status)
+    return JsonResponse(_session_status(session))
+
+
+def _may_export(request):
+    token = export_setting('TOKEN')
+    if token and constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer ' + token):
+        return True
+    user = get_request_user(request)
+    return user is not None and user.is_staff
+
+
+@require_safe
+def export(request, resource, fmt):
+    """Stream every row of ``resource`` updated between ``?since=`` and ``?until=`` as NDJSON or CSV.
+
+    Open to staff users and to ``Bearer`` requests with ``EXPORT['TOKEN']``.
+    Pass the ``X-Export-Watermark`` response header as ``since`` on the next
+    call to get only what changed. The body is gzipped when the client
+    accepts it.
+    """
+    if resource not in RESOURCES or fmt not in FORMATS:
+        raise Http404('Unknown export.')
+    if not _may_export(request):
+        return HttpResponseForbidden()
+    try:
+        since = parse_watermark(request.GET.get('since'))
+        until = parse_watermark(request.GET.get('until')) or timezone.now()
+    except Exception as e:
+        return HttpResponseBadRequest(str(e))
+    compress = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+
+    response = StreamingHttpResponse(export_chunks(resource, fmt, since, until, compress), content_type=FORMATS[fmt])
+    response['X-Export-Watermark'] = until.isoformat()
+    response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (resource, fmt)
+    response['Cache-Control'] = 'no-store'
+    if compress:
+        response['Content-Encoding'] = 'gzip'
+    patch_vary_headers(response, ('Accept-Encoding', 'Authorization'))
+    return response
+
+
+@require_safe
+def upload_content(request, kind, pk):
+    """Download one revision of a post or review upload.
+
+    Revisions stored as files redirect to the media URL. Those stored as a
+    delta are rebuilt from the newer revisions, for those who may see the
+    upload (see ``review.access``).
+    """
+    if kind not in KINDS:
+        raise Http404('Unknown upload.')
+    upload = KINDS[kind].objects.filter(pk=pk).first()
+    if upload is None:
+        raise Http404('Upload not found.')
+    if upload.delta is None:
+        if not upload.file_upload:
+            raise Http404('Upload has no file.')
+        return HttpResponseRedirect(upload.file_upload.url)
+
+    if not can_view_upload(get_request_user(request), upload):
+        return HttpResponseForbidden()
+    # A revision never changes, so its content hash is a strong validator.
+    etag = quote_etag(upload.content_hash)
+    mtime = upload.created_at.timestamp()
+    if not_modified(request, etag, mtime):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(revision_content(upload), content_type=content_type(upload))
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(mtime)
+    response['Cache-Control'] = 'private, no-cache'
+    response['Vary'] = 'Cookie, Authorization'
+    return response